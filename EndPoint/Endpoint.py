@@ -1,37 +1,78 @@
 import sys
 import os
+import time
+import logging
+import importlib
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+
+_started = time.perf_counter()
 from util.config import app, uvicorn
-from safarai_realtime.backend import realtime
-from audio_book import audio_book_router as audio_book_router
-from text_to_speech import text_to_speech_router as text_to_speech_router
-from translation import translation_router as translation_router
-from correction import correction_router as correction_router
-from chatbot import chatbot_router as chatbot_router
-from new_chatbot import new_chatbot_router
-from util.del_speech_files import del_speech_files_router as del_speech_files_router
+from util.metrics import metrics_router
+_config_seconds = time.perf_counter() - _started
+
+# Every router this service can serve, in include order: name -> (module, router attribute).
+# Set AI_ENGINE_ROUTERS to a comma-separated subset (e.g. "translation" or
+# "text_to_speech,del_speech_files") to run a worker that only imports what it serves.
+ROUTERS = {
+    "new_chatbot": ("new_chatbot", "new_chatbot_router"),
+    "realtime": ("safarai_realtime.backend", "realtime"),
+    "audio_book": ("audio_book", "audio_book_router"),
+    "text_to_speech": ("text_to_speech", "text_to_speech_router"),
+    "translation": ("translation", "translation_router"),
+    "correction": ("correction", "correction_router"),
+    "correction_jobs": ("correction_jobs", "correction_jobs_router"),
+    "chatbot": ("chatbot", "chatbot_router"),
+    "del_speech_files": ("util.del_speech_files", "del_speech_files_router"),
+    "prompts": ("prompts", "prompts_router"),
+    "admin": ("admin", "admin_router"),
+}
+
+
+def enabled_routers() -> list[str]:
+    selected = os.getenv("AI_ENGINE_ROUTERS", "").strip()
+    if not selected or selected == "all":
+        return list(ROUTERS)
+    names = [name.strip() for name in selected.split(",") if name.strip()]
+    unknown = [name for name in names if name not in ROUTERS]
+    if unknown:
+        raise ValueError(f"Unknown routers in AI_ENGINE_ROUTERS: {', '.join(unknown)} (available: {', '.join(ROUTERS)})")
+    return [name for name in ROUTERS if name in names]
+
+
+def include_routers() -> list[dict]:
+    """
+    Import and include the enabled routers, timing each import.
+    Returns:
+        list[dict]: Import-time profile, one entry per module, slowest first.
+    """
+    profile = [{"module": "util.config", "seconds": round(_config_seconds, 4)}]
+    for name in enabled_routers():
+        module_name, attribute = ROUTERS[name]
+        started = time.perf_counter()
+        module = importlib.import_module(module_name)
+        profile.append({"module": module_name, "router": name, "seconds": round(time.perf_counter() - started, 4)})
+        app.include_router(getattr(module, attribute))
+    profile.sort(key=lambda entry: entry["seconds"], reverse=True)
+    total = sum(entry["seconds"] for entry in profile)
+    logging.info(f"Imported {len(profile) - 1} routers in {total:.3f}s: " + ", ".join(f"{e['module']}={e['seconds']:.3f}s" for e in profile))
+    return profile
 
 
 @app.get("/")
 def read_root():
     return {"Hello": "World"}
-app.include_router(new_chatbot_router)
-
-app.include_router(realtime)
 
-app.include_router(audio_book_router)
 
-app.include_router(text_to_speech_router)
+app.state.import_profile = include_routers()
+app.include_router(metrics_router)
 
-app.include_router(translation_router)
 
-app.include_router(correction_router)
+@app.get("/debug/import-profile")
+def import_profile():
+    """Seconds spent importing each router module at startup (slowest first)."""
+    profile = app.state.import_profile
+    return {"total_seconds": round(sum(entry["seconds"] for entry in profile), 4), "modules": profile}
 
-app.include_router(chatbot_router)
 
-app.include_router(del_speech_files_router)
-    
 if __name__ == "__main__":
     uvicorn.run("Endpoint:app", host = "0.0.0.0", port = 9999, reload=True)
-
-
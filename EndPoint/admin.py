@@ -0,0 +1,69 @@
+import os
+import hmac
+import asyncio
+import threading
+from fastapi import Depends, Header, Query
+from fastapi.responses import PlainTextResponse
+from util.config import APIRouter, HTTPException
+from util.profiler import profiler, collapsed, ProfilerBusy, PROFILE_MAX_SECONDS
+from util import tracing
+from util.glossary import glossary, normalize_term
+
+# Admin endpoints are disabled unless ADMIN_TOKEN is set; callers send it in X-Admin-Token.
+ADMIN_TOKEN = os.getenv("ADMIN_TOKEN", "")
+
+
+def require_admin(x_admin_token: str = Header(default="")):
+    if not ADMIN_TOKEN:
+        raise HTTPException(status_code=403, detail="Admin endpoints are disabled; set ADMIN_TOKEN to enable them")
+    if not hmac.compare_digest(x_admin_token.encode(), ADMIN_TOKEN.encode()):
+        raise HTTPException(status_code=401, detail="Invalid admin token")
+
+
+admin_router = APIRouter(tags=["admin"], prefix="/admin", dependencies=[Depends(require_admin)])
+
+
+@admin_router.get("/profile", response_class=PlainTextResponse)
+async def profile(
+    seconds: float = Query(10, gt=0, le=PROFILE_MAX_SECONDS),
+    interval_ms: float = Query(5, ge=1, le=1000),
+    all_threads: bool = False,
+):
+    """
+    Sample this worker's stacks for `seconds` and return them as collapsed stacks
+    ("frame;frame;... count" per line), ready for flamegraph.pl or speedscope.
+    By default only the event loop thread is sampled; all_threads=true adds the
+    worker threads (asyncio.to_thread, SQLite, the LangChain client). Time the
+    loop spends waiting for I/O shows up as the event loop's own frames.
+    """
+    loop_thread = threading.get_ident()
+    try:
+        stacks, rounds = await asyncio.to_thread(
+            profiler.run, seconds, interval_ms / 1000, None if all_threads else {loop_thread}
+        )
+    except ProfilerBusy as e:
+        raise HTTPException(status_code=409, detail=str(e))
+    return PlainTextResponse(collapsed(stacks), headers={"X-Profile-Samples": str(rounds)})
+
+
+@admin_router.get("/traces/slow")
+async def slow_traces(limit: int = Query(20, ge=1, le=tracing.TRACE_SLOW_KEEP)):
+    """The most recent requests slower than TRACE_SLOW_SECONDS, newest first, with their span breakdown."""
+    traces = list(tracing.slow_traces)[-limit:]
+    return {"threshold_seconds": tracing.TRACE_SLOW_SECONDS, "traces": traces[::-1]}
+
+
+@admin_router.delete("/glossary/{term}")
+async def purge_glossary_term(term: str):
+    """Stop serving a glossary answer, learned or seed, in every worker (within GLOSSARY_REFRESH_SECONDS)."""
+    term = normalize_term(term)
+    await glossary.purge(term)
+    return {"purged": term}
+
+
+@admin_router.delete("/glossary")
+async def purge_learned_glossary():
+    """Drop every learned glossary entry, keeping the seed entries."""
+    if not await glossary.purge_learned():
+        raise HTTPException(status_code=409, detail="Glossary is being rebuilt by another worker; retry shortly")
+    return {"index_entries": glossary.snapshot()["index_entries"]}
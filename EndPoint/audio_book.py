@@ -1,40 +1,76 @@
-from util.config import client, cls, Path, HTTPException, APIRouter
-from util.audio_model import audio_model
+import asyncio
+from util.config import cls, HTTPException, APIRouter, Response, StreamingResponse
+from util.audio_book_pipeline import AudioBookPipeline
+from util.complition_model import http_error
+from util.prompts import prompt_registry, prompt_registry_lifespan
+from util.tracing import span
 
-audio_book_router = APIRouter(tags=["audio-book"])
+audio_book_router = APIRouter(tags=["audio-book"], lifespan=prompt_registry_lifespan)
 
-@audio_book_router.post("/audio-book", response_model=cls.AduioBookResponse)
-async def audio_book(request: cls.AduioBookRequest):
-    try:
-        audio_book_path = Path(__file__).parent.parent/ "config" / "audiobook_prompt.txt"
-        with open(audio_book_path, "r", encoding="utf-8") as file:
-            audio_book_prompt = file.read()
-
-        audio_book_tts_path = Path(__file__).parent.parent/ "config" / "audiobook_TTS_prompt.txt"
-        with open(audio_book_tts_path, "r", encoding="utf-8") as file:
-            audio_book_tts_prompt = file.read()
 
-        text_response = await client.responses.create(
+def audio_book_pipeline(request: cls.AduioBookRequest) -> AudioBookPipeline:
+    with span("prompt.build"):
+        return AudioBookPipeline(
             model="gpt-4.1",
-            instructions = audio_book_prompt,
+            instructions = prompt_registry.text("audiobook_prompt"),
             input=request.text,
             max_output_tokens=2000,
             temperature=0.5,
-        )
-
-        speech_file_path = Path(__file__).parent.parent/ "speechfiles" / f"audio-book_{request.id}.mp3"
-        await audio_model(
-            model="gpt-4o-mini-tts",
+            tts_model="gpt-4o-mini-tts",
             voice="nova",
-            instructions = audio_book_tts_prompt,
-            input=text_response.output_text,
-            speech_file_path=speech_file_path
+            tts_instructions = prompt_registry.text("audiobook_TTS_prompt"),
         )
-            
+
+
+@audio_book_router.post("/audio-book", response_model=cls.AduioBookResponse)
+async def audio_book(request: cls.AduioBookRequest, response: Response):
+    try:
+        pipeline = audio_book_pipeline(request)
+        response.headers["X-Prompt-Version"] = prompt_registry.version_header("audiobook_prompt", "audiobook_TTS_prompt")
+        speech_file_path = await pipeline.build()
+
         return cls.AduioBookResponse(
             message="Audio book created successfully",
-            text=text_response.output_text,
+            text=pipeline.text,
             file_path=str(speech_file_path)
         )
     except Exception as e:
-        raise HTTPException(status_code = 500, detail = str(e))
\ No newline at end of file
+        raise http_error(e)
+
+
+@audio_book_router.post("/audio-book/stream")
+async def audio_book_stream(request: cls.AduioBookRequest):
+    """
+    Stream the narrated story as audio/mpeg, one segment at a time in story order.
+    Playback can start as soon as the first few sentences are written and narrated.
+    """
+    try:
+        pipeline = audio_book_pipeline(request)
+        segment_files = pipeline.segment_files()
+        # Wait for the first segment here so generation failures still become a 500.
+        first_segment = await anext(segment_files)
+
+        async def read_segment(path):
+            with span("mp3.read"):
+                return await asyncio.to_thread(path.read_bytes)
+
+        async def generate_audio():
+            try:
+                yield await read_segment(first_segment)
+                async for segment in segment_files:
+                    yield await read_segment(segment)
+            finally:
+                await segment_files.aclose()
+
+        return StreamingResponse(
+            generate_audio(),
+            media_type="audio/mpeg",
+            headers={
+                "Cache-Control": "no-cache",
+                "X-Prompt-Version": prompt_registry.version_header("audiobook_prompt", "audiobook_TTS_prompt"),
+            }
+        )
+    except StopAsyncIteration:
+        raise HTTPException(status_code = 500, detail = "The story model returned no text")
+    except Exception as e:
+        raise http_error(e)
@@ -1,8 +1,37 @@
-from util.config import cls, HTTPException, APIRouter, stream_response, system_prompt, StreamingResponse
-from langchain_core.messages import HumanMessage, AIMessage
-import json
+from util.config import cls, HTTPException, APIRouter, Response, StreamingResponse
+from util.sse import sse_event, with_heartbeat, SSE_HEADERS
+from util import metrics
+from util.glossary import glossary, glossary_term
+from util.tokens import preload_encoding
+from safarai_chatbot.chatbot.chatbot import astream_response, system_prompt, get_chat
+from safarai_chatbot.chatbot.history import history_manager
+from langchain_core.messages import HumanMessage, AIMessage, SystemMessage
+from contextlib import asynccontextmanager
+import asyncio
 
-chatbot_router = APIRouter(tags=["chatbot"])
+
+@asynccontextmanager
+async def chatbot_lifespan(app):
+    # Build the LangChain client in the background so startup does not wait for it.
+    warmup = asyncio.create_task(asyncio.to_thread(get_chat))
+    # History compaction counts tokens; do not load the tokenizer on the event loop.
+    await preload_encoding()
+    await glossary.start()
+    yield
+    await glossary.stop()
+    if not warmup.done():
+        warmup.cancel()
+
+
+chatbot_router = APIRouter(tags=["chatbot"], lifespan=chatbot_lifespan)
+
+
+def asks_question(history: list) -> bool:
+    """Whether the assistant's last turn was a question; a one-word message is then an answer, not a term to look up."""
+    for msg in reversed(history):
+        if msg.get("role") == "assistant":
+            return str(msg.get("content", "")).rstrip().endswith(("?", "؟"))
+    return False
 
 # #@chatbot_router.post("/chatbot", response_model=cls.ChatbotResponse)
 # async def chatbot_chat(request: cls.ChatbotRequest):
@@ -43,6 +72,21 @@ chatbot_router = APIRouter(tags=["chatbot"])
 #         raise HTTPException(status_code=500, detail=str(e))
 
 # Chatbot streaming endpoint
+async def define(term: str) -> str:
+    """The assistant's answer to term alone, without the student's conversation, for the glossary."""
+    model = get_chat().model_name
+    with metrics.UpstreamTimer("chat.completions", model):
+        response = await get_chat().ainvoke([system_prompt, HumanMessage(content=term)])
+    if response.usage_metadata:
+        usage = response.usage_metadata
+        metrics.record_usage(model, {
+            "input_tokens": usage.get("input_tokens"),
+            "cached_tokens": (usage.get("input_token_details") or {}).get("cache_read"),
+            "output_tokens": usage.get("output_tokens"),
+        })
+    return response.content
+
+
 @chatbot_router.post("/chatbot/stream")
 async def chatbot_stream(request: cls.ChatbotRequest):
     """
@@ -50,11 +94,27 @@ async def chatbot_stream(request: cls.ChatbotRequest):
     Returns a streaming response for real-time chat experience.
     """
     try:
+        # Single words and short phrases are answered from the glossary when it has them
+        term = None if asks_question(request.conversation_history) else glossary_term(request.message)
+        answer = glossary.lookup(term) if term else None
+        if answer is not None:
+            # The whole stream is known up front; send it as one body rather than a threadpool-drained iterator
+            return Response(
+                sse_event({'content': answer, 'done': False}) + sse_event({'content': '', 'done': True}),
+                media_type="text/event-stream",
+                headers=SSE_HEADERS
+            )
+
         # Build conversation history with system prompt
         messages = [system_prompt]
+
+        # Keep the replayed history within the token budget; older turns arrive as a summary
+        summary, recent_history = await history_manager.compact(request.conversation_history)
+        if summary:
+            messages.append(SystemMessage(content=f"Summary of the earlier conversation:\n{summary}"))
         
         # Add conversation history if provided
-        for msg in request.conversation_history:
+        for msg in recent_history:
             if msg.get("role") == "user":
                 messages.append(HumanMessage(content=msg.get("content", "")))
             elif msg.get("role") == "assistant":
@@ -63,21 +123,39 @@ async def chatbot_stream(request: cls.ChatbotRequest):
         # Add current user message
         messages.append(HumanMessage(content=request.message))
         
-        def generate_stream():
+        async def generate_stream():
+            model = get_chat().model_name
+            reply = []
             try:
-                for chunk in stream_response(messages):
-                    if chunk.content:
-                        # Format as Server-Sent Events
-                        yield f"data: {json.dumps({'content': chunk.content, 'done': False})}\n\n"
+                with metrics.UpstreamTimer("chat.completions.stream", model) as timer:
+                    async for chunk in astream_response(messages):
+                        if chunk.usage_metadata:
+                            usage = chunk.usage_metadata
+                            metrics.record_usage(model, {
+                                "input_tokens": usage.get("input_tokens"),
+                                "cached_tokens": (usage.get("input_token_details") or {}).get("cache_read"),
+                                "output_tokens": usage.get("output_tokens"),
+                            })
+                        if chunk.content:
+                            timer.first_token()
+                            if term:
+                                reply.append(chunk.content)
+                            # Format as Server-Sent Events
+                            yield sse_event({'content': chunk.content, 'done': False})
                 # Send completion signal
-                yield f"data: {json.dumps({'content': '', 'done': True})}\n\n"
+                yield sse_event({'content': '', 'done': True})
+                if term and not request.conversation_history:
+                    # System prompt and the message only, so the reply can be learned as is
+                    await glossary.learn(term, "".join(reply))
+                elif term:
+                    glossary.backfill(term, lambda: define(term))
             except Exception as e:
-                yield f"data: {json.dumps({'error': str(e), 'done': True})}\n\n"
+                yield sse_event({'error': str(e), 'done': True})
         
         return StreamingResponse(
-            generate_stream(),
-            media_type="text/plain",
-            headers={"Cache-Control": "no-cache", "Connection": "keep-alive"}
+            with_heartbeat(generate_stream()),
+            media_type="text/event-stream",
+            headers=SSE_HEADERS
         )
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -1,27 +1,28 @@
-from util.config import client, cls, Path, HTTPException, APIRouter, prs
-from util.complition_model import complition_model
+import logging
+from functools import lru_cache
+from util.config import cls, HTTPException, APIRouter, Response, StreamingResponse, prs
+from util.complition_model import complition_model, complition_model_stream, usage_tokens, http_error
+from util.json_stream import JsonStreamParser
+from util.prompts import prompt_registry, prompt_registry_lifespan
+from util.sse import sse_event, with_heartbeat, SSE_HEADERS
+from util.tracing import span
 
-correction_router = APIRouter(tags=["correction"])
+correction_router = APIRouter(tags=["correction"], lifespan=prompt_registry_lifespan)
 
-@correction_router.post("/correction", response_model=cls.CorrectionResponse)
-async def get_correction(request: cls.CorrectionRequest):
-    try:
-        criteria_path = Path(__file__).parent.parent / "config" / "activitywritingcriteria.txt"
-        example_path = Path(__file__).parent.parent / "config" / "writingexamples.txt"
-                # read the criteria from the file
-        with open(criteria_path, "r", encoding="utf-8") as file:
-            # read the file content
-            criteria = file.read()
-        with open(example_path, "r", encoding="utf-8") as file:
-            # read the file content
-            examples = file.read()
-        instructions = f"""
+CORRECTION_MODEL = "gpt-4o"
+
+@lru_cache(maxsize=8)
+def correction_instructions(criteria: str, examples: str) -> str:
+    """
+    Build the static grading instructions (rubric, scoring rules, examples).
+    Nothing request-specific goes in here, so every /correction call sends a
+    byte-identical prefix and the provider's prompt cache can reuse it.
+    """
+    return f"""
                 You are a professional writing correction assistant.
                 You should be strict with the evaluation.
-                Your task is to evaluate a user's written response based on:
-
-                The given question: 
-                {request.question}
+                Your task is to evaluate a user's written response to the given question.
+                The question and the user's response are provided in the input.
 
                 The evaluation criteria: 
                 {criteria}
@@ -57,29 +58,138 @@ async def get_correction(request: cls.CorrectionRequest):
                 ##Example##
                 {examples}"""
 
-            
-        response = await complition_model(
-            model = "gpt-4o",
-            instructions = instructions,
-            input = request.text
-        )
-        # Parse the response to extract JSON
-        response_data = prs.extract_json_from_response(response, header="score:")
-        
-        # Safely convert score to int
-        score = response_data.get("score", 0)
-        if isinstance(score, str):
-            try:
-                score = int(score)
-            except ValueError:
-                score = 0
-        
-        # Get feedback safely
-        feedback = response_data.get("feedback", "No feedback available")
-        
-        return cls.CorrectionResponse(
-            score=score,
-            feedback=feedback
+
+def correction_input(question: str, text: str) -> str:
+    """The per-request part of the prompt: the question and the user's answer."""
+    return f"""The given question:
+{question}
+
+The user's written response:
+{text}"""
+
+
+def correction_request(question: str, text: str) -> dict:
+    """complition_model arguments for grading one answer (also the body of a Batch API line)."""
+    with span("prompt.build"):
+        criteria = prompt_registry.text("activitywritingcriteria")
+        examples = prompt_registry.text("writingexamples")
+        return dict(
+            model = CORRECTION_MODEL,
+            instructions = correction_instructions(criteria, examples),
+            input = correction_input(question, text),
+            prompt_cache_key = "correction",
+            text_format = prs.json_schema_format(cls.CorrectionResponse)
         )
+
+
+# Appended to the per-request input, so the cached instruction prefix is the same as /correction's.
+PER_CRITERION_OUTPUT = """
+
+Report each of the five criteria separately in "criteria", in the order listed, with its score (0, 1, 3 or 5) and feedback, then the total "score"."""
+
+
+def parse_correction(response) -> cls.CorrectionResponse:
+    try:
+        # Structured output validates straight into the model.
+        return prs.parse_model(response, cls.CorrectionResponse)
+    except ValueError:
+        pass
+    # Parse the response to extract JSON
+    response_data = prs.extract_json_from_response(response, header="score:")
+
+    # Safely convert score to int
+    score = response_data.get("score", 0)
+    if isinstance(score, str):
+        try:
+            score = int(score)
+        except ValueError:
+            score = 0
+
+    # Get feedback safely
+    feedback = response_data.get("feedback", "No feedback available")
+
+    return cls.CorrectionResponse(
+        score=score,
+        feedback=feedback
+    )
+
+
+async def grade(question: str, text: str, deadline: float = None) -> tuple[cls.CorrectionResponse, dict]:
+    """
+    Grade one written answer.
+    Returns:
+        tuple: The CorrectionResponse and the token usage of the call (see usage_tokens).
+    """
+    response = await complition_model(**correction_request(question, text), deadline=deadline)
+    usage = usage_tokens(response)
+    logging.info(f"Correction usage: {usage['input_tokens']} input tokens ({usage['cached_tokens']} cached), {usage['output_tokens']} output tokens")
+    with span("parse"):
+        return parse_correction(response), usage
+
+
+@correction_router.post("/correction", response_model=cls.CorrectionResponse)
+async def get_correction(request: cls.CorrectionRequest, http_response: Response):
+    try:
+        http_response.headers["X-Prompt-Version"] = prompt_registry.version_header("activitywritingcriteria", "writingexamples")
+        correction, usage = await grade(request.question, request.text)
+        http_response.headers["X-Cached-Tokens"] = str(usage["cached_tokens"])
+        return correction
     except Exception as e:
-        raise HTTPException(status_code = 500, detail = str(e))
\ No newline at end of file
+        raise http_error(e)
+
+
+@correction_router.post("/correction/stream")
+async def stream_correction(request: cls.CorrectionRequest):
+    """
+    Stream the evaluation as Server-Sent Events while the model writes it.
+    Each criterion arrives as {"criterion": {"criterion", "score", "feedback"}, "done": false}
+    as soon as it is complete; the last event is {"result": CorrectionResponse, "criteria": [...], "done": true}.
+    """
+    try:
+        params = correction_request(request.question, request.text)
+        params["input"] += PER_CRITERION_OUTPUT
+        params["text_format"] = prs.json_schema_format(cls.CorrectionStreamOutput)
+        deltas = complition_model_stream(**params)
+        # Wait for the first delta here so upstream failures still become an HTTP error.
+        first_delta = await anext(deltas)
+    except StopAsyncIteration:
+        raise HTTPException(status_code = 500, detail = "The correction model returned no text")
+    except Exception as e:
+        raise http_error(e)
+
+    async def generate_events():
+        parser = JsonStreamParser()
+        criteria = []
+        try:
+            delta = first_delta
+            while True:
+                with span("parse"):
+                    completed = parser.feed(delta)
+                for key, value in completed:
+                    if key == "criteria":
+                        criterion = cls.CorrectionCriterion.model_validate(value)
+                        criteria.append(criterion)
+                        yield sse_event({"criterion": criterion.model_dump(), "done": False})
+                try:
+                    delta = await anext(deltas)
+                except StopAsyncIteration:
+                    break
+            if parser.result is not None:
+                output = cls.CorrectionStreamOutput.model_validate(parser.result)
+            else:
+                output = cls.CorrectionStreamOutput(criteria=criteria, score=sum(c.score for c in criteria))
+            correction = cls.CorrectionResponse(
+                score=output.score,
+                feedback=" ".join(f"{c.criterion}: {c.feedback}" for c in output.criteria)
+            )
+            yield sse_event({"result": correction.model_dump(), "criteria": [c.model_dump() for c in output.criteria], "done": True})
+        except Exception as e:
+            yield sse_event({"error": str(e), "done": True})
+        finally:
+            await deltas.aclose()
+
+    return StreamingResponse(
+        with_heartbeat(generate_events()),
+        media_type="text/event-stream",
+        headers={**SSE_HEADERS, "X-Prompt-Version": prompt_registry.version_header("activitywritingcriteria", "writingexamples")}
+    )
@@ -0,0 +1,489 @@
+import sys
+import os
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
+import json
+import time
+import uuid
+import asyncio
+import logging
+import argparse
+from contextlib import asynccontextmanager
+from dataclasses import dataclass, asdict, field
+from pathlib import Path
+from typing import Iterator
+from fastapi.responses import FileResponse
+from util.config import cls, HTTPException, APIRouter
+from util.prompts import prompt_registry, prompt_registry_lifespan
+from correction import grade, correction_request
+
+try:
+    import fcntl
+except ImportError:  # Windows: jobs are not locked across worker processes
+    fcntl = None
+
+CORRECTION_JOBS_DIR = Path(os.getenv("CORRECTION_JOBS_DIR", str(Path(__file__).parent.parent / "correction_jobs")))
+CORRECTION_JOB_CONCURRENCY = int(os.getenv("CORRECTION_JOB_CONCURRENCY", "8"))
+# Essays are long; give each one more time (retries included) than an interactive call.
+CORRECTION_JOB_DEADLINE = float(os.getenv("CORRECTION_JOB_DEADLINE", "300"))
+# The Batch API accepts at most 50,000 requests per input file.
+BATCH_FILE_MAX_LINES = 50000
+CHECKPOINT_EVERY = 50
+CHECKPOINT_SECONDS = 5
+# How often a running job looks for a cancel request from another worker.
+CANCEL_POLL_SECONDS = 2
+# Input lines read and parsed per worker-thread call while a job runs.
+READ_BATCH_LINES = 500
+
+
+@dataclass
+class JobItem:
+    line: int
+    id: str
+    question: str = ""
+    text: str = ""
+    error: str | None = None
+
+
+def parse_item(line_number: int, line: str) -> JobItem:
+    """One input line as an item; a line that cannot be used becomes an item with an error."""
+    try:
+        data = json.loads(line)
+        return JobItem(line=line_number, id=str(data.get("id", line_number)), question=data["question"], text=data["text"])
+    except (ValueError, KeyError, AttributeError) as e:
+        return JobItem(line=line_number, id=str(line_number), error=f"Invalid input line: {e!r}")
+
+
+def read_items(path: Path) -> Iterator[JobItem]:
+    """Yield the answers in a JSONL file."""
+    with open(path, encoding="utf-8") as file:
+        for line_number, line in enumerate(file, start=1):
+            if line.strip():
+                yield parse_item(line_number, line)
+
+
+def read_item_batch(path: Path, position: int, line_number: int, size: int = READ_BATCH_LINES) -> tuple[list[JobItem], int, int]:
+    """
+    Up to size answers from byte position on, where line_number lines have been read.
+    Returns them with the position and line number the next batch starts from; an empty
+    list at the end of the file.
+    """
+    items = []
+    with open(path, "rb") as file:
+        file.seek(position)
+        while len(items) < size and (line := file.readline()):
+            position += len(line)
+            line_number += 1
+            text = line.decode("utf-8")
+            if text.strip():
+                items.append(parse_item(line_number, text))
+    return items, position, line_number
+
+
+def count_items(path: Path) -> int:
+    with open(path, encoding="utf-8") as file:
+        return sum(1 for line in file if line.strip())
+
+
+def completed_ids(path: Path) -> set[str]:
+    """Ids that already have a graded result in an output file (the checkpoint)."""
+    done = set()
+    if not path.exists():
+        return done
+    with open(path, encoding="utf-8") as file:
+        for line in file:
+            try:
+                record = json.loads(line)
+            except ValueError:
+                # A line cut short by a crash; that item is graded again.
+                continue
+            if "error" not in record:
+                done.add(record["id"])
+    return done
+
+
+@dataclass
+class CorrectionJob:
+    """
+    One bulk grading run. The output JSONL doubles as the checkpoint: every result is
+    appended and flushed as soon as it is ready, and a resumed run skips every id that
+    already has a graded line. Failed items are written with an "error" and retried on
+    resume, so the last line for an id is its current result.
+    """
+    job_id: str
+    input_path: str
+    output_path: str
+    concurrency: int = CORRECTION_JOB_CONCURRENCY
+    state: str = "queued"  # queued, running, completed, failed, cancelled, interrupted, batch_file_ready
+    total: int = 0
+    graded: int = 0
+    failed: int = 0
+    skipped: int = 0
+    created_at: float = field(default_factory=time.time)
+    started_at: float | None = None
+    finished_at: float | None = None
+    error: str | None = None
+    batch_files: list[str] = field(default_factory=list)
+
+    # Open <id>.lock while this process runs the job; not a dataclass field, so never saved.
+    _lock = None
+
+    @property
+    def meta_path(self) -> Path:
+        return Path(self.output_path).with_suffix("").with_suffix(".json")
+
+    @property
+    def lock_path(self) -> Path:
+        return Path(self.output_path).with_suffix("").with_suffix(".lock")
+
+    @property
+    def cancel_path(self) -> Path:
+        return Path(self.output_path).with_suffix("").with_suffix(".cancel")
+
+    def lock(self) -> bool:
+        """
+        Take an exclusive flock on <id>.lock, so only one process (worker or CLI) appends to
+        the output file. Returns False if another process holds it. Released by unlock(),
+        or by the OS if the process dies.
+        """
+        if self._lock is not None:
+            return True
+        file = open(self.lock_path, "wb")
+        if fcntl is not None:
+            try:
+                fcntl.flock(file, fcntl.LOCK_EX | fcntl.LOCK_NB)
+            except BlockingIOError:
+                file.close()
+                return False
+        self._lock = file
+        return True
+
+    def unlock(self):
+        if self._lock is not None:
+            self._lock.close()
+            self._lock = None
+
+    def locked_elsewhere(self) -> bool:
+        """Whether another process is running this job right now."""
+        if self._lock is not None:
+            return False
+        if not self.lock():
+            return True
+        self.unlock()
+        return False
+
+    def request_cancel(self):
+        """Ask whichever process runs this job to stop; it checks every CANCEL_POLL_SECONDS."""
+        self.cancel_path.touch()
+
+    def snapshot(self) -> dict:
+        data = asdict(self)
+        processed = self.skipped + self.graded + self.failed
+        data["progress"] = round(processed / self.total, 4) if self.total else None
+        return data
+
+    def save(self):
+        tmp = self.meta_path.with_suffix(".tmp")
+        tmp.write_text(json.dumps(asdict(self), indent=2), encoding="utf-8")
+        os.replace(tmp, self.meta_path)
+
+    @classmethod
+    def load(cls, path: Path) -> "CorrectionJob":
+        return cls(**json.loads(path.read_text(encoding="utf-8")))
+
+    async def _watch_cancel(self, task: asyncio.Task):
+        while True:
+            await asyncio.sleep(CANCEL_POLL_SECONDS)
+            if await asyncio.to_thread(self.cancel_path.exists):
+                self.state = "cancelling"
+                task.cancel()
+                return
+
+    async def run(self):
+        """
+        Grade every item not yet in the output file, with at most `concurrency` calls in flight.
+        Holds the job's lock for the whole run; raises RuntimeError if another process has it.
+        """
+        if not self.lock():
+            raise RuntimeError(f"Job {self.job_id} is already running in another process")
+        input_path, output_path = Path(self.input_path), Path(self.output_path)
+        self.state, self.started_at, self.finished_at, self.error = "running", time.time(), None, None
+        self.graded = self.failed = self.skipped = 0
+        self.cancel_path.unlink(missing_ok=True)
+        watcher = asyncio.create_task(self._watch_cancel(asyncio.current_task()))
+        last_save = time.monotonic()
+        try:
+            self.total = await asyncio.to_thread(count_items, input_path)
+            done = await asyncio.to_thread(completed_ids, output_path)
+            await asyncio.to_thread(self.save)
+            queue: asyncio.Queue = asyncio.Queue(maxsize=self.concurrency * 2)
+            with open(output_path, "a", encoding="utf-8") as output:
+
+                def write(record: dict):
+                    output.write(json.dumps(record, ensure_ascii=False) + "\n")
+                    output.flush()
+
+                async def worker():
+                    nonlocal last_save
+                    while (item := await queue.get()) is not None:
+                        record = {"id": item.id, "line": item.line}
+                        try:
+                            if item.error:
+                                raise ValueError(item.error)
+                            correction, usage = await grade(item.question, item.text, deadline=CORRECTION_JOB_DEADLINE)
+                            record.update(correction.model_dump(), usage=usage)
+                            self.graded += 1
+                        except Exception as e:
+                            record["error"] = str(e)
+                            self.failed += 1
+                        write(record)
+                        # Other workers read progress from the job file.
+                        if (self.graded + self.failed) % CHECKPOINT_EVERY == 0 or time.monotonic() - last_save > CHECKPOINT_SECONDS:
+                            last_save = time.monotonic()
+                            await asyncio.to_thread(self.save)
+
+                async def produce():
+                    position = line_number = 0
+                    while True:
+                        items, position, line_number = await asyncio.to_thread(read_item_batch, input_path, position, line_number)
+                        if not items:
+                            break
+                        for item in items:
+                            if item.id in done:
+                                self.skipped += 1
+                                continue
+                            await queue.put(item)
+                    for _ in range(self.concurrency):
+                        await queue.put(None)
+
+                tasks = [asyncio.create_task(produce())] + [asyncio.create_task(worker()) for _ in range(self.concurrency)]
+                try:
+                    await asyncio.gather(*tasks)
+                finally:
+                    for task in tasks:
+                        task.cancel()
+            self.state = "completed"
+        except asyncio.CancelledError:
+            self.state = "cancelled" if self.state == "cancelling" else "interrupted"
+            raise
+        except Exception as e:
+            logging.error(f"Correction job {self.job_id} failed: {e}")
+            self.state, self.error = "failed", str(e)
+        finally:
+            watcher.cancel()
+            self.finished_at = time.time()
+            # One thread call: it finishes (and releases the lock) even if this task is cancelled again.
+            await asyncio.to_thread(self._finish)
+            logging.info(f"Correction job {self.job_id} {self.state}: {self.graded} graded, {self.failed} failed, {self.skipped} skipped")
+
+    def _finish(self):
+        self.save()
+        self.cancel_path.unlink(missing_ok=True)
+        self.unlock()
+
+    def write_batch_files(self) -> list[str]:
+        """
+        Write the pending items as Batch API request files (POST /v1/responses, custom_id = item id)
+        next to the output, split at BATCH_FILE_MAX_LINES. Upload them with purpose "batch".
+        """
+        done = completed_ids(Path(self.output_path))
+        paths, batch, lines = [], None, 0
+        try:
+            for item in read_items(Path(self.input_path)):
+                if item.error or item.id in done:
+                    continue
+                if batch is None or lines >= BATCH_FILE_MAX_LINES:
+                    if batch is not None:
+                        batch.close()
+                    path = Path(self.output_path).with_suffix("").with_suffix(f".batch{len(paths) + 1}.jsonl")
+                    paths.append(str(path))
+                    batch, lines = open(path, "w", encoding="utf-8"), 0
+                body = correction_request(item.question, item.text)
+                body["text"] = {"format": body.pop("text_format")}
+                batch.write(json.dumps({"custom_id": item.id, "method": "POST", "url": "/v1/responses", "body": body}, ensure_ascii=False) + "\n")
+                lines += 1
+        finally:
+            if batch is not None:
+                batch.close()
+        self.batch_files = paths
+        self.state = "batch_file_ready"
+        self.save()
+        return paths
+
+
+class CorrectionJobs:
+    """
+    Submitted jobs and their background tasks. Job files live in CORRECTION_JOBS_DIR as
+    <id>.in.jsonl, <id>.out.jsonl and <id>.json. With several worker processes any worker
+    may get a job's requests: status is read from <id>.json, <id>.lock makes sure only one
+    process runs a job, and a cancel is passed to the running worker through <id>.cancel.
+    """
+
+    def __init__(self, directory: Path = CORRECTION_JOBS_DIR):
+        self.directory = Path(directory)
+        # Jobs running in this process.
+        self._jobs: dict[str, CorrectionJob] = {}
+        self._tasks: dict[str, asyncio.Task] = {}
+
+    def _load(self, job_id: str) -> CorrectionJob | None:
+        meta = self.directory / f"{Path(job_id).name}.json"
+        if not meta.exists():
+            return None
+        job = CorrectionJob.load(meta)
+        if job.state in ("queued", "running", "cancelling") and not job.locked_elsewhere():
+            # The worker that ran it stopped without saving (crash or kill); resume it.
+            job.state = "interrupted"
+        return job
+
+    async def get(self, job_id: str) -> CorrectionJob | None:
+        if self.running(job_id):
+            return self._jobs[job_id]
+        return await asyncio.to_thread(self._load, job_id)
+
+    def running(self, job_id: str) -> bool:
+        task = self._tasks.get(job_id)
+        return task is not None and not task.done()
+
+    async def submit(self, request: cls.CorrectionJobRequest) -> CorrectionJob:
+        self.directory.mkdir(parents=True, exist_ok=True)
+        job_id = uuid.uuid4().hex[:12]
+        input_path = self.directory / f"{job_id}.in.jsonl"
+        if request.items:
+            lines = [json.dumps({"id": str(index), **item.model_dump()}, ensure_ascii=False) + "\n" for index, item in enumerate(request.items)]
+            await asyncio.to_thread(input_path.write_text, "".join(lines), encoding="utf-8")
+        elif request.input_file:
+            # Only files inside the jobs directory can be graded.
+            input_path = self.directory / Path(request.input_file).name
+            if not input_path.is_file():
+                raise HTTPException(status_code=404, detail=f"Input file '{request.input_file}' not found in {self.directory}")
+        else:
+            raise HTTPException(status_code=422, detail="Provide either items or input_file")
+        job = CorrectionJob(job_id=job_id, input_path=str(input_path), output_path=str(self.directory / f"{job_id}.out.jsonl"),
+                            concurrency=request.concurrency)
+        if request.batch_file:
+            await asyncio.to_thread(job.write_batch_files)
+        else:
+            await asyncio.to_thread(job.save)
+            self.start(job)
+        return job
+
+    def start(self, job: CorrectionJob):
+        if self.running(job.job_id) or not job.lock():
+            raise HTTPException(status_code=409, detail=f"Job {job.job_id} is already running")
+        job.state = "queued"
+        self._jobs[job.job_id] = job
+        task = self._tasks[job.job_id] = asyncio.create_task(job.run())
+        task.add_done_callback(lambda _: self._forget(job.job_id, task))
+
+    def _forget(self, job_id: str, task: asyncio.Task):
+        if self._tasks.get(job_id) is task:
+            del self._tasks[job_id]
+            del self._jobs[job_id]
+
+    async def cancel(self, job: CorrectionJob) -> CorrectionJob:
+        """Cancel a running job, in this process or another one; returns its current state."""
+        task = self._tasks.get(job.job_id)
+        if task is not None and not task.done():
+            job.state = "cancelling"
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+            return job
+        if job.state in ("queued", "running"):
+            # Running in another worker: it sees the request within CANCEL_POLL_SECONDS.
+            await asyncio.to_thread(job.request_cancel)
+            job.state = "cancelling"
+        return job
+
+    async def shutdown(self):
+        # Interrupted jobs keep their checkpoint and can be resumed after the restart.
+        tasks = [task for task in self._tasks.values() if not task.done()]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+correction_jobs = CorrectionJobs()
+
+
+@asynccontextmanager
+async def correction_jobs_lifespan(app):
+    async with prompt_registry_lifespan(app):
+        yield
+        await correction_jobs.shutdown()
+
+
+correction_jobs_router = APIRouter(tags=["correction"], lifespan=correction_jobs_lifespan)
+
+
+async def get_job(job_id: str) -> CorrectionJob:
+    job = await correction_jobs.get(job_id)
+    if job is None:
+        raise HTTPException(status_code=404, detail=f"Correction job {job_id} not found")
+    return job
+
+
+@correction_jobs_router.post("/correction/jobs")
+async def submit_correction_job(request: cls.CorrectionJobRequest):
+    """
+    Grade many answers in the background. Results are appended to the job's output JSONL
+    as they finish; poll GET /correction/jobs/{job_id} for progress.
+    With batch_file=true the answers are written as Batch API request files instead.
+    """
+    try:
+        job = await correction_jobs.submit(request)
+        return job.snapshot()
+    except Exception as e:
+        if isinstance(e, HTTPException):
+            raise
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@correction_jobs_router.get("/correction/jobs/{job_id}")
+async def correction_job_status(job_id: str):
+    return (await get_job(job_id)).snapshot()
+
+
+@correction_jobs_router.get("/correction/jobs/{job_id}/results")
+async def correction_job_results(job_id: str):
+    """The output JSONL so far: one {"id", "line", "score", "feedback", "usage"} or {"id", "line", "error"} per line."""
+    job = await get_job(job_id)
+    if not Path(job.output_path).exists():
+        raise HTTPException(status_code=404, detail=f"Correction job {job_id} has no results yet")
+    return FileResponse(job.output_path, media_type="application/x-ndjson", filename=Path(job.output_path).name)
+
+
+@correction_jobs_router.post("/correction/jobs/{job_id}/resume")
+async def resume_correction_job(job_id: str):
+    """Run the job again, skipping every answer that already has a graded result."""
+    job = await get_job(job_id)
+    correction_jobs.start(job)
+    return job.snapshot()
+
+
+@correction_jobs_router.post("/correction/jobs/{job_id}/cancel")
+async def cancel_correction_job(job_id: str):
+    job = await get_job(job_id)
+    return (await correction_jobs.cancel(job)).snapshot()
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Grade a JSONL file of {id, question, text} answers.")
+    parser.add_argument("input", help="Input JSONL file")
+    parser.add_argument("output", help="Output JSONL file; re-running with the same output resumes the job")
+    parser.add_argument("--concurrency", type=int, default=CORRECTION_JOB_CONCURRENCY)
+    parser.add_argument("--batch-file", action="store_true", help="Write Batch API request files instead of grading")
+    args = parser.parse_args()
+
+    logging.basicConfig(level=logging.INFO)
+    prompt_registry.reload()
+    output = Path(args.output)
+    job = CorrectionJob(job_id=output.stem, input_path=args.input, output_path=str(output), concurrency=args.concurrency)
+    if args.batch_file:
+        for path in job.write_batch_files():
+            print(path)
+    else:
+        asyncio.run(job.run())
+        print(json.dumps(job.snapshot(), indent=2))
+
+
+if __name__ == "__main__":
+    main()
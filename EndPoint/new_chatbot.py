@@ -1,15 +1,25 @@
-from fastapi import APIRouter, HTTPException
-from fastapi.responses import StreamingResponse
-from openai import OpenAI
-from dotenv import load_dotenv
-import os
-import requests as req
-import json
-
-load_dotenv()
-api_key = os.getenv("OPEN_AI_KEY")
-new_chatbot_router = APIRouter(tags=["new_chatbot"])
-client = OpenAI(api_key=api_key)
+from openai import APIStatusError
+from util.config import client, HTTPException, APIRouter
+from util.complition_model import usage_tokens
+from util import metrics
+from util.glossary import glossary, glossary_term
+from collections import OrderedDict
+from contextlib import asynccontextmanager
+
+
+@asynccontextmanager
+async def new_chatbot_lifespan(app):
+    await glossary.start()
+    yield
+    await glossary.stop()
+
+
+new_chatbot_router = APIRouter(tags=["new_chatbot"], lifespan=new_chatbot_lifespan)
+
+# Conversations whose last reply from this worker ended in a question; a one-word
+# message there is an answer, so it goes to the model instead of the glossary.
+_asked_question: OrderedDict[str, None] = OrderedDict()
+ASKED_QUESTION_KEEP = 10000
 
 prompt = """You are a friendly, professional, helpful assistant that guides students in learning English.
 You are an expert in English education. You only answer questions related to learning English.
@@ -19,10 +29,19 @@ If the user asks something unrelated, reply with: "I can only answer questions a
 Correct any typos the user makes.
 You're talking to kids or teenagers."""
 
+async def define(term: str) -> str:
+    """The assistant's answer to term alone, outside any conversation, for the glossary."""
+    with metrics.UpstreamTimer("responses", "gpt-4.1"):
+        response = await client.responses.create(model="gpt-4.1", input=term, instructions=prompt)
+    metrics.record_usage("gpt-4.1", usage_tokens(response))
+    return response.output_text
+
+
 @new_chatbot_router.get("/new_conversation")
 async def new_conversation():
     try:
-        coversationID = client.conversations.create()
+        with metrics.UpstreamTimer("conversations.create", ""):
+            coversationID = await client.conversations.create()
         return {"conversation_id": coversationID.id}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -31,31 +50,56 @@ async def new_conversation():
 @new_chatbot_router.delete("/delete_conversation")
 async def delete_conversation(conversation_id: str):
     try:
-        url = f"https://api.openai.com/v1/conversations/{conversation_id}"
-        headers = {
-            "Authorization": f"Bearer {api_key}",
-            "Content-Type": "application/json"
-        }
-        response = req.delete(url, headers=headers)
-
-        if response.status_code == 200:
-            return {"message": "Conversation deleted successfully", "status": "success"}
-        else:
-            return {"message": "Failed to delete conversation", "status": "error", "details": response.json()}
+        with metrics.UpstreamTimer("conversations.delete", ""):
+            await client.conversations.delete(conversation_id)
+        return {"message": "Conversation deleted successfully", "status": "success"}
+    except APIStatusError as e:
+        return {"message": "Failed to delete conversation", "status": "error", "details": e.body}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
     
 
+def _track_question(conversation_id: str, reply: str):
+    _asked_question.pop(conversation_id, None)
+    if reply.rstrip().endswith(("?", "؟")):
+        _asked_question[conversation_id] = None
+        while len(_asked_question) > ASKED_QUESTION_KEEP:
+            _asked_question.popitem(last=False)
+
+
+@new_chatbot_router.get("/chatbot/glossary/stats")
+async def glossary_stats():
+    """Hit ratio, sizes and learned entries of the single-word glossary in this worker."""
+    return glossary.snapshot()
+
+
 @new_chatbot_router.post("/chatbot")
 async def chat(conversation_id: str, user_message: str):
     try:
-        response = client.responses.create(
-            model="gpt-4.1",
-            conversation=conversation_id,
-            input = user_message,
-            instructions=prompt
-        )
+        term = None if conversation_id in _asked_question else glossary_term(user_message)
+        answer = glossary.lookup(term) if term else None
+        if answer is not None:
+            # Record the turn so the conversation reads as if the model had answered it
+            with metrics.UpstreamTimer("conversations.items.create", ""):
+                await client.conversations.items.create(conversation_id, items=[
+                    {"type": "message", "role": "user", "content": [{"type": "input_text", "text": user_message}]},
+                    {"type": "message", "role": "assistant", "content": [{"type": "output_text", "text": answer}]},
+                ])
+            return answer
+
+        with metrics.UpstreamTimer("responses", "gpt-4.1"):
+            response = await client.responses.create(
+                model="gpt-4.1",
+                conversation=conversation_id,
+                input = user_message,
+                instructions=prompt
+            )
+        metrics.record_usage("gpt-4.1", usage_tokens(response))
 
+        _track_question(conversation_id, response.output_text)
+        if term:
+            # The reply above depends on the conversation; learn from one without it
+            glossary.backfill(term, lambda: define(term))
         return response.output_text
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
@@ -0,0 +1,21 @@
+import asyncio
+from util.config import APIRouter, HTTPException
+from util.prompts import prompt_registry, prompt_registry_lifespan
+
+
+prompts_router = APIRouter(tags=["prompts"], lifespan=prompt_registry_lifespan)
+
+@prompts_router.get("/prompts")
+async def list_prompts():
+    """Versions of the prompt files currently served from memory."""
+    return {"versions": prompt_registry.versions()}
+
+
+@prompts_router.post("/prompts/reload")
+async def reload_prompts():
+    """Re-read changed prompt files now instead of waiting for the watcher."""
+    try:
+        changed = await asyncio.to_thread(prompt_registry.reload)
+        return {"changed": changed, "versions": prompt_registry.versions()}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
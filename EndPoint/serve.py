@@ -0,0 +1,60 @@
+# Server launcher. Kept free of app imports so worker processes only import the app once.
+import os
+import glob
+import argparse
+import tempfile
+import importlib.util
+import uvicorn
+
+APP_DIR = os.path.dirname(os.path.abspath(__file__))
+
+
+def _installed(module: str) -> bool:
+    return importlib.util.find_spec(module) is not None
+
+
+def run_server():
+    """
+    Start the API with uvicorn.
+    By default this is the development server (single process, auto-reload).
+    With --prod (or AI_ENGINE_ENV=production) it runs N worker processes without the
+    file watcher, on uvloop/httptools when installed, and drains in-flight requests
+    and streams for up to AI_ENGINE_GRACEFUL_TIMEOUT seconds on shutdown.
+    """
+    parser = argparse.ArgumentParser(description="SafarAI AI engine API server")
+    parser.add_argument("--prod", action="store_true", default=os.getenv("AI_ENGINE_ENV", "development") == "production")
+    parser.add_argument("--host", default=os.getenv("AI_ENGINE_HOST", "0.0.0.0"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("AI_ENGINE_PORT", "9999")))
+    parser.add_argument("--workers", type=int, default=int(os.getenv("AI_ENGINE_WORKERS", str(os.cpu_count() or 1))))
+    args = parser.parse_args()
+
+    if not args.prod:
+        uvicorn.run("Endpoint:app", host = args.host, port = args.port, reload=True, app_dir=APP_DIR)
+        return
+
+    if args.workers > 1:
+        # Realtime sessions must be visible to whichever worker gets the keep-alive/close call.
+        os.environ.setdefault("REALTIME_SESSION_STORE", "sqlite")
+        # Workers share their metrics through files here, so /metrics on any worker reports all of them.
+        metrics_dir = os.environ.setdefault("METRICS_MULTIPROC_DIR", tempfile.mkdtemp(prefix="ai-engine-metrics-"))
+        os.makedirs(metrics_dir, exist_ok=True)
+        for path in glob.glob(os.path.join(metrics_dir, "*.json")):
+            # Totals start from zero on every launch, like a single process would.
+            os.remove(path)
+    uvicorn.run(
+        "Endpoint:app",
+        host = args.host,
+        port = args.port,
+        app_dir=APP_DIR,
+        workers=args.workers,
+        loop="uvloop" if _installed("uvloop") else "asyncio",
+        http="httptools" if _installed("httptools") else "h11",
+        backlog=int(os.getenv("AI_ENGINE_BACKLOG", "2048")),
+        timeout_keep_alive=int(os.getenv("AI_ENGINE_KEEP_ALIVE", "15")),
+        timeout_graceful_shutdown=int(os.getenv("AI_ENGINE_GRACEFUL_TIMEOUT", "30")),
+        proxy_headers=True,
+    )
+
+
+if __name__ == "__main__":
+    run_server()
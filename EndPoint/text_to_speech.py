@@ -1,27 +1,62 @@
-from util.config import client, cls, Path, HTTPException, APIRouter
-from util.audio_model import audio_model
+from util.config import cls, HTTPException, APIRouter, StreamingResponse
+from util.speech_cache import speech_cache
 
 text_to_speech_router = APIRouter(tags=["text-to-speech"])
 
 
-@text_to_speech_router.post("/text-to-speech", response_model=cls.TextToSpeechResponse)
-async def text_to_speech(request: cls.TextToSpeechRequest):
-    try:
-        speech_file_path = Path(__file__).parent.parent/ "speechfiles" / f"speech_{request.id}.mp3"
-        instructions = f"""
+def tts_instructions(accent: str) -> str:
+    return f"""
             Please read the text in a clear and engaging manner. Use a friendly tone and emphasize key points.
             Use the accent of the text to read the text.
-            you should talk in this accent: {request.accent}.
+            you should talk in this accent: {accent}.
         """
 
-        await audio_model(
+
+@text_to_speech_router.post("/text-to-speech", response_model=cls.TextToSpeechResponse)
+async def text_to_speech(request: cls.TextToSpeechRequest):
+    try:
+        instructions = tts_instructions(request.accent)
+
+        speech_file_path = await speech_cache.get_or_create(
             model="gpt-4o-mini-tts",
             voice=request.voice,
             instructions=instructions,
-            input=request.text,
-            speech_file_path=speech_file_path
+            text=request.text
         )
 
         return cls.TextToSpeechResponse(message="Speech synthesis complete", file_path=str(speech_file_path))
     except Exception as e:
-        raise HTTPException(status_code = 500, detail = str(e))
\ No newline at end of file
+        raise HTTPException(status_code = 500, detail = str(e))
+
+
+@text_to_speech_router.post("/text-to-speech/stream")
+async def text_to_speech_stream(request: cls.TextToSpeechRequest):
+    """
+    Stream the MP3 to the client as it is synthesized, so playback can start right away.
+    The audio is saved to the speech cache at the same time; its path is sent in the
+    X-Speech-File header.
+    """
+    try:
+        instructions = tts_instructions(request.accent)
+        params = dict(model="gpt-4o-mini-tts", voice=request.voice, instructions=instructions, text=request.text)
+        speech_file_path = speech_cache.path_for(speech_cache.key(**params))
+        audio = speech_cache.stream(**params)
+        # Wait for the first chunk here so upstream failures still become a 500.
+        first_chunk = await anext(audio, b"")
+
+        async def generate_audio():
+            try:
+                yield first_chunk
+                async for chunk in audio:
+                    yield chunk
+            finally:
+                # Detach from the synthesis right away when the client leaves; it keeps writing the file.
+                await audio.aclose()
+
+        return StreamingResponse(
+            generate_audio(),
+            media_type="audio/mpeg",
+            headers={"Cache-Control": "no-cache", "X-Speech-File": str(speech_file_path)}
+        )
+    except Exception as e:
+        raise HTTPException(status_code = 500, detail = str(e))
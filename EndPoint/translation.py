@@ -1,15 +1,42 @@
-from dis import Instruction
-from util.config import client, cls, HTTPException, APIRouter, prs
-from util.complition_model import complition_model
+import os
+import json
+import asyncio
+import logging
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from util.config import client, cls, APIRouter, prs
+from util.complition_model import complition_model, http_error
+from util.translation_cache import translation_cache, normalize_text, normalize_language
+from util.tokens import count_tokens, preload_encoding
 
-translation_router  = APIRouter(tags=["translation"])
+# Translations are short, so a duplicate request after this many seconds cuts the latency tail.
+TRANSLATION_HEDGE_AFTER = float(os.getenv("TRANSLATION_HEDGE_AFTER", "4"))
+TRANSLATION_DEADLINE = float(os.getenv("TRANSLATION_DEADLINE", "30"))
+TRANSLATION_MODEL = "gpt-5-nano"
+# /translation/batch packs phrases of one target language into calls of at most this
+# many input tokens / items; the groups run concurrently.
+TRANSLATION_BATCH_TOKENS = int(os.getenv("TRANSLATION_BATCH_TOKENS", "1500"))
+TRANSLATION_BATCH_MAX_ITEMS = int(os.getenv("TRANSLATION_BATCH_MAX_ITEMS", "40"))
+TRANSLATION_BATCH_DEADLINE = float(os.getenv("TRANSLATION_BATCH_DEADLINE", "60"))
+
+
+@asynccontextmanager
+async def translation_cache_lifespan(app):
+    await preload_encoding()
+    if translation_cache.path is not None:
+        removed = await asyncio.to_thread(translation_cache.prune)
+        logging.info(f"Translation cache at {translation_cache.path}: pruned {removed} expired entries")
+    yield
+    translation_cache.close()
 
-@translation_router.post("/translation", response_model=cls.translationResponse)
-async def translate_text(request: cls.translationRequest):
-    try:
 
-        Instruction = f"""
-            You are a translation assistant. Your ONLY task is to translate the user's text to {request.target_language}.
+translation_router  = APIRouter(tags=["translation"], lifespan=translation_cache_lifespan)
+
+
+@lru_cache(maxsize=64)
+def translation_instructions(target_language: str) -> str:
+    return f"""
+            You are a translation assistant. Your ONLY task is to translate the user's text to {target_language}.
             Do NOT answer, explain, or comment on the text. Do NOT provide any information except the translation and a brief description of the translated text.
             If the input is a question, ONLY translate the question—do NOT answer it.
             Return the translation in JSON format with these keys: {{ "translation": "string", "info": "string" }}.
@@ -26,17 +53,168 @@ async def translate_text(request: cls.translationRequest):
             output: {{ "translation": "أحب البرمجة.", "info": "جملة تعبر عن الحب للبرمجة." }}
             """
 
+
+@lru_cache(maxsize=64)
+def batch_translation_instructions(target_language: str) -> str:
+    return f"""
+            You are a translation assistant. Your ONLY task is to translate every text in the user's JSON array to {target_language}.
+            Do NOT answer, explain, or comment on the texts. If a text is a question, ONLY translate the question—do NOT answer it.
+            For each input item return its "id", the translation and a brief description of the translated text.
+            Return JSON in this format: {{ "items": [{{ "id": 0, "translation": "string", "info": "string" }}] }}.
+            Return exactly one item per input id and nothing else.
+
+            ##EXAMPLE##
+            input: [{{"id": 0, "text": "How are you?"}}, {{"id": 1, "text": "I love programming."}}]
+            output: {{ "items": [{{ "id": 0, "translation": "مرحباً، كيف حالك؟", "info": "سؤال شائع للتحية." }}, {{ "id": 1, "translation": "أحب البرمجة.", "info": "جملة تعبر عن الحب للبرمجة." }}] }}
+            """
+
+
+def pack_groups(texts: list[str], budget: int = TRANSLATION_BATCH_TOKENS, max_items: int = TRANSLATION_BATCH_MAX_ITEMS) -> list[slice]:
+    """Split texts into consecutive groups that stay within the token budget and item limit."""
+    groups = []
+    start, used = 0, 0
+    for index, text in enumerate(texts):
+        # A few tokens for the id and JSON framing of each item.
+        tokens = count_tokens(text) + 8
+        if index > start and (used + tokens > budget or index - start >= max_items):
+            groups.append(slice(start, index))
+            start, used = index, 0
+        used += tokens
+    if start < len(texts):
+        groups.append(slice(start, len(texts)))
+    return groups
+
+
+async def translate_group(texts: list[str], target_language: str) -> list[dict | None]:
+    """
+    Translate several texts to one language in a single model call.
+    Returns:
+        list: One {"translation", "info"} dict per text, in order, or None where the model skipped an item.
+    """
+    response = await complition_model(
+        model = TRANSLATION_MODEL,
+        instructions = batch_translation_instructions(target_language),
+        input = json.dumps([{"id": index, "text": text} for index, text in enumerate(texts)], ensure_ascii=False),
+        text_format = prs.json_schema_format(cls.translationBatchOutput),
+        deadline = TRANSLATION_BATCH_DEADLINE,
+    )
+    try:
+        items = [item.model_dump() for item in prs.parse_model(response, cls.translationBatchOutput).items]
+    except ValueError:
+        items = prs.extract_json_from_response(response).get("items")
+    translated = {}
+    for item in items if isinstance(items, list) else []:
+        if isinstance(item, dict) and isinstance(item.get("id"), int) and item.get("translation"):
+            translated[item["id"]] = {"translation": str(item["translation"]), "info": str(item.get("info", ""))}
+    return [translated.get(index) for index in range(len(texts))]
+
+
+async def translate(text: str, target_language: str, count: bool = True) -> dict:
+    """
+    Translate text through the cache.
+    Args:
+        count: False when the cache lookup was already counted (batch items retried on their own).
+    Returns:
+        dict: The parsed model output, normally with "translation" and "info" keys.
+    """
+    instructions = translation_instructions(normalize_language(target_language))
+
+    async def call_model() -> dict:
         response = await complition_model (
-            model = "gpt-5-nano",
-            instructions = Instruction,
-            input = request.text,
+            model = TRANSLATION_MODEL,
+            instructions = instructions,
+            input = text,
+            text_format = prs.json_schema_format(cls.translationResponse),
+            deadline = TRANSLATION_DEADLINE,
+            hedge_after = TRANSLATION_HEDGE_AFTER,
         )
-        # Parse the response to extract JSON
-        response_data = prs.extract_json_from_response(response)
+        try:
+            return prs.parse_model(response, cls.translationResponse).model_dump()
+        except ValueError:
+            # Parse the response to extract JSON
+            return prs.extract_json_from_response(response)
+
+    # Only the cache key is normalized; the model gets the text as the user wrote it.
+    key = translation_cache.key(TRANSLATION_MODEL, instructions, normalize_text(text))
+    return await translation_cache.get_or_create(key, call_model, count)
+
+
+@translation_router.post("/translation", response_model=cls.translationResponse)
+async def translate_text(request: cls.translationRequest):
+    try:
+        response_data = await translate(request.text, request.target_language)
         # Return the translation response model
         return cls.translationResponse(
             translation=response_data.get("translation", "error:translation not found"),
             info=response_data.get("info", "error:info not found")
         )
     except Exception as e:
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        raise http_error(e)
+
+
+@translation_router.get("/translation/cache/stats")
+async def translation_cache_stats():
+    """Hit/miss counters and size of the translation cache."""
+    return translation_cache.snapshot()
+
+
+@translation_router.post("/translation/batch", response_model=cls.translationBatchResponse)
+async def translate_batch(request: cls.translationBatchRequest):
+    """
+    Translate many short texts at once. Cached texts are answered directly; the rest are
+    grouped per target language into as few model calls as fit TRANSLATION_BATCH_TOKENS.
+    Results come back in request order, with an error per item instead of failing the batch.
+    """
+    try:
+        keys = []
+        jobs: dict[str, tuple[str, str]] = {}
+        for item in request.items:
+            language = normalize_language(item.target_language)
+            key = translation_cache.key(TRANSLATION_MODEL, translation_instructions(language), normalize_text(item.text))
+            keys.append(key)
+            jobs.setdefault(key, (item.text, language))
+
+        results = await translation_cache.lookup_many(list(jobs))
+        errors: dict[str, str] = {}
+        by_language: dict[str, list[str]] = {}
+        for key, (text, language) in jobs.items():
+            if key not in results:
+                by_language.setdefault(language, []).append(key)
+
+        async def translate_single(key: str):
+            try:
+                results[key] = await translate(*jobs[key], count=False)
+            except Exception as e:
+                errors[key] = str(e)
+
+        async def run_group(language: str, group: list[str]):
+            try:
+                values = await translate_group([jobs[key][0] for key in group], language)
+            except Exception as e:
+                logging.error(f"Batch translation group of {len(group)} failed: {e}")
+                errors.update((key, str(e)) for key in group)
+                return
+            for key, value in zip(group, values):
+                if value is not None:
+                    results[key] = value
+                    await translation_cache.put(key, value)
+            # Items the model dropped from its answer go through the single-text path.
+            await asyncio.gather(*(translate_single(key) for key, value in zip(group, values) if value is None))
+
+        groups = [(language, pending[part]) for language, pending in by_language.items()
+                  for part in pack_groups([jobs[key][0] for key in pending])]
+        await asyncio.gather(*(run_group(language, group) for language, group in groups))
+        logging.info(f"Batch translation: {len(keys)} items, {len(jobs)} distinct, {len(jobs) - sum(map(len, by_language.values()))} cached, {len(groups)} model calls")
+
+        batch_results = []
+        for key in keys:
+            if key in results:
+                batch_results.append(cls.translationBatchResult(
+                    translation=results[key].get("translation", "error:translation not found"),
+                    info=results[key].get("info", "error:info not found")
+                ))
+            else:
+                batch_results.append(cls.translationBatchResult(error=errors.get(key, "translation failed")))
+        return cls.translationBatchResponse(results=batch_results)
+    except Exception as e:
+        raise http_error(e)
@@ -0,0 +1,95 @@
+"""
+Run the engine for a benchmark: the normal app from EndPoint/Endpoint.py, one worker, plus
+an event-loop lag probe at GET /__bench/loop-lag (?reset=true starts a new measurement).
+
+    OPENAI_BASE_URL=http://127.0.0.1:8765/v1 python benchmarks/app_server.py --port 9998
+"""
+import os
+import sys
+import time
+import asyncio
+import argparse
+from contextlib import asynccontextmanager
+
+ROOT = os.path.abspath(os.path.join(os.path.dirname(__file__), ".."))
+sys.path.insert(0, os.path.join(ROOT, "EndPoint"))
+sys.path.insert(0, ROOT)
+
+import uvicorn
+from fastapi import APIRouter
+from Endpoint import app
+
+LAG_INTERVAL = 0.01
+
+
+class LoopLagMonitor:
+    """Wakes up every `interval` seconds and records how late it was; a blocked loop shows up as lag."""
+
+    def __init__(self, interval: float = LAG_INTERVAL):
+        self.interval = interval
+        self.samples: list[float] = []
+        self._task: asyncio.Task | None = None
+
+    async def _run(self):
+        # perf_counter rather than loop.time(): uvloop's clock only has millisecond resolution.
+        while True:
+            expected = time.perf_counter() + self.interval
+            await asyncio.sleep(self.interval)
+            self.samples.append(max(0.0, time.perf_counter() - expected))
+
+    def start(self):
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        self._task.cancel()
+        try:
+            await self._task
+        except asyncio.CancelledError:
+            pass
+
+    def snapshot(self, reset: bool = False) -> dict:
+        samples = sorted(self.samples)
+        if reset:
+            self.samples = []
+        if not samples:
+            return {"samples": 0}
+        return {
+            "samples": len(samples),
+            "mean_ms": round(sum(samples) / len(samples) * 1000, 3),
+            "p99_ms": round(samples[min(len(samples) - 1, int(len(samples) * 0.99))] * 1000, 3),
+            "max_ms": round(samples[-1] * 1000, 3),
+            "at": time.time(),
+        }
+
+
+monitor = LoopLagMonitor()
+
+
+@asynccontextmanager
+async def bench_lifespan(app):
+    monitor.start()
+    yield
+    await monitor.stop()
+
+
+bench_router = APIRouter(lifespan=bench_lifespan, include_in_schema=False)
+
+
+@bench_router.get("/__bench/loop-lag")
+async def loop_lag(reset: bool = False):
+    return monitor.snapshot(reset=reset)
+
+
+app.include_router(bench_router)
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run the engine with an event-loop lag probe.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=9998)
+    args = parser.parse_args()
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,310 @@
+"""
+Local stand-in for the OpenAI endpoints the engine calls, so load tests cost nothing.
+
+Serves /v1/responses (plain and streamed, honouring json_schema output formats),
+/v1/chat/completions (streamed, for the LangChain chatbot), /v1/audio/speech,
+/v1/realtime/sessions and /v1/conversations (and their items). Latency, token rate and error
+injection are configurable:
+
+    python benchmarks/mock_openai.py --port 8765 --latency 0.3 --token-rate 80 --error-rate 0.01
+
+Point the engine at it with OPENAI_BASE_URL=http://127.0.0.1:8765/v1.
+GET /mock/stats returns the number of calls per endpoint.
+"""
+import os
+import sys
+import json
+import time
+import uuid
+import random
+import asyncio
+import argparse
+from collections import Counter
+from dataclasses import dataclass, asdict
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+import uvicorn
+
+WORDS = ("the student wrote a clear answer with good structure but should check verb tenses "
+         "and use more linking words to connect ideas across paragraphs").split()
+
+
+@dataclass
+class MockConfig:
+    latency: float = 0.3  # Seconds before the first token (or the whole reply for non-streamed calls)
+    jitter: float = 0.1  # Uniform +/- jitter on latency, in seconds
+    token_rate: float = 80.0  # Output tokens per second
+    output_tokens: int = 60  # Length of free-text replies
+    chunk_tokens: int = 4  # Tokens per streamed delta
+    audio_bytes_per_char: int = 400  # Size of the fake MP3 per input character
+    audio_rate: float = 64000.0  # Bytes per second of generated audio
+    error_rate: float = 0.0  # Fraction of calls answered with an error
+    error_status: int = 429  # 429 (with retry-after-ms) or a 5xx status
+
+
+config = MockConfig()
+calls: Counter = Counter()
+app = FastAPI(title="Mock OpenAI")
+
+
+def latency() -> float:
+    return max(0.0, config.latency + random.uniform(-config.jitter, config.jitter))
+
+
+def injected_error() -> JSONResponse | None:
+    if config.error_rate <= 0 or random.random() >= config.error_rate:
+        return None
+    calls["errors"] += 1
+    if config.error_status == 429:
+        return JSONResponse(
+            status_code=429,
+            headers={"retry-after-ms": "200"},
+            content={"error": {"message": "Rate limit reached (mock)", "type": "requests", "code": "rate_limit_exceeded"}},
+        )
+    return JSONResponse(
+        status_code=config.error_status,
+        content={"error": {"message": "Injected server error (mock)", "type": "server_error", "code": None}},
+    )
+
+
+def lorem(tokens: int) -> str:
+    return " ".join(random.choice(WORDS) for _ in range(tokens))
+
+
+def fake_instance(schema: dict, defs: dict, items: int):
+    """A value that matches a (strict) JSON schema; arrays of objects with an "id" are numbered 0..items-1."""
+    if "$ref" in schema:
+        schema = defs[schema["$ref"].split("/")[-1]]
+    if "anyOf" in schema:
+        schema = next((s for s in schema["anyOf"] if s.get("type") != "null"), schema["anyOf"][0])
+    kind = schema.get("type")
+    if kind == "object":
+        return {name: fake_instance(sub, defs, items) for name, sub in schema.get("properties", {}).items()}
+    if kind == "array":
+        values = [fake_instance(schema.get("items", {}), defs, items) for _ in range(items)]
+        for index, value in enumerate(values):
+            if isinstance(value, dict) and "id" in value:
+                value["id"] = index
+        return values
+    if kind == "integer":
+        return random.choice([0, 1, 3, 5])
+    if kind == "number":
+        return round(random.random() * 5, 2)
+    if kind == "boolean":
+        return True
+    if kind == "null":
+        return None
+    return lorem(8)
+
+
+def output_text(body: dict) -> str:
+    text_format = (body.get("text") or {}).get("format") or {}
+    if text_format.get("type") != "json_schema":
+        return lorem(config.output_tokens)
+    schema = text_format["schema"]
+    # Batch translation sends a JSON array; answer one item per input item.
+    items = 5
+    try:
+        parsed = json.loads(body.get("input") or "")
+        if isinstance(parsed, list):
+            items = len(parsed)
+    except (TypeError, ValueError):
+        pass
+    return json.dumps(fake_instance(schema, schema.get("$defs", {}), items), ensure_ascii=False)
+
+
+def chunks(text: str) -> list[str]:
+    words = text.split(" ")
+    size = max(1, config.chunk_tokens)
+    return [" ".join(words[i:i + size]) + (" " if i + size < len(words) else "") for i in range(0, len(words), size)]
+
+
+def usage(body: dict, text: str) -> dict:
+    prompt = f"{body.get('instructions') or ''}{body.get('input') or ''}"
+    input_tokens = len(prompt) // 4
+    cached = 0
+    if body.get("prompt_cache_key"):
+        # Pretend the instructions are cached after the first call, in 128-token blocks.
+        cached = (len(body.get("instructions") or "") // 4) // 128 * 128
+    output_tokens = len(text.split())
+    return {
+        "input_tokens": input_tokens,
+        "input_tokens_details": {"cached_tokens": min(cached, input_tokens)},
+        "output_tokens": output_tokens,
+        "output_tokens_details": {"reasoning_tokens": 0},
+        "total_tokens": input_tokens + output_tokens,
+    }
+
+
+def response_object(body: dict, response_id: str, message_id: str, text: str | None) -> dict:
+    done = text is not None
+    return {
+        "id": response_id,
+        "object": "response",
+        "created_at": int(time.time()),
+        "model": body.get("model", "mock"),
+        "status": "completed" if done else "in_progress",
+        "output": [{
+            "type": "message", "id": message_id, "status": "completed", "role": "assistant",
+            "content": [{"type": "output_text", "text": text, "annotations": []}],
+        }] if done else [],
+        "parallel_tool_calls": True,
+        "tool_choice": "auto",
+        "tools": [],
+        "usage": usage(body, text) if done else None,
+    }
+
+
+def sse(event: dict, name: str | None = None) -> str:
+    prefix = f"event: {name}\n" if name else ""
+    return f"{prefix}data: {json.dumps(event, ensure_ascii=False)}\n\n"
+
+
+@app.post("/v1/responses")
+async def responses(request: Request):
+    body = await request.json()
+    calls["responses"] += 1
+    if (error := injected_error()) is not None:
+        return error
+    text = output_text(body)
+    response_id, message_id = f"resp_{uuid.uuid4().hex}", f"msg_{uuid.uuid4().hex}"
+    if not body.get("stream"):
+        await asyncio.sleep(latency() + len(text.split()) / config.token_rate)
+        return response_object(body, response_id, message_id, text)
+
+    calls["responses_stream"] += 1
+
+    async def events():
+        sequence = 0
+        yield sse({"type": "response.created", "sequence_number": sequence, "response": response_object(body, response_id, message_id, None)}, "response.created")
+        await asyncio.sleep(latency())
+        for delta in chunks(text):
+            sequence += 1
+            yield sse({"type": "response.output_text.delta", "item_id": message_id, "output_index": 0, "content_index": 0,
+                       "delta": delta, "logprobs": [], "sequence_number": sequence}, "response.output_text.delta")
+            await asyncio.sleep(config.chunk_tokens / config.token_rate)
+        sequence += 1
+        yield sse({"type": "response.completed", "sequence_number": sequence, "response": response_object(body, response_id, message_id, text)}, "response.completed")
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    calls["chat_completions"] += 1
+    if (error := injected_error()) is not None:
+        return error
+    text = lorem(config.output_tokens)
+    completion_id, created, model = f"chatcmpl-{uuid.uuid4().hex}", int(time.time()), body.get("model", "mock")
+    if not body.get("stream"):
+        await asyncio.sleep(latency() + config.output_tokens / config.token_rate)
+        return {
+            "id": completion_id, "object": "chat.completion", "created": created, "model": model,
+            "choices": [{"index": 0, "message": {"role": "assistant", "content": text}, "finish_reason": "stop"}],
+            "usage": {"prompt_tokens": 100, "completion_tokens": config.output_tokens, "total_tokens": 100 + config.output_tokens},
+        }
+
+    def chunk(delta: dict, finish_reason: str | None = None) -> str:
+        return sse({"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model,
+                    "choices": [{"index": 0, "delta": delta, "finish_reason": finish_reason}]})
+
+    async def events():
+        await asyncio.sleep(latency())
+        yield chunk({"role": "assistant", "content": ""})
+        for delta in chunks(text):
+            yield chunk({"content": delta})
+            await asyncio.sleep(config.chunk_tokens / config.token_rate)
+        yield chunk({}, "stop")
+        if (body.get("stream_options") or {}).get("include_usage"):
+            yield sse({"id": completion_id, "object": "chat.completion.chunk", "created": created, "model": model, "choices": [],
+                       "usage": {"prompt_tokens": 100, "completion_tokens": config.output_tokens, "total_tokens": 100 + config.output_tokens}})
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(events(), media_type="text/event-stream")
+
+
+@app.post("/v1/audio/speech")
+async def speech(request: Request):
+    body = await request.json()
+    calls["audio_speech"] += 1
+    if (error := injected_error()) is not None:
+        return error
+    size = max(1024, len(body.get("input", "")) * config.audio_bytes_per_char)
+
+    async def audio():
+        await asyncio.sleep(latency())
+        sent, chunk_size = 0, 4096
+        while sent < size:
+            chunk = min(chunk_size, size - sent)
+            yield b"\xff\xfb" + os.urandom(chunk - 2)
+            sent += chunk
+            await asyncio.sleep(chunk / config.audio_rate)
+
+    return StreamingResponse(audio(), media_type="audio/mpeg")
+
+
+@app.post("/v1/realtime/sessions")
+async def realtime_sessions(request: Request):
+    body = await request.json()
+    calls["realtime_sessions"] += 1
+    if (error := injected_error()) is not None:
+        return error
+    await asyncio.sleep(latency())
+    expires_at = int(time.time()) + 60
+    return {
+        "id": f"sess_{uuid.uuid4().hex}",
+        "object": "realtime.session",
+        "model": body.get("model", "mock"),
+        "expires_at": expires_at,
+        "client_secret": {"value": f"ek_{uuid.uuid4().hex}", "expires_at": expires_at},
+    }
+
+
+@app.post("/v1/conversations")
+async def create_conversation():
+    calls["conversations_create"] += 1
+    if (error := injected_error()) is not None:
+        return error
+    await asyncio.sleep(latency())
+    return {"id": f"conv_{uuid.uuid4().hex}", "object": "conversation", "created_at": int(time.time()), "metadata": {}}
+
+
+@app.post("/v1/conversations/{conversation_id}/items")
+async def create_conversation_items(conversation_id: str, request: Request):
+    calls["conversation_items_create"] += 1
+    items = (await request.json()).get("items", [])
+    await asyncio.sleep(latency())
+    return {
+        "object": "list",
+        "data": [{**item, "id": f"msg_{uuid.uuid4().hex}", "status": "completed"} for item in items],
+        "first_id": None, "last_id": None, "has_more": False,
+    }
+
+
+@app.delete("/v1/conversations/{conversation_id}")
+async def delete_conversation(conversation_id: str):
+    calls["conversations_delete"] += 1
+    await asyncio.sleep(latency())
+    return {"id": conversation_id, "object": "conversation.deleted", "deleted": True}
+
+
+@app.get("/mock/stats")
+async def stats():
+    return {"config": asdict(config), "calls": dict(calls)}
+
+
+def main(argv: list[str] | None = None):
+    parser = argparse.ArgumentParser(description="Mock OpenAI server for load tests.")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=8765)
+    for name, value in asdict(MockConfig()).items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value)
+    args = parser.parse_args(argv)
+    for name in asdict(config):
+        setattr(config, name, getattr(args, name))
+    uvicorn.run(app, host=args.host, port=args.port, log_level="warning", access_log=False)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
@@ -0,0 +1,340 @@
+"""
+Offline load benchmark for the engine.
+
+Starts the mock OpenAI server (benchmarks/mock_openai.py) and the engine
+(benchmarks/app_server.py) pointed at it, drives each router's endpoints with a fixed
+number of concurrent clients, and reports p50/p95/p99 latency, time to first byte,
+requests per second, error rate and the engine's event-loop lag per scenario.
+
+    python benchmarks/run.py --concurrency 32 --duration 10
+    python benchmarks/run.py --scenarios translation,correction_stream --latency 0.5
+    python benchmarks/run.py --save-baseline benchmarks/baseline.json
+    python benchmarks/run.py --baseline benchmarks/baseline.json   # exits 1 on regression
+
+--target http://host:port benchmarks an engine that is already running instead
+(loop lag is only reported when it was started with app_server.py).
+"""
+import os
+import sys
+import json
+import time
+import random
+import socket
+import asyncio
+import argparse
+import platform
+import subprocess
+import tempfile
+from dataclasses import dataclass, field
+from typing import Callable
+import httpx
+
+HERE = os.path.dirname(os.path.abspath(__file__))
+sys.path.insert(0, HERE)
+from mock_openai import MockConfig
+
+PHRASES = [
+    "apple", "library", "How are you?", "I would like a cup of tea.", "Where is the station?",
+    "beautiful", "She has been studying English for three years.", "homework", "Can you help me?",
+    "The weather is nice today.", "friendship", "I am looking forward to the weekend.",
+]
+ESSAY = ("Last summer I visited my grandparents in the countryside. Every morning we goed to the market "
+         "and buyed fresh vegetables. I learned how to cook traditional food and I enjoyed it very much. ") * 4
+
+
+def text(unique: bool) -> str:
+    phrase = random.choice(PHRASES)
+    return f"{phrase} ({random.getrandbits(48):x})" if unique else phrase
+
+
+@dataclass
+class Scenario:
+    name: str
+    router: str  # Name in Endpoint.ROUTERS
+    method: str
+    path: str
+    body: Callable[[bool], dict] | None = None
+    params: Callable[[bool], dict] | None = None
+    stream: bool = False
+
+
+SCENARIOS = [
+    Scenario("root", "app", "GET", "/"),
+    Scenario("prompts", "prompts", "GET", "/prompts"),
+    Scenario("speech_stats", "del_speech_files", "GET", "/del-speech-files/stats"),
+    Scenario("translation", "translation", "POST", "/translation",
+             body=lambda u: {"text": text(u), "target_language": "Arabic"}),
+    Scenario("translation_batch", "translation", "POST", "/translation/batch",
+             body=lambda u: {"items": [{"text": text(u), "target_language": "Arabic"} for _ in range(20)]}),
+    Scenario("correction", "correction", "POST", "/correction",
+             body=lambda u: {"question": "Describe your last holiday.", "text": ESSAY + text(u)}),
+    Scenario("correction_stream", "correction", "POST", "/correction/stream", stream=True,
+             body=lambda u: {"question": "Describe your last holiday.", "text": ESSAY + text(u)}),
+    Scenario("text_to_speech", "text_to_speech", "POST", "/text-to-speech",
+             body=lambda u: {"text": text(u), "id": 1, "voice": "nova", "accent": "British"}),
+    Scenario("text_to_speech_stream", "text_to_speech", "POST", "/text-to-speech/stream", stream=True,
+             body=lambda u: {"text": text(u), "id": 1, "voice": "nova", "accent": "British"}),
+    Scenario("audio_book", "audio_book", "POST", "/audio-book",
+             body=lambda u: {"text": text(u), "id": 1}),
+    Scenario("audio_book_stream", "audio_book", "POST", "/audio-book/stream", stream=True,
+             body=lambda u: {"text": text(u), "id": 1}),
+    Scenario("chatbot_stream", "chatbot", "POST", "/chatbot/stream", stream=True,
+             body=lambda u: {"message": text(u), "conversation_history": [
+                 {"role": "user", "content": "Hi!"}, {"role": "assistant", "content": "Hello! How can I help?"}]}),
+    Scenario("new_chatbot", "new_chatbot", "POST", "/chatbot",
+             params=lambda u: {"conversation_id": "conv_bench", "user_message": text(u)}),
+    Scenario("new_conversation", "new_chatbot", "GET", "/new_conversation"),
+    Scenario("realtime_session", "realtime", "POST", "/realtime/session",
+             body=lambda u: {"level": "Intermediate", "theme": "Travel", "personality": "Friendly Mentor"}),
+    Scenario("correction_job_submit", "correction_jobs", "POST", "/correction/jobs",
+             body=lambda u: {"items": [{"question": "Describe your last holiday.", "text": ESSAY}], "batch_file": True}),
+]
+
+
+@dataclass
+class Result:
+    latencies: list[float] = field(default_factory=list)
+    ttfb: list[float] = field(default_factory=list)
+    errors: dict[str, int] = field(default_factory=dict)
+
+    def error(self, kind: str):
+        self.errors[kind] = self.errors.get(kind, 0) + 1
+
+
+def percentile(values: list[float], q: float) -> float | None:
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[min(len(ordered) - 1, int(round(q / 100 * (len(ordered) - 1))))]
+
+
+def ms(value: float | None) -> float | None:
+    return round(value * 1000, 2) if value is not None else None
+
+
+async def request_once(client: httpx.AsyncClient, scenario: Scenario, unique: bool, result: Result):
+    kwargs = {}
+    if scenario.body is not None:
+        kwargs["json"] = scenario.body(unique)
+    if scenario.params is not None:
+        kwargs["params"] = scenario.params(unique)
+    started = time.perf_counter()
+    try:
+        async with client.stream(scenario.method, scenario.path, **kwargs) as response:
+            first, last = None, b""
+            async for chunk in response.aiter_raw():
+                if first is None and chunk:
+                    first = time.perf_counter()
+                last = chunk or last
+            finished = time.perf_counter()
+            if response.status_code >= 400:
+                result.error(str(response.status_code))
+                return
+            # An SSE stream can end with an error event instead of a status code.
+            if scenario.stream and response.headers.get("content-type", "").startswith("text/event-stream") and b'"error"' in last:
+                result.error("stream_error")
+                return
+    except httpx.HTTPError as e:
+        result.error(type(e).__name__)
+        return
+    result.latencies.append(finished - started)
+    result.ttfb.append((first or finished) - started)
+
+
+async def run_scenario(client: httpx.AsyncClient, scenario: Scenario, concurrency: int, duration: float,
+                       unique_ratio: float, warmup: int) -> dict:
+    result = Result()
+    for _ in range(warmup):
+        await request_once(client, scenario, random.random() < unique_ratio, Result())
+    await lag(client, reset=True)
+    stop_at = time.perf_counter() + duration
+
+    async def worker():
+        while time.perf_counter() < stop_at:
+            await request_once(client, scenario, random.random() < unique_ratio, result)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(worker() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    completed = len(result.latencies)
+    failed = sum(result.errors.values())
+    return {
+        "requests": completed + failed,
+        "errors": result.errors,
+        "error_rate": round(failed / (completed + failed), 4) if completed + failed else None,
+        "rps": round(completed / elapsed, 2),
+        "p50_ms": ms(percentile(result.latencies, 50)),
+        "p95_ms": ms(percentile(result.latencies, 95)),
+        "p99_ms": ms(percentile(result.latencies, 99)),
+        "ttfb_p50_ms": ms(percentile(result.ttfb, 50)) if scenario.stream else None,
+        "ttfb_p95_ms": ms(percentile(result.ttfb, 95)) if scenario.stream else None,
+        "loop_lag": await lag(client),
+    }
+
+
+async def lag(client: httpx.AsyncClient, reset: bool = False) -> dict | None:
+    try:
+        response = await client.get("/__bench/loop-lag", params={"reset": str(reset).lower()})
+        return response.json() if response.status_code == 200 else None
+    except httpx.HTTPError:
+        return None
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+async def wait_ready(url: str, process: subprocess.Popen, timeout: float = 60):
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient() as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"{process.args} exited with {process.returncode}")
+            try:
+                await client.get(url)
+                return
+            except httpx.HTTPError:
+                await asyncio.sleep(0.2)
+    raise RuntimeError(f"{url} did not come up within {timeout}s")
+
+
+def start_servers(args, workdir: str) -> tuple[str, list[subprocess.Popen]]:
+    mock_port, app_port = free_port(), free_port()
+    mock_args = [sys.executable, os.path.join(HERE, "mock_openai.py"), "--port", str(mock_port)]
+    for name in MockConfig.__dataclass_fields__:
+        mock_args += [f"--{name.replace('_', '-')}", str(getattr(args, name))]
+    base_url = f"http://127.0.0.1:{mock_port}/v1"
+    env = {
+        **os.environ,
+        "OPEN_AI_KEY": "sk-bench",
+        "OPENAI_BASE_URL": base_url,
+        "OPENAI_API_BASE": base_url,
+        "SPEECH_DIR": os.path.join(workdir, "speechfiles"),
+        "CORRECTION_JOBS_DIR": os.path.join(workdir, "correction_jobs"),
+        "TRANSLATION_CACHE_DB": os.path.join(workdir, "translation_cache.db"),
+        "REALTIME_SESSION_STORE": "memory",
+        # Every simulated client shares one address; measure the service, not the per-client limits.
+        "ADMISSION_INTERACTIVE_RATE": os.environ.get("ADMISSION_INTERACTIVE_RATE", "0"),
+        "ADMISSION_BULK_RATE": os.environ.get("ADMISSION_BULK_RATE", "0"),
+    }
+    output = None if args.verbose else subprocess.DEVNULL
+    mock = subprocess.Popen(mock_args, stdout=output, stderr=output)
+    engine = subprocess.Popen([sys.executable, os.path.join(HERE, "app_server.py"), "--port", str(app_port)],
+                              env=env, stdout=output, stderr=output)
+    return f"http://127.0.0.1:{app_port}", [mock, engine]
+
+
+def compare(results: dict, baseline: dict, threshold: float) -> list[str]:
+    """Scenarios whose p95 latency, throughput or error rate got worse than the baseline by more than threshold."""
+    regressions = []
+    for name, current in results["scenarios"].items():
+        base = baseline.get("scenarios", {}).get(name)
+        if not base:
+            continue
+        notes = []
+        if base.get("p95_ms") and current.get("p95_ms") and current["p95_ms"] > base["p95_ms"] * (1 + threshold):
+            notes.append(f"p95 {base['p95_ms']} -> {current['p95_ms']} ms")
+        if base.get("rps") and current["rps"] < base["rps"] * (1 - threshold):
+            notes.append(f"rps {base['rps']} -> {current['rps']}")
+        if (current.get("error_rate") or 0) > (base.get("error_rate") or 0) + 0.01:
+            notes.append(f"errors {base.get('error_rate') or 0} -> {current['error_rate']}")
+        if notes:
+            regressions.append(f"{name}: " + ", ".join(notes))
+    return regressions
+
+
+def print_table(results: dict, baseline: dict | None):
+    columns = ["scenario", "reqs", "err%", "rps", "p50", "p95", "p99", "ttfb50", "ttfb95", "lag p99", "lag max"]
+    print(" ".join(f"{c:>10}" if i else f"{c:<22}" for i, c in enumerate(columns)))
+    for name, r in results["scenarios"].items():
+        lag_stats = r.get("loop_lag") or {}
+        row = [r["requests"], round((r["error_rate"] or 0) * 100, 2), r["rps"], r["p50_ms"], r["p95_ms"], r["p99_ms"],
+               r["ttfb_p50_ms"], r["ttfb_p95_ms"], lag_stats.get("p99_ms"), lag_stats.get("max_ms")]
+        print(f"{name:<22} " + " ".join(f"{'-' if v is None else v:>10}" for v in row))
+        base = (baseline or {}).get("scenarios", {}).get(name)
+        if base and base.get("p95_ms") and r.get("p95_ms"):
+            print(f"{'':<22} {'baseline':>10} p95 {base['p95_ms']} ms ({(r['p95_ms'] / base['p95_ms'] - 1) * 100:+.1f}%), "
+                  f"rps {base['rps']} ({(r['rps'] / base['rps'] - 1) * 100 if base['rps'] else 0:+.1f}%)")
+
+
+async def main_async(args) -> int:
+    selected = [s for s in SCENARIOS if not args.scenarios or s.name in args.scenarios or s.router in args.scenarios]
+    if not selected:
+        print(f"No scenarios match {args.scenarios}; available: {', '.join(s.name for s in SCENARIOS)}")
+        return 2
+    processes = []
+    with tempfile.TemporaryDirectory(prefix="ai-engine-bench-") as workdir:
+        try:
+            if args.target:
+                target = args.target.rstrip("/")
+            else:
+                target, processes = start_servers(args, workdir)
+                await wait_ready(f"{target}/", processes[1])
+            limits = httpx.Limits(max_connections=args.concurrency * 2, max_keepalive_connections=args.concurrency * 2)
+            async with httpx.AsyncClient(base_url=target, limits=limits, timeout=args.timeout) as client:
+                results = {
+                    "settings": {
+                        "concurrency": args.concurrency, "duration": args.duration, "unique": args.unique,
+                        "mock": {name: getattr(args, name) for name in MockConfig.__dataclass_fields__},
+                    },
+                    "environment": {"python": platform.python_version(), "platform": platform.platform()},
+                    "started_at": time.time(),
+                    "scenarios": {},
+                }
+                for scenario in selected:
+                    print(f"Running {scenario.name} ...", file=sys.stderr)
+                    results["scenarios"][scenario.name] = await run_scenario(
+                        client, scenario, args.concurrency, args.duration, args.unique, args.warmup)
+        finally:
+            for process in processes:
+                process.terminate()
+            for process in processes:
+                try:
+                    process.wait(timeout=10)
+                except subprocess.TimeoutExpired:
+                    process.kill()
+
+    baseline = None
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as file:
+            baseline = json.load(file)
+    print_table(results, baseline)
+    for path in filter(None, (args.output, args.save_baseline)):
+        with open(path, "w", encoding="utf-8") as file:
+            json.dump(results, file, indent=2)
+        print(f"Wrote {path}", file=sys.stderr)
+    if baseline is not None:
+        regressions = compare(results, baseline, args.threshold)
+        if regressions:
+            print("\nRegressions against the baseline:")
+            for line in regressions:
+                print(f"  {line}")
+            return 1
+        print("\nNo regressions against the baseline.")
+    return 0
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load-test the engine against a local mock OpenAI server.")
+    parser.add_argument("--scenarios", type=lambda v: [s.strip() for s in v.split(",") if s.strip()], default=[],
+                        help="Comma-separated scenario or router names (default: all)")
+    parser.add_argument("--concurrency", type=int, default=16)
+    parser.add_argument("--duration", type=float, default=10, help="Seconds per scenario")
+    parser.add_argument("--warmup", type=int, default=3, help="Requests per scenario before measuring")
+    parser.add_argument("--unique", type=float, default=0.5, help="Fraction of requests with text no cache has seen")
+    parser.add_argument("--timeout", type=float, default=120)
+    parser.add_argument("--target", help="Benchmark an already running engine at this URL")
+    parser.add_argument("--output", help="Write the results as JSON")
+    parser.add_argument("--save-baseline", help="Write the results as the new baseline")
+    parser.add_argument("--baseline", help="Compare against this baseline; exit 1 on regression")
+    parser.add_argument("--threshold", type=float, default=0.1, help="Allowed relative slowdown before a regression")
+    parser.add_argument("--verbose", action="store_true", help="Show server output")
+    for name, value in MockConfig().__dict__.items():
+        parser.add_argument(f"--{name.replace('_', '-')}", type=type(value), default=value, help="Mock server setting")
+    sys.exit(asyncio.run(main_async(parser.parse_args())))
+
+
+if __name__ == "__main__":
+    main()
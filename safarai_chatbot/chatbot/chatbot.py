@@ -1,6 +1,6 @@
 import os
 import dotenv
-from langchain_openai import ChatOpenAI
+from functools import lru_cache
 from langchain_core.messages import (
     SystemMessage,
     HumanMessage,
@@ -10,12 +10,19 @@ from langchain_core.messages import (
 dotenv.load_dotenv()
 key = os.getenv("OPEN_AI_KEY")
 
-chat = ChatOpenAI(
-    openai_api_key=key,
-    model_name="gpt-4.1",
-    streaming=True,
-    temperature=0.3,
-)
+
+@lru_cache(maxsize=1)
+def get_chat():
+    """Build the ChatOpenAI client on first use; importing langchain_openai takes most of a second."""
+    from langchain_openai import ChatOpenAI
+    return ChatOpenAI(
+        openai_api_key=key,
+        model_name="gpt-4.1",
+        streaming=True,
+        # Adds token usage to the last streamed chunk, for the metrics endpoint.
+        stream_usage=True,
+        temperature=0.3,
+    )
 
 # System prompt
 system_prompt = SystemMessage(content="""
@@ -30,4 +37,8 @@ You're talking to kids or teenagers.
 
 def stream_response(messages: list):
     """Takes conversation history and gets response from LangChain OpenAI wrapper."""
-    return chat.stream(messages)
+    return get_chat().stream(messages)
+
+def astream_response(messages: list):
+    """Async version of stream_response: yields chunks on the event loop without a worker thread."""
+    return get_chat().astream(messages)
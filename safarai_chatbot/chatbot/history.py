@@ -0,0 +1,134 @@
+import os
+import math
+import hashlib
+import logging
+from collections import OrderedDict
+from util.complition_model import complition_model
+from util.singleflight import SingleFlight
+from util.tokens import count_tokens
+
+logger = logging.getLogger(__name__)
+
+CHAT_HISTORY_TOKEN_BUDGET = int(os.getenv("CHAT_HISTORY_TOKEN_BUDGET", "3000"))
+# Old turns are folded in blocks of this many messages, so the fold point (and with it
+# the summary) only moves every few turns instead of on every turn.
+CHAT_HISTORY_FOLD_STEP = int(os.getenv("CHAT_HISTORY_FOLD_STEP", "6"))
+# The last user/assistant exchange is always replayed verbatim if it fits the budget.
+CHAT_HISTORY_MIN_RECENT = 2
+CHAT_SUMMARY_MODEL = os.getenv("CHAT_SUMMARY_MODEL", "gpt-4.1-mini")
+CHAT_SUMMARY_CACHE_SIZE = int(os.getenv("CHAT_SUMMARY_CACHE_SIZE", "2048"))
+
+SUMMARY_PROMPT = """You keep a running summary of a conversation between an English-learning student and their tutor.
+You are given the previous summary (possibly empty) and the newest messages.
+Return an updated summary in at most 150 words that keeps: the student's level and goals,
+words and grammar points already explained, recurring mistakes, and any open question.
+Write in English. Return only the summary."""
+
+
+def message_tokens(message: dict) -> int:
+    # A few tokens of per-message framing on top of the content.
+    return count_tokens(message.get("content", "") or "") + 4
+
+
+def _message_digest(previous: bytes, message: dict) -> bytes:
+    digest = hashlib.sha256(previous)
+    digest.update(message.get("role", "").encode("utf-8"))
+    digest.update(b"\0")
+    digest.update((message.get("content", "") or "").encode("utf-8"))
+    return digest.digest()
+
+
+class HistoryManager:
+    """
+    Keeps the conversation history sent to the model within a token budget.
+    The newest turns that fit in `budget` tokens are replayed verbatim. Older turns are
+    folded into a rolling summary. Summaries are cached by a hash of the folded prefix,
+    and a new summary extends the longest cached one, so each turn is summarized once.
+    """
+
+    def __init__(self, budget: int = CHAT_HISTORY_TOKEN_BUDGET, fold_step: int = CHAT_HISTORY_FOLD_STEP,
+                 model: str = CHAT_SUMMARY_MODEL, cache_size: int = CHAT_SUMMARY_CACHE_SIZE):
+        self.budget = budget
+        self.fold_step = max(1, fold_step)
+        self.model = model
+        self.cache_size = cache_size
+        self._summaries: OrderedDict[bytes, str] = OrderedDict()
+        self._flight = SingleFlight()
+
+    def fold_point(self, history: list) -> int:
+        """Number of leading messages that must be folded into the summary."""
+        used = 0
+        keep_from = len(history)
+        for index in range(len(history) - 1, -1, -1):
+            used += message_tokens(history[index])
+            if used > self.budget:
+                break
+            keep_from = index
+        if keep_from == 0:
+            return 0
+        rounded = math.ceil(keep_from / self.fold_step) * self.fold_step
+        # Rounding up must not swallow the latest exchange, unless it alone is over budget.
+        return max(keep_from, min(rounded, len(history) - CHAT_HISTORY_MIN_RECENT))
+
+    async def compact(self, history: list) -> tuple[str | None, list]:
+        """
+        Split history into (summary of older turns or None, recent turns to replay).
+        If summarizing fails the older turns are dropped rather than failing the chat.
+        """
+        fold = self.fold_point(history)
+        if fold == 0:
+            return None, list(history)
+        try:
+            summary = await self.summary_for(history[:fold])
+        except Exception as e:
+            logger.warning(f"History summary failed, dropping {fold} old messages: {e}")
+            summary = None
+        return summary, list(history[fold:])
+
+    async def summary_for(self, folded: list) -> str:
+        digests = []
+        digest = b""
+        for message in folded:
+            digest = _message_digest(digest, message)
+            digests.append(digest)
+        key = digests[-1]
+        cached = self._get(key)
+        if cached is not None:
+            return cached
+        return await self._flight.do(key, lambda: self._summarize(folded, digests))
+
+    async def _summarize(self, folded: list, digests: list) -> str:
+        # Start from the longest prefix we already summarized.
+        previous, start = "", 0
+        for index in range(len(digests) - 2, -1, -1):
+            cached = self._get(digests[index])
+            if cached is not None:
+                previous, start = cached, index + 1
+                break
+        transcript = "\n".join(f"{m.get('role', 'user')}: {m.get('content', '')}" for m in folded[start:])
+        response = await complition_model(
+            model=self.model,
+            instructions=SUMMARY_PROMPT,
+            input=f"Previous summary:\n{previous or '(none)'}\n\nNew messages:\n{transcript}",
+            max_output_tokens=300,
+            temperature=0.2,
+        )
+        summary = response.output_text.strip()
+        self._put(digests[-1], summary)
+        logger.info(f"Summarized {len(folded) - start} messages on top of {start} already summarized")
+        return summary
+
+    def _get(self, key: bytes) -> str | None:
+        summary = self._summaries.get(key)
+        if summary is not None:
+            self._summaries.move_to_end(key)
+        return summary
+
+    def _put(self, key: bytes, summary: str):
+        self._summaries[key] = summary
+        self._summaries.move_to_end(key)
+        while len(self._summaries) > self.cache_size:
+            self._summaries.popitem(last=False)
+
+
+history_manager = HistoryManager()
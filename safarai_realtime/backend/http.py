@@ -0,0 +1,51 @@
+# Shared outbound HTTP pool for the realtime router
+import os
+import ssl
+import certifi
+import aiohttp
+from contextlib import asynccontextmanager
+
+REALTIME_HTTP_LIMIT = int(os.getenv("REALTIME_HTTP_LIMIT", "100"))
+REALTIME_HTTP_LIMIT_PER_HOST = int(os.getenv("REALTIME_HTTP_LIMIT_PER_HOST", "50"))
+REALTIME_HTTP_KEEPALIVE = float(os.getenv("REALTIME_HTTP_KEEPALIVE", "60"))
+REALTIME_HTTP_DNS_TTL = int(os.getenv("REALTIME_HTTP_DNS_TTL", "300"))
+REALTIME_HTTP_TIMEOUT = float(os.getenv("REALTIME_HTTP_TIMEOUT", "20"))
+REALTIME_HTTP_CONNECT_TIMEOUT = float(os.getenv("REALTIME_HTTP_CONNECT_TIMEOUT", "5"))
+
+_session: aiohttp.ClientSession | None = None
+
+
+def _create_session() -> aiohttp.ClientSession:
+    # One verified TLS context for the whole pool, so sessions can be resumed across connections.
+    ssl_context = ssl.create_default_context(cafile=certifi.where())
+    connector = aiohttp.TCPConnector(
+        ssl=ssl_context,
+        limit=REALTIME_HTTP_LIMIT,
+        limit_per_host=REALTIME_HTTP_LIMIT_PER_HOST,
+        keepalive_timeout=REALTIME_HTTP_KEEPALIVE,
+        ttl_dns_cache=REALTIME_HTTP_DNS_TTL,
+    )
+    timeout = aiohttp.ClientTimeout(total=REALTIME_HTTP_TIMEOUT, sock_connect=REALTIME_HTTP_CONNECT_TIMEOUT)
+    return aiohttp.ClientSession(connector=connector, timeout=timeout)
+
+
+def get_http_session() -> aiohttp.ClientSession:
+    """Return the pooled session, creating it on first use if the lifespan has not run (e.g. scripts)."""
+    global _session
+    if _session is None or _session.closed:
+        _session = _create_session()
+    return _session
+
+
+async def close_http_session():
+    global _session
+    if _session is not None and not _session.closed:
+        await _session.close()
+    _session = None
+
+
+@asynccontextmanager
+async def http_session_lifespan(app):
+    get_http_session()
+    yield
+    await close_http_session()
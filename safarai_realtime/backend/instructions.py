@@ -0,0 +1,52 @@
+# Realtime tutor instructions, built from config/ and memoized per parameter combination
+import json
+import logging
+from functools import lru_cache
+from util.prompts import prompt_registry
+
+logger = logging.getLogger(__name__)
+
+TEMPLATE_PROMPT = "realtime_tutor_prompt"
+PROFILES_PROMPT = "realtime_tutor_profiles"
+TUTOR_INSTRUCTIONS_CACHE_SIZE = 1024
+
+
+@lru_cache(maxsize=4)
+def _profiles(version: str) -> dict:
+    """Parsed level/theme/personality tables; re-parsed only when the file changes."""
+    return json.loads(prompt_registry.text(PROFILES_PROMPT))
+
+
+@lru_cache(maxsize=TUTOR_INSTRUCTIONS_CACHE_SIZE)
+def _build(level: str, theme: str, personality: str, topic: str, template_version: str, profiles_version: str) -> str:
+    profiles = _profiles(profiles_version)
+    personalities = profiles["personalities"]
+    logger.debug(f"Building tutor instructions for level={level}, theme={theme}, personality={personality}, topic={topic!r}")
+    return prompt_registry.text(TEMPLATE_PROMPT).format(
+        personality=personality,
+        personality_style=personalities.get(personality, personalities[profiles["default_personality"]]),
+        level=level,
+        level_instructions=profiles["levels"].get(level, ""),
+        theme=theme,
+        theme_focus=profiles["themes"].get(theme, ""),
+        topic=topic if topic else "None - use general theme topics",
+        teaching_approach=personalities.get(personality, ""),
+    )
+
+
+def tutor_instructions(level: str, theme: str, personality: str, topic: str = "") -> str:
+    """
+    Instructions for a realtime tutor session.
+    Each (level, theme, personality, topic) variant is formatted once and then served
+    from an LRU cache. The prompt versions are part of the key, so editing the files
+    under config/ takes effect without clearing anything.
+    """
+    return _build(
+        level, theme, personality, topic,
+        prompt_registry.get(TEMPLATE_PROMPT).version,
+        prompt_registry.get(PROFILES_PROMPT).version,
+    )
+
+
+def cache_info():
+    return _build.cache_info()
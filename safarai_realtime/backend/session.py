@@ -1,22 +1,53 @@
 # backend.py
 import os
 import time
+import asyncio
+import logging
 import aiohttp
 from fastapi import APIRouter, Request
 from fastapi.responses import JSONResponse, FileResponse
 from dotenv import load_dotenv
 import uvicorn
+from contextlib import asynccontextmanager
+from dataclasses import asdict
+from .http import get_http_session, http_session_lifespan
+from .store import SessionRecord, SessionReaper, create_session_store
+from .instructions import tutor_instructions
+from util.prompts import prompt_registry_lifespan
+from util import metrics
 
 load_dotenv()
+logger = logging.getLogger(__name__)
 
 OPENAI_API_KEY = os.getenv("OPEN_AI_KEY")
-OPENAI_REALTIME_URL = "https://api.openai.com/v1/realtime/sessions"
+# Follows OPENAI_BASE_URL (e.g. a local mock for benchmarks) unless set explicitly.
+OPENAI_REALTIME_URL = os.getenv(
+    "OPENAI_REALTIME_URL",
+    os.getenv("OPENAI_BASE_URL", "https://api.openai.com/v1").rstrip("/") + "/realtime/sessions",
+)
 
 
-realtime = APIRouter(tags=["realtime"], prefix="/realtime")
+session_store = create_session_store()
+session_reaper = SessionReaper(session_store)
 
 
-active_sessions = {}  # Store session IDs temporarily
+async def count_sessions():
+    metrics.realtime_sessions_active.set(await session_store.count())
+
+
+metrics.add_collector(count_sessions)
+
+
+@asynccontextmanager
+async def realtime_lifespan(app):
+    async with http_session_lifespan(app), prompt_registry_lifespan(app):
+        session_reaper.start()
+        yield
+        await session_reaper.stop()
+        await session_store.close()
+
+
+realtime = APIRouter(tags=["realtime"], prefix="/realtime", lifespan=realtime_lifespan)
 
 
 @realtime.get("/new")
@@ -36,108 +67,47 @@ async def create_session(request: Request):
     topic = data.get("topic", "")
     personality = data.get("personality", "Friendly Mentor")
     avatar = data.get("avatar", "friendly")
-    print(f"Creating session for level: {level}, theme: {theme}, topic: {topic}, personality: {personality}, avatar: {avatar}")
-
-    level_instructions = {
-        "Beginner": "Use very simple English, short sentences, and speak slowly. Avoid difficult vocabulary. Encourage the student gently.",
-        "Intermediate": "Use everyday English, with some new vocabulary. Ask questions, correct mistakes, and explain grammar in simple terms.",
-        "Advanced": "Use natural, fluent, and more complex English. Challenge the student with idioms, advanced grammar, and deeper discussions."
-    }
-    theme_prompts = {
-        "Daily Life": "Talk about everyday routines, shopping, food, family, housing, and errands.",
-        "Travel": "Discuss destinations, flights, hotels, itineraries, directions, and travel experiences.",
-        "Work/Business": "Discuss workplaces, meetings, emails, presentations, negotiations, and career goals.",
-        "Hobbies": "Talk about free-time activities, sports, arts, collections, and personal interests.",
-        "School/University": "Discuss classes, assignments, majors, study tips, exams, and campus life.",
-        "Culture & Society": "Discuss customs, festivals, news, values, traditions, and social issues with sensitivity."
-    }
+    logger.info(f"Creating session for level: {level}, theme: {theme}, topic: {topic}, personality: {personality}, avatar: {avatar}")
 
-    personality_instructions = {
-        "Friendly Mentor": "Be warm, encouraging, and supportive. Use a gentle, caring tone. Celebrate small victories and provide positive reinforcement. Use phrases like 'Great job!' and 'You're doing wonderfully!'",
-        "Professional Coach": "Be structured, clear, and goal-oriented. Focus on practical improvement and measurable progress. Use business-like language and provide specific feedback. Be direct but respectful.",
-        "Casual Friend": "Be relaxed, informal, and conversational. Use everyday language, slang when appropriate, and keep things light and fun. Make jokes and use casual expressions like 'Hey there!' and 'No worries!'",
-        "Academic Expert": "Be precise, detailed, and scholarly. Use formal language and provide thorough explanations. Focus on grammar rules, vocabulary expansion, and linguistic accuracy. Be patient with complex explanations.",
-        "Energetic Guide": "Be enthusiastic, dynamic, and motivating. Use exclamation points, energetic language, and motivational phrases. Keep the energy high and encourage active participation. Use phrases like 'Let's go!' and 'You've got this!'",
-        "Patient Teacher": "Be calm, understanding, and methodical. Take time to explain things clearly and repeat when necessary. Use a soothing tone and be very patient with mistakes. Provide gentle guidance and reassurance."
-    }
+    instruction = tutor_instructions(level, theme, personality, topic)
 
-    print(f"Creating session for level: {level}, theme: {theme}")
-    print(f"Level instructions: {level_instructions.get(level, '')}")
-    print(f"Theme focus: {theme_prompts.get(theme, '')}")
-    if topic:
-        print(f"Specific topic: {topic}")
-
-    instruction = f"""You are "Safar AI", an English speaking tutor with the personality of a {personality}. Your goal is to help students improve their spoken English through engaging, personality-driven conversations.
-
-**Your Personality & Teaching Style:**
-{personality_instructions.get(personality, personality_instructions["Friendly Mentor"])}
-
-**Core Teaching Principles:**
-- Start and maintain engaging, human-like discussions on everyday topics.
-- If the student makes a grammatical or pronunciation mistake, correct them appropriately based on your personality style.
-- Encourage students to express themselves and ask follow-up questions to keep the conversation flowing.
-- Always provide constructive feedback and motivate students to keep practicing.
-
-**Correction Guidelines - IMPORTANT:**
-- **Limit corrections per word**: If a student struggles with a word, correct it maximum 2-3 times, then move on.
-- **Focus on communication**: Prioritize understanding and communication over perfect pronunciation.
-- **Don't obsess over perfection**: If the student's pronunciation is understandable, don't keep correcting the same word.
-- **Mix corrections with encouragement**: After 2-3 attempts, praise their effort and continue the conversation.
-- **Choose your battles**: Only correct the most important mistakes, not every small error.
-
-**Important Guidelines:**
-- Always follow the user's selected English level when providing feedback and corrections.
-- Use the appropriate level instructions to guide the conversation and support the user's learning.
-- Be patient and encouraging, especially with beginners who may need more support.
-- Adapt your language and explanations based on the user's proficiency and comfort level.
-- Keep the conversation engaging and fun to motivate the user to practice more.
-- **Remember**: The goal is fluent communication, not perfect pronunciation. Don't let corrections interrupt the flow of conversation.
-
-**Session Details:**
-- Student's level: {level}
-- Level instructions: {level_instructions.get(level, "")}
-- Conversation theme: {theme}
-- Theme focus: {theme_prompts.get(theme, "")}
-- Specific topic: {topic if topic else "None - use general theme topics"}
-- Your personality: {personality}
-- Teaching approach: {personality_instructions.get(personality, "")}
-
-Remember to embody your {personality} personality throughout the entire conversation while maintaining effective English teaching practices.
-"""
-
-    import ssl
-    ssl_context = ssl.create_default_context()
-    ssl_context.check_hostname = False
-    ssl_context.verify_mode = ssl.CERT_NONE
-    
-    connector = aiohttp.TCPConnector(ssl=ssl_context)
-    async with aiohttp.ClientSession(connector=connector) as session:
-        async with session.post(
-            OPENAI_REALTIME_URL,
-            headers={
-                "Authorization": f"Bearer {OPENAI_API_KEY}",
-                "Content-Type": "application/json",
-            },
-            json={
-            "model": "gpt-realtime",
-            "modalities": ["audio", "text"],
-            "instructions": instruction },
-        ) as resp:
-            if resp.status != 200:
-                return JSONResponse(
-                    status_code=resp.status,
-                    content={"error": await resp.text()},
-                )
-
-            data = await resp.json()
-            session_id = data.get("id")
-            print(f"Created session with ID: {session_id}")
-            if session_id:
-                data["last_activity"] = time.time()
-                active_sessions[session_id] = data
-                print(f"Stored session in active_sessions. Total sessions: {len(active_sessions)}")
-                print(f"Active session IDs: {list(active_sessions.keys())}")
-            return data
+    session = get_http_session()
+    try:
+        with metrics.UpstreamTimer("realtime.sessions", "gpt-realtime") as timer:
+            async with session.post(
+                OPENAI_REALTIME_URL,
+                headers={
+                    "Authorization": f"Bearer {OPENAI_API_KEY}",
+                    "Content-Type": "application/json",
+                },
+                json={
+                "model": "gpt-realtime",
+                "modalities": ["audio", "text"],
+                "instructions": instruction },
+            ) as resp:
+                if resp.status != 200:
+                    timer.outcome = "error"
+                    return JSONResponse(
+                        status_code=resp.status,
+                        content={"error": await resp.text()},
+                    )
+                data = await resp.json()
+
+        session_id = data.get("id")
+        logger.info(f"Created session with ID: {session_id}")
+        if session_id:
+            await session_store.add(SessionRecord.from_provider(
+                data, level=level, theme=theme, personality=personality
+            ))
+            data["last_activity"] = time.time()
+            logger.debug(f"Stored session {session_id} in session store")
+        return data
+    except asyncio.TimeoutError:
+        logger.warning("Timed out creating realtime session")
+        return JSONResponse(status_code=504, content={"error": "Timed out creating realtime session"})
+    except aiohttp.ClientError as e:
+        logger.error(f"Error creating realtime session: {str(e)}")
+        return JSONResponse(status_code=502, content={"error": f"Error creating realtime session: {str(e)}"})
 
 
 @realtime.post("/keep-alive")
@@ -146,19 +116,18 @@ async def keep_alive(request: Request):
     data = await request.json()
     session_id = data.get("session_id")
     
-    print(f"Keep-alive request for session: {session_id}")
-    print(f"Active sessions: {list(active_sessions.keys())}")
+    logger.debug(f"Keep-alive request for session: {session_id}")
     
-    if not session_id or session_id not in active_sessions:
+    # Update the session timestamp to keep it "active"
+    last_activity = await session_store.touch(session_id) if session_id else None
+    if last_activity is None:
         return JSONResponse(
             status_code=404,
             content={"error": "Session not found"}
         )
     
-    # Update the session timestamp to keep it "active"
-    active_sessions[session_id]["last_activity"] = time.time()
-    print(f"Updated last activity for session: {session_id}")
-    return {"status": "Session kept alive", "timestamp": active_sessions[session_id]["last_activity"]}
+    logger.debug(f"Updated last activity for session: {session_id}")
+    return {"status": "Session kept alive", "timestamp": last_activity}
 
 @realtime.post("/close")
 async def close_session(request: Request):
@@ -173,18 +142,17 @@ async def close_session(request: Request):
                 content={"error": "session_id is required"}
             )
         
-        if session_id in active_sessions:
-            del active_sessions[session_id]
-            print(f"Closed session with ID: {session_id}")
+        if await session_store.remove(session_id):
+            logger.info(f"Closed session with ID: {session_id}")
             return {"status": "Session closed"}
         else:
-            print(f"Attempted to close non-existent session with ID: {session_id}")
+            logger.info(f"Attempted to close non-existent session with ID: {session_id}")
             return JSONResponse(
                 status_code=404,
                 content={"error": "Session not found"}
             )
     except Exception as e:
-        print(f"Error closing session: {str(e)}")
+        logger.error(f"Error closing session: {str(e)}")
         return JSONResponse(
             status_code=500,
             content={"error": f"Error closing session: {str(e)}"}
@@ -193,9 +161,10 @@ async def close_session(request: Request):
 @realtime.get("/debug/sessions")
 async def debug_sessions():
     """Debug endpoint to check active sessions"""
+    records = await session_store.records()
     return {
-        "active_sessions_count": len(active_sessions),
-        "session_ids": list(active_sessions.keys()),
-        "sessions": active_sessions
+        "active_sessions_count": len(records),
+        "session_ids": [record.session_id for record in records],
+        "sessions": {record.session_id: asdict(record) for record in records}
     }
     
\ No newline at end of file
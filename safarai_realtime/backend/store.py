@@ -0,0 +1,267 @@
+# Realtime session store: bounded, idle-expiring, with in-process and SQLite backends
+import os
+import time
+import json
+import asyncio
+import logging
+import sqlite3
+import threading
+from abc import ABC, abstractmethod
+from collections import OrderedDict
+from dataclasses import dataclass, asdict
+
+logger = logging.getLogger(__name__)
+
+REALTIME_SESSION_STORE = os.getenv("REALTIME_SESSION_STORE", "memory")
+REALTIME_SESSION_DB = os.getenv("REALTIME_SESSION_DB", os.path.join(os.path.dirname(os.path.abspath(__file__)), "realtime_sessions.db"))
+REALTIME_SESSION_MAX = int(os.getenv("REALTIME_SESSION_MAX", "5000"))
+# The call page sends /keep-alive every 30 seconds; five idle minutes means the tab is gone.
+REALTIME_SESSION_IDLE_TTL = float(os.getenv("REALTIME_SESSION_IDLE_TTL", "300"))
+REALTIME_REAP_INTERVAL = float(os.getenv("REALTIME_REAP_INTERVAL", "30"))
+
+
+@dataclass
+class SessionRecord:
+    """What we keep per session instead of the whole provider payload."""
+    session_id: str
+    created_at: float
+    last_activity: float
+    expires_at: float | None = None
+    model: str = ""
+    level: str = ""
+    theme: str = ""
+    personality: str = ""
+
+    @classmethod
+    def from_provider(cls, data: dict, **details) -> "SessionRecord":
+        now = time.time()
+        client_secret = data.get("client_secret") or {}
+        return cls(
+            session_id=data["id"],
+            created_at=now,
+            last_activity=now,
+            expires_at=data.get("expires_at") or client_secret.get("expires_at"),
+            model=data.get("model", ""),
+            **details,
+        )
+
+
+class SessionStore(ABC):
+    """Interface shared by the session store backends. All methods are coroutines."""
+
+    @abstractmethod
+    async def add(self, record: SessionRecord):
+        ...
+
+    @abstractmethod
+    async def touch(self, session_id: str) -> float | None:
+        """Mark a session active; returns the new timestamp, or None if it does not exist."""
+        ...
+
+    @abstractmethod
+    async def remove(self, session_id: str) -> bool:
+        ...
+
+    @abstractmethod
+    async def get(self, session_id: str) -> SessionRecord | None:
+        ...
+
+    @abstractmethod
+    async def count(self) -> int:
+        ...
+
+    @abstractmethod
+    async def records(self) -> list[SessionRecord]:
+        ...
+
+    @abstractmethod
+    async def reap(self) -> int:
+        """Drop sessions idle for longer than the TTL; returns how many were removed."""
+        ...
+
+    async def close(self):
+        pass
+
+
+class MemorySessionStore(SessionStore):
+    """
+    Per-process store. Records are kept in last-activity order, so touching a session
+    is an O(1) move to the end and reaping only looks at the stale head of the list.
+    """
+
+    def __init__(self, max_size: int = REALTIME_SESSION_MAX, idle_ttl: float = REALTIME_SESSION_IDLE_TTL):
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._sessions: OrderedDict[str, SessionRecord] = OrderedDict()
+
+    async def add(self, record: SessionRecord):
+        self._sessions[record.session_id] = record
+        self._sessions.move_to_end(record.session_id)
+        while len(self._sessions) > self.max_size:
+            evicted, _ = self._sessions.popitem(last=False)
+            logger.info(f"Session store full, evicted least recently active session {evicted}")
+
+    async def touch(self, session_id: str) -> float | None:
+        record = self._sessions.get(session_id)
+        if record is None:
+            return None
+        record.last_activity = time.time()
+        self._sessions.move_to_end(session_id)
+        return record.last_activity
+
+    async def remove(self, session_id: str) -> bool:
+        return self._sessions.pop(session_id, None) is not None
+
+    async def get(self, session_id: str) -> SessionRecord | None:
+        return self._sessions.get(session_id)
+
+    async def count(self) -> int:
+        return len(self._sessions)
+
+    async def records(self) -> list[SessionRecord]:
+        return list(self._sessions.values())
+
+    async def reap(self) -> int:
+        cutoff = time.time() - self.idle_ttl
+        removed = 0
+        while self._sessions:
+            session_id, record = next(iter(self._sessions.items()))
+            if record.last_activity >= cutoff:
+                break
+            del self._sessions[session_id]
+            removed += 1
+        return removed
+
+
+class SQLiteSessionStore(SessionStore):
+    """
+    Store in a local SQLite file (WAL mode), so every uvicorn worker on the host sees
+    the same sessions. Queries run in a worker thread to keep the event loop free.
+    """
+
+    def __init__(self, path: str = REALTIME_SESSION_DB, max_size: int = REALTIME_SESSION_MAX,
+                 idle_ttl: float = REALTIME_SESSION_IDLE_TTL):
+        self.path = path
+        self.max_size = max_size
+        self.idle_ttl = idle_ttl
+        self._lock = threading.Lock()
+        self._conn = sqlite3.connect(path, check_same_thread=False, timeout=5, isolation_level=None)
+        self._conn.execute("PRAGMA journal_mode=WAL")
+        self._conn.execute("PRAGMA synchronous=NORMAL")
+        self._conn.execute(
+            "CREATE TABLE IF NOT EXISTS realtime_sessions ("
+            "session_id TEXT PRIMARY KEY, last_activity REAL NOT NULL, record TEXT NOT NULL)"
+        )
+        self._conn.execute(
+            "CREATE INDEX IF NOT EXISTS realtime_sessions_activity ON realtime_sessions (last_activity)"
+        )
+
+    def _execute(self, sql: str, params: tuple = ()) -> int:
+        """Run a statement and return the number of rows it changed."""
+        with self._lock:
+            return self._conn.execute(sql, params).rowcount
+
+    def _fetchall(self, sql: str, params: tuple = ()) -> list:
+        with self._lock:
+            return self._conn.execute(sql, params).fetchall()
+
+    async def _run(self, fn, *args):
+        return await asyncio.to_thread(fn, *args)
+
+    def _add(self, record: SessionRecord):
+        with self._lock:
+            self._conn.execute(
+                "INSERT OR REPLACE INTO realtime_sessions VALUES (?, ?, ?)",
+                (record.session_id, record.last_activity, json.dumps(asdict(record))),
+            )
+            self._conn.execute(
+                "DELETE FROM realtime_sessions WHERE session_id IN ("
+                "SELECT session_id FROM realtime_sessions ORDER BY last_activity DESC LIMIT -1 OFFSET ?)",
+                (self.max_size,),
+            )
+
+    def _touch(self, session_id: str) -> float | None:
+        now = time.time()
+        changed = self._execute(
+            "UPDATE realtime_sessions SET last_activity = ?, record = json_set(record, '$.last_activity', ?) "
+            "WHERE session_id = ?",
+            (now, now, session_id),
+        )
+        return now if changed else None
+
+    def _get(self, session_id: str) -> SessionRecord | None:
+        rows = self._fetchall("SELECT record FROM realtime_sessions WHERE session_id = ?", (session_id,))
+        return SessionRecord(**json.loads(rows[0][0])) if rows else None
+
+    def _records(self) -> list[SessionRecord]:
+        rows = self._fetchall("SELECT record FROM realtime_sessions ORDER BY last_activity")
+        return [SessionRecord(**json.loads(row[0])) for row in rows]
+
+    async def add(self, record: SessionRecord):
+        await self._run(self._add, record)
+
+    async def touch(self, session_id: str) -> float | None:
+        return await self._run(self._touch, session_id)
+
+    async def remove(self, session_id: str) -> bool:
+        return await self._run(self._execute, "DELETE FROM realtime_sessions WHERE session_id = ?", (session_id,)) > 0
+
+    async def get(self, session_id: str) -> SessionRecord | None:
+        return await self._run(self._get, session_id)
+
+    async def count(self) -> int:
+        rows = await self._run(self._fetchall, "SELECT COUNT(*) FROM realtime_sessions")
+        return rows[0][0]
+
+    async def records(self) -> list[SessionRecord]:
+        return await self._run(self._records)
+
+    async def reap(self) -> int:
+        cutoff = time.time() - self.idle_ttl
+        return await self._run(self._execute, "DELETE FROM realtime_sessions WHERE last_activity < ?", (cutoff,))
+
+    async def close(self):
+        with self._lock:
+            self._conn.close()
+
+
+def create_session_store(backend: str = REALTIME_SESSION_STORE) -> SessionStore:
+    """Build the store selected by REALTIME_SESSION_STORE ("memory" or "sqlite")."""
+    if backend == "sqlite":
+        logger.info(f"Using SQLite realtime session store at {REALTIME_SESSION_DB}")
+        return SQLiteSessionStore()
+    if backend != "memory":
+        raise ValueError(f"Unknown REALTIME_SESSION_STORE '{backend}' (expected 'memory' or 'sqlite')")
+    return MemorySessionStore()
+
+
+class SessionReaper:
+    """Periodically removes idle sessions from a store."""
+
+    def __init__(self, store: SessionStore, interval: float = REALTIME_REAP_INTERVAL):
+        self.store = store
+        self.interval = interval
+        self._task: asyncio.Task | None = None
+
+    async def _loop(self):
+        while True:
+            await asyncio.sleep(self.interval)
+            try:
+                removed = await self.store.reap()
+                if removed:
+                    logger.info(f"Reaped {removed} idle realtime sessions")
+            except Exception as e:
+                logger.error(f"Realtime session reaper failed: {e}")
+
+    def start(self):
+        if self._task is None:
+            self._task = asyncio.create_task(self._loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
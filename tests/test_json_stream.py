@@ -0,0 +1,92 @@
+import json
+import pytest
+from util.json_stream import JsonStreamParser
+
+DOCUMENT = {
+    "criteria": [
+        {"criterion": "Grammar", "score": 3, "feedback": 'Say "I went", not "I goed" \\ check {tenses} [1]'},
+        {"criterion": "Vocabulary", "score": 4, "feedback": "Nice words: café, مدرسة, \U0001F600\nNew line"},
+    ],
+    "score": 7,
+}
+
+
+def feed_all(parser: JsonStreamParser, chunks) -> list:
+    completed = []
+    for chunk in chunks:
+        completed.extend(parser.feed(chunk))
+    return completed
+
+
+def split_every(text: str, size: int) -> list[str]:
+    return [text[i:i + size] for i in range(0, len(text), size)]
+
+
+@pytest.mark.parametrize("ensure_ascii", [True, False])
+@pytest.mark.parametrize("size", [1, 2, 3, 7, 1000])
+def test_chunk_boundaries_anywhere(size, ensure_ascii):
+    # Size 1 puts a boundary inside every string, escape sequence (\", \\, \n, \uXXXX) and key.
+    text = json.dumps(DOCUMENT, ensure_ascii=ensure_ascii)
+    parser = JsonStreamParser()
+    completed = feed_all(parser, split_every(text, size))
+    assert completed == [("criteria", item) for item in DOCUMENT["criteria"]]
+    assert parser.result == DOCUMENT
+
+
+def test_every_split_point():
+    text = json.dumps(DOCUMENT)
+    for split in range(len(text) + 1):
+        parser = JsonStreamParser()
+        completed = feed_all(parser, [text[:split], text[split:]])
+        assert [value for _, value in completed] == DOCUMENT["criteria"]
+        assert parser.result == DOCUMENT
+
+
+def test_elements_are_emitted_as_soon_as_they_close():
+    parser = JsonStreamParser()
+    assert parser.feed('{"criteria": [{"a": 1}') == [("criteria", {"a": 1})]
+    assert parser.feed(', {"a": 2') == []
+    assert parser.feed("}") == [("criteria", {"a": 2})]
+    assert parser.result is None
+    assert parser.feed("]}") == []
+    assert parser.result == {"criteria": [{"a": 1}, {"a": 2}]}
+
+
+def test_nested_arrays():
+    document = {"rows": [[1, 2], [], [[3], {"x": [4, [5]]}]], "tags": ["a", "b]", 3, True, None], "n": {"deep": [[1]]}}
+    parser = JsonStreamParser()
+    completed = feed_all(parser, split_every(json.dumps(document), 2))
+    assert completed == [
+        ("rows", [1, 2]), ("rows", []), ("rows", [[3], {"x": [4, [5]]}]),
+        ("tags", "a"), ("tags", "b]"), ("tags", 3), ("tags", True), ("tags", None),
+    ]
+    assert parser.result == document
+
+
+def test_text_around_the_object_is_ignored():
+    parser = JsonStreamParser()
+    completed = feed_all(parser, ["Sure! ```json\n", '{"criteria": [1]', "}\n``` {\"criteria\": [2]}"])
+    assert completed == [("criteria", 1)]
+    assert parser.result == {"criteria": [1]}
+
+
+def test_truncated_stream_has_no_result():
+    parser = JsonStreamParser()
+    completed = feed_all(parser, ['{"criteria": [{"a": 1}, {"a": "unfinished'])
+    assert completed == [("criteria", {"a": 1})]
+    assert parser.result is None
+
+
+@pytest.mark.parametrize("text", [
+    '{"criteria": [1,, 2]}',
+    '{"criteria": [{"a": }]}',
+    '{"criteria": [1]]',
+    '{"a" 1}',
+    "{: 1}",
+    '{"a": [tru]}',
+    '{"a": 1,}',
+])
+def test_malformed_input_raises_value_error(text):
+    parser = JsonStreamParser()
+    with pytest.raises(ValueError):
+        feed_all(parser, split_every(text, 3))
@@ -0,0 +1,47 @@
+import pytest
+from types import SimpleNamespace
+from pydantic import BaseModel
+from util.parsingoutput import extract_json_object, parse_model
+
+
+class Grade(BaseModel):
+    score: int
+    feedback: str
+
+
+def test_plain_object():
+    assert extract_json_object('{"score": 7, "feedback": "ok"}') == {"score": 7, "feedback": "ok"}
+
+
+def test_object_in_prose_and_code_fence():
+    text = 'Here is the result:\n```json\n{"score": 7, "feedback": "ok"}\n```\nHope this helps {not json}'
+    assert extract_json_object(text) == {"score": 7, "feedback": "ok"}
+
+
+def test_braces_and_quotes_inside_strings():
+    text = 'output: {"feedback": "use \\"{\\" and } carefully", "nested": {"a": [1, {"b": 2}]}}'
+    assert extract_json_object(text) == {"feedback": 'use "{" and } carefully', "nested": {"a": [1, {"b": 2}]}}
+
+
+def test_skips_invalid_candidates():
+    assert extract_json_object('{oops} {"score": 1} {"score": 2}') == {"score": 1}
+
+
+def test_first_object_wins_over_later_ones():
+    assert extract_json_object('[{"score": 1}]') == {"score": 1}
+
+
+@pytest.mark.parametrize("text", ["", "no json here", "{", '{"score": 1', '{"score": }', "[1, 2, 3]", "}{"])
+def test_malformed_input_returns_none(text):
+    assert extract_json_object(text) is None
+
+
+def test_parse_model_structured_and_embedded():
+    assert parse_model(SimpleNamespace(output_text='{"score": 5, "feedback": "fine"}'), Grade) == Grade(score=5, feedback="fine")
+    embedded = SimpleNamespace(output_text='Result: {"score": 5, "feedback": "fine"} Thanks!')
+    assert parse_model(embedded, Grade).score == 5
+
+
+def test_parse_model_without_json_raises():
+    with pytest.raises(ValueError):
+        parse_model(SimpleNamespace(output_text="Sorry, I cannot grade this."), Grade)
@@ -0,0 +1,347 @@
+import os
+import json
+import math
+import time
+import heapq
+import asyncio
+import hashlib
+import logging
+import itertools
+from fnmatch import fnmatchcase
+from collections import OrderedDict, deque
+from contextvars import ContextVar
+from util import metrics
+from util.tracing import span
+
+logger = logging.getLogger(__name__)
+
+INTERACTIVE = "interactive"
+BULK = "bulk"
+EXEMPT = "exempt"
+# Lower is served first when requests wait for the same upstream slot.
+PRIORITY = {INTERACTIVE: 0, BULK: 1}
+
+
+def _patterns(name: str, default: str) -> list[str]:
+    return [pattern.strip() for pattern in os.getenv(name, default).split(",") if pattern.strip()]
+
+
+# "METHOD /path" glob patterns. Bulk routes are long generations and batch work;
+# exempt routes are cheap and must stay reachable under overload (scrapes, admin, docs).
+ADMISSION_BULK_ROUTES = _patterns(
+    "ADMISSION_BULK_ROUTES",
+    "POST /audio-book*,POST /translation/batch,POST /correction/jobs,POST /correction/jobs/*/resume",
+)
+ADMISSION_EXEMPT_ROUTES = _patterns(
+    "ADMISSION_EXEMPT_ROUTES",
+    "OPTIONS *,GET /,* /metrics,* /admin/*,GET /docs*,GET /redoc*,GET /openapi.json,GET /debug/*",
+)
+
+# Requests of a class served at once, how many may wait for a slot, and for how long.
+ADMISSION_INTERACTIVE_CONCURRENCY = int(os.getenv("ADMISSION_INTERACTIVE_CONCURRENCY", "256"))
+ADMISSION_INTERACTIVE_QUEUE = int(os.getenv("ADMISSION_INTERACTIVE_QUEUE", "512"))
+ADMISSION_INTERACTIVE_TIMEOUT = float(os.getenv("ADMISSION_INTERACTIVE_TIMEOUT", "5"))
+ADMISSION_BULK_CONCURRENCY = int(os.getenv("ADMISSION_BULK_CONCURRENCY", "8"))
+ADMISSION_BULK_QUEUE = int(os.getenv("ADMISSION_BULK_QUEUE", "32"))
+ADMISSION_BULK_TIMEOUT = float(os.getenv("ADMISSION_BULK_TIMEOUT", "30"))
+
+# Per-client token buckets: sustained requests per second and burst size, per class (rate 0 disables).
+# A school network often reaches us from one address, so the interactive bucket is generous.
+ADMISSION_INTERACTIVE_RATE = float(os.getenv("ADMISSION_INTERACTIVE_RATE", "20"))
+ADMISSION_INTERACTIVE_BURST = float(os.getenv("ADMISSION_INTERACTIVE_BURST", "60"))
+ADMISSION_BULK_RATE = float(os.getenv("ADMISSION_BULK_RATE", "0.2"))
+ADMISSION_BULK_BURST = float(os.getenv("ADMISSION_BULK_BURST", "5"))
+ADMISSION_MAX_CLIENTS = int(os.getenv("ADMISSION_MAX_CLIENTS", "50000"))
+# Behind Apache the peer address is the proxy; use the last X-Forwarded-For hop (the one Apache added) instead.
+ADMISSION_TRUST_FORWARDED = os.getenv("ADMISSION_TRUST_FORWARDED", "true").lower() == "true"
+# API keys (comma-separated) that identify a client for rate limiting. Nothing else in the app
+# checks keys, so any other X-API-Key / Authorization value is ignored and the IP is used;
+# otherwise a client could get a fresh bucket per request by making keys up.
+ADMISSION_API_KEYS = frozenset(
+    hashlib.sha256(key.encode()).hexdigest() for key in _patterns("ADMISSION_API_KEYS", "")
+)
+
+# Share of each model's upstream slots that bulk work may hold, so interactive calls never queue behind it.
+ADMISSION_BULK_UPSTREAM_SHARE = float(os.getenv("ADMISSION_BULK_UPSTREAM_SHARE", "0.5"))
+
+_priority: ContextVar[str] = ContextVar("admission_class", default=INTERACTIVE)
+
+admission_active = metrics.Gauge("admission_active", "Requests holding an admission slot.", ("class",))
+admission_queued = metrics.Gauge("admission_queued", "Requests waiting for an admission slot.", ("class",))
+admission_wait = metrics.Histogram("admission_wait_seconds", "Time requests waited for an admission slot.", ("class",))
+admission_rejected = metrics.Counter(
+    "admission_rejected_total", "Requests turned away; reason is rate_limited, queue_full or queue_timeout.", ("class", "reason"),
+)
+
+
+def current_class() -> str:
+    """Admission class of the request being served (interactive outside a request)."""
+    return _priority.get()
+
+
+class Rejected(Exception):
+    def __init__(self, status: int, reason: str, retry_after: float, detail: str):
+        super().__init__(detail)
+        self.status = status
+        self.reason = reason
+        self.retry_after = retry_after
+
+
+class Lane:
+    """
+    Concurrency limit with a bounded FIFO queue for one admission class.
+    A request that finds the queue full is shed immediately; one that waits
+    longer than `timeout` gives up. Both are told when to retry, estimated from
+    the recent time a slot is held and the length of the queue.
+    """
+
+    def __init__(self, name: str, limit: int, max_queue: int, timeout: float):
+        self.name = name
+        self.limit = limit
+        self.max_queue = max_queue
+        self.timeout = timeout
+        self.active = 0
+        self.hold_time = 1.0  # Moving average of seconds a slot is held
+        self._waiters: deque[asyncio.Future] = deque()
+
+    def retry_after(self) -> float:
+        return self.hold_time * (len(self._waiters) + 1) / self.limit
+
+    async def acquire(self):
+        if self.active < self.limit and not self._waiters:
+            self.active += 1
+            admission_active.labels(self.name).set(self.active)
+            return
+        if len(self._waiters) >= self.max_queue:
+            raise Rejected(503, "queue_full", self.retry_after(), f"Too many {self.name} requests queued")
+        future = asyncio.get_running_loop().create_future()
+        self._waiters.append(future)
+        admission_queued.labels(self.name).set(len(self._waiters))
+        started = time.perf_counter()
+        try:
+            with span("admission.queue"):
+                await asyncio.wait_for(future, self.timeout)
+        except asyncio.TimeoutError:
+            if future.done() and not future.cancelled():
+                # Granted a slot in the same loop iteration as the timeout (wait_for on 3.12+): pass it on.
+                self.release()
+            raise Rejected(503, "queue_timeout", self.retry_after(), f"Timed out waiting for a {self.name} slot") from None
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted a slot just as the client went away: pass it on.
+                self.release()
+            raise
+        finally:
+            if future.cancelled() and future in self._waiters:
+                self._waiters.remove(future)
+            admission_queued.labels(self.name).set(len(self._waiters))
+            admission_wait.labels(self.name).observe(time.perf_counter() - started)
+
+    def release(self, held: float = None):
+        if held is not None:
+            self.hold_time += (held - self.hold_time) * 0.1
+        while self._waiters:
+            future = self._waiters.popleft()
+            if not future.done():
+                # Hand the slot over directly; active stays the same.
+                future.set_result(True)
+                admission_queued.labels(self.name).set(len(self._waiters))
+                return
+        self.active -= 1
+        admission_active.labels(self.name).set(self.active)
+
+
+class TokenBucket:
+    __slots__ = ("tokens", "updated")
+
+    def __init__(self, burst: float, now: float):
+        self.tokens = burst
+        self.updated = now
+
+
+class RateLimiter:
+    """
+    Per-client token buckets, `rate` requests per second with bursts of up to `burst`.
+    At most max_clients buckets are kept. The least recently seen client is evicted
+    first, and its bucket has usually refilled by then, so forgetting it changes nothing.
+    """
+
+    def __init__(self, rate: float, burst: float, max_clients: int = ADMISSION_MAX_CLIENTS):
+        self.rate = rate
+        self.burst = max(1.0, burst)
+        self.max_clients = max_clients
+        self._buckets: OrderedDict[str, TokenBucket] = OrderedDict()
+
+    def take(self, client: str) -> float:
+        """Spend one token; returns 0 if allowed, otherwise the seconds until a token is available."""
+        if self.rate <= 0:
+            return 0.0
+        now = time.monotonic()
+        bucket = self._buckets.get(client)
+        if bucket is None:
+            bucket = self._buckets[client] = TokenBucket(self.burst, now)
+            if len(self._buckets) > self.max_clients:
+                self._buckets.popitem(last=False)
+        else:
+            self._buckets.move_to_end(client)
+            bucket.tokens = min(self.burst, bucket.tokens + (now - bucket.updated) * self.rate)
+            bucket.updated = now
+        if bucket.tokens >= 1:
+            bucket.tokens -= 1
+            return 0.0
+        return (1 - bucket.tokens) / self.rate
+
+
+def classify(method: str, path: str) -> str:
+    route = f"{method} {path}"
+    if any(fnmatchcase(route, pattern) for pattern in ADMISSION_EXEMPT_ROUTES):
+        return EXEMPT
+    if any(fnmatchcase(route, pattern) for pattern in ADMISSION_BULK_ROUTES):
+        return BULK
+    return INTERACTIVE
+
+
+def client_key(scope) -> str:
+    """The caller's API key (hashed) if it is one of ADMISSION_API_KEYS, otherwise its IP address."""
+    forwarded = None
+    for name, value in scope.get("headers", ()):
+        if name in (b"x-api-key", b"authorization") and ADMISSION_API_KEYS:
+            digest = hashlib.sha256(value.decode("latin-1").removeprefix("Bearer ").strip().encode()).hexdigest()
+            if digest in ADMISSION_API_KEYS:
+                return "key:" + digest[:16]
+        elif name == b"x-forwarded-for":
+            forwarded = value.decode("latin-1")
+    if forwarded and ADMISSION_TRUST_FORWARDED:
+        return "ip:" + forwarded.rsplit(",", 1)[-1].strip()
+    client = scope.get("client")
+    return "ip:" + (client[0] if client else "unknown")
+
+
+lanes = {
+    INTERACTIVE: Lane(INTERACTIVE, ADMISSION_INTERACTIVE_CONCURRENCY, ADMISSION_INTERACTIVE_QUEUE, ADMISSION_INTERACTIVE_TIMEOUT),
+    BULK: Lane(BULK, ADMISSION_BULK_CONCURRENCY, ADMISSION_BULK_QUEUE, ADMISSION_BULK_TIMEOUT),
+}
+rate_limiters = {
+    INTERACTIVE: RateLimiter(ADMISSION_INTERACTIVE_RATE, ADMISSION_INTERACTIVE_BURST),
+    BULK: RateLimiter(ADMISSION_BULK_RATE, ADMISSION_BULK_BURST),
+}
+
+
+async def _reject(send, error: Rejected):
+    retry_after = str(max(1, math.ceil(error.retry_after)))
+    body = json.dumps({"detail": str(error)}).encode()
+    await send({
+        "type": "http.response.start",
+        "status": error.status,
+        "headers": [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(body)).encode()),
+            (b"retry-after", retry_after.encode()),
+        ],
+    })
+    await send({"type": "http.response.body", "body": body})
+
+
+class AdmissionMiddleware:
+    """
+    Admission control in front of every route:
+    1. The route's class (interactive, bulk or exempt) comes from ADMISSION_*_ROUTES.
+    2. The client's token bucket for that class must have a token, else 429.
+    3. The request waits for a slot in its class's lane, else 503 (queue full or timed out).
+    The slot is held until the response, streams included, has been sent. The class is
+    also visible to upstream calls (current_class), which serve interactive work first.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        path = scope["path"]
+        root_path = scope.get("root_path", "")
+        if root_path and path.startswith(root_path):
+            path = path[len(root_path):] or "/"
+        admission_class = classify(scope["method"], path)
+        if admission_class == EXEMPT:
+            await self.app(scope, receive, send)
+            return
+
+        lane = lanes[admission_class]
+        try:
+            wait = rate_limiters[admission_class].take(client_key(scope))
+            if wait:
+                raise Rejected(429, "rate_limited", wait, f"Rate limit exceeded for {admission_class} requests")
+            await lane.acquire()
+        except Rejected as e:
+            admission_rejected.labels(admission_class, e.reason).inc()
+            logger.info(f"Rejected {scope['method']} {path} ({e.reason}, retry after {e.retry_after:.1f}s)")
+            await _reject(send, e)
+            return
+
+        token = _priority.set(admission_class)
+        started = time.perf_counter()
+        try:
+            await self.app(scope, receive, send)
+        finally:
+            _priority.reset(token)
+            lane.release(time.perf_counter() - started)
+
+
+class PrioritySemaphore:
+    """
+    Semaphore that hands free slots to the highest-priority waiter (interactive before
+    bulk, FIFO within a class) and lets bulk work hold at most `bulk_limit` slots.
+    acquire() returns the class it was granted for; pass it back to release().
+    """
+
+    def __init__(self, value: int, bulk_share: float = ADMISSION_BULK_UPSTREAM_SHARE):
+        self.value = value
+        self.bulk_limit = max(1, int(value * bulk_share))
+        self.held = {INTERACTIVE: 0, BULK: 0}
+        self._waiters: list[tuple[int, int, str, asyncio.Future]] = []
+        self._order = itertools.count()
+
+    def _free(self, admission_class: str) -> bool:
+        if sum(self.held.values()) >= self.value:
+            return False
+        return admission_class != BULK or self.held[BULK] < self.bulk_limit
+
+    def _grant(self):
+        while self._waiters:
+            _, _, admission_class, future = self._waiters[0]
+            if future.done():
+                heapq.heappop(self._waiters)
+                continue
+            if not self._free(admission_class):
+                # The best waiter cannot run yet; everyone behind it ranks lower.
+                return
+            heapq.heappop(self._waiters)
+            self.held[admission_class] += 1
+            future.set_result(True)
+
+    async def acquire(self, admission_class: str = None) -> str:
+        admission_class = admission_class or current_class()
+        if not self._waiters and self._free(admission_class):
+            self.held[admission_class] += 1
+            return admission_class
+        future = asyncio.get_running_loop().create_future()
+        heapq.heappush(self._waiters, (PRIORITY.get(admission_class, 0), next(self._order), admission_class, future))
+        # Queued bulk work that is over its share must not hold up an interactive call.
+        self._grant()
+        try:
+            await future
+        except asyncio.CancelledError:
+            if future.done() and not future.cancelled():
+                # Granted just before being cancelled: give the slot back.
+                self.release(admission_class)
+            raise
+        return admission_class
+
+    def release(self, admission_class: str):
+        self.held[admission_class] -= 1
+        self._grant()
+
+    def locked(self) -> bool:
+        return sum(self.held.values()) >= self.value
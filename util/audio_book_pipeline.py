@@ -0,0 +1,157 @@
+import os
+import re
+import asyncio
+import logging
+from pathlib import Path
+from typing import AsyncIterator
+from util.complition_model import complition_model_stream
+from util.speech_cache import SpeechCache, speech_cache
+from util.tracing import span
+
+AUDIO_BOOK_TTS_WORKERS = int(os.getenv("AUDIO_BOOK_TTS_WORKERS", "4"))
+
+# The first segment is kept short so narration can start early; later ones are
+# longer so the story is read in fewer, more natural-sounding pieces.
+FIRST_SEGMENT_MIN_CHARS = 150
+SEGMENT_MIN_CHARS = 500
+SEGMENT_MAX_CHARS = 1500
+
+# End of a paragraph, or end of a sentence (with any closing quotes/brackets) followed by space.
+_BOUNDARY = re.compile(r"\n\s*\n|[.!?…][\"'”’)\]]*\s+")
+
+
+def _cut_point(buffer: str, min_chars: int, max_chars: int) -> int | None:
+    """Index to split buffer at, preferring the last boundary in [min_chars, max_chars]."""
+    cut = None
+    for match in _BOUNDARY.finditer(buffer, 0, max_chars):
+        if match.end() >= min_chars:
+            cut = match.end()
+    if cut is None and len(buffer) > max_chars:
+        # A run-on passage with no sentence end: fall back to the last space.
+        space = buffer.rfind(" ", min_chars, max_chars)
+        cut = space + 1 if space != -1 else max_chars
+    return cut
+
+
+async def split_segments(deltas: AsyncIterator[str]) -> AsyncIterator[str]:
+    """Group streamed text deltas into sentence/paragraph-aligned segments for TTS."""
+    buffer = ""
+    min_chars = FIRST_SEGMENT_MIN_CHARS
+    async for delta in deltas:
+        buffer += delta
+        while (cut := _cut_point(buffer, min_chars, SEGMENT_MAX_CHARS)) is not None:
+            segment, buffer = buffer[:cut].strip(), buffer[cut:]
+            if segment:
+                yield segment
+                min_chars = SEGMENT_MIN_CHARS
+    if buffer.strip():
+        yield buffer.strip()
+
+
+def _join_files(paths: list[Path], destination: Path):
+    with open(destination, "wb") as out:
+        for path in paths:
+            with open(path, "rb") as segment:
+                while chunk := segment.read(1024 * 1024):
+                    out.write(chunk)
+
+
+class AudioBookPipeline:
+    """
+    Generates a story and narrates it with the two stages overlapping.
+    The story is streamed from the text model and cut at sentence or paragraph
+    boundaries; each segment is sent to TTS as soon as it is complete, with at most
+    `workers` syntheses in flight. Segment files are delivered in story order.
+    """
+
+    def __init__(self, model: str, instructions: str, input: str, tts_model: str, voice: str,
+                 tts_instructions: str, max_output_tokens: int = None, temperature: float = None,
+                 workers: int = AUDIO_BOOK_TTS_WORKERS, cache: SpeechCache = speech_cache):
+        self.model = model
+        self.instructions = instructions
+        self.input = input
+        self.tts_model = tts_model
+        self.voice = voice
+        self.tts_instructions = tts_instructions
+        self.max_output_tokens = max_output_tokens
+        self.temperature = temperature
+        self.cache = cache
+        self.text = ""
+        self._segments: list[str] = []
+        self._semaphore = asyncio.Semaphore(workers)
+        self._queue: asyncio.Queue = asyncio.Queue()
+        self._tasks: list[asyncio.Task] = []
+        self._producer: asyncio.Task | None = None
+
+    async def _synthesize(self, segment: str) -> Path:
+        async with self._semaphore:
+            return await self.cache.get_or_create(
+                model=self.tts_model,
+                voice=self.voice,
+                instructions=self.tts_instructions,
+                text=segment
+            )
+
+    async def _record(self, deltas: AsyncIterator[str]) -> AsyncIterator[str]:
+        """Keep the full story text, formatting included, while it streams past."""
+        async for delta in deltas:
+            self.text += delta
+            yield delta
+
+    async def _produce(self):
+        try:
+            deltas = complition_model_stream(
+                model=self.model,
+                instructions=self.instructions,
+                input=self.input,
+                max_output_tokens=self.max_output_tokens,
+                temperature=self.temperature,
+            )
+            async for segment in split_segments(self._record(deltas)):
+                self._segments.append(segment)
+                task = asyncio.create_task(self._synthesize(segment))
+                self._tasks.append(task)
+                self._queue.put_nowait(task)
+            self.text = self.text.strip()
+            logging.info(f"Audio book text complete: {len(self._segments)} segments, {len(self.text)} chars")
+        finally:
+            self._queue.put_nowait(None)
+
+    async def segment_files(self) -> AsyncIterator[Path]:
+        """Yield the MP3 of each segment, in order, as soon as it (and all before it) are ready."""
+        self._producer = asyncio.create_task(self._produce())
+        try:
+            while (task := await self._queue.get()) is not None:
+                yield await task
+            # Re-raise a text generation failure.
+            await self._producer
+        finally:
+            self.close()
+
+    async def build(self) -> Path:
+        """Run the whole pipeline and return a single MP3 with every segment joined in order."""
+        paths = [path async for path in self.segment_files()]
+        if not paths:
+            raise RuntimeError("The story model returned no text")
+        if len(paths) == 1:
+            return paths[0]
+        key = self.cache.key(self.tts_model, self.voice, self.tts_instructions, self.text)
+        existing = await self.cache.lookup(key)
+        if existing is not None:
+            return existing
+        tmp_path = self.cache.temp_path(key)
+        try:
+            with span("mp3.write"):
+                await asyncio.to_thread(_join_files, paths, tmp_path)
+            return await self.cache.commit(key, tmp_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+
+    def close(self):
+        """Stop generating and cancel outstanding syntheses (e.g. when a streaming client leaves)."""
+        if self._producer is not None and not self._producer.done():
+            self._producer.cancel()
+        for task in self._tasks:
+            if not task.done():
+                task.cancel()
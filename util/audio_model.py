@@ -1,10 +1,80 @@
+import asyncio
+from typing import AsyncIterator
 from util.config import client
+from util import metrics
+from util.tracing import span
+
+# Audio is written to disk in batches of about this many bytes.
+WRITE_BUFFER_SIZE = 256 * 1024
+
+
+class ChunkWriter:
+    """
+    Writes streamed audio chunks to a file from a worker thread, in WRITE_BUFFER_SIZE
+    batches, so disk I/O never blocks the event loop:
+
+        async with ChunkWriter(path) as writer:
+            async for chunk in chunks:
+                await writer.write(chunk)
+
+    The buffered rest is written when the block exits without an error.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self._buffer = bytearray()
+        self._file = None
+        self._writes = metrics.file_io_duration.labels("speech.write")
+
+    async def __aenter__(self):
+        self._file = await asyncio.to_thread(open, self.path, "wb")
+        return self
+
+    async def write(self, chunk: bytes):
+        self._buffer += chunk
+        if len(self._buffer) >= WRITE_BUFFER_SIZE:
+            await self.flush()
+
+    async def flush(self):
+        if self._buffer:
+            data, self._buffer = bytes(self._buffer), bytearray()
+            with span("mp3.write", self._writes):
+                await asyncio.to_thread(self._file.write, data)
+
+    async def __aexit__(self, exc_type, exc, traceback):
+        try:
+            if exc_type is None:
+                await self.flush()
+        finally:
+            await asyncio.to_thread(self._file.close)
+        return False
+
 
 async def audio_model(model: str, voice: str, instructions: str, input: str, speech_file_path: str):
-    async with client.audio.speech.with_streaming_response.create(
-        model=model,
-        voice=voice,
-        instructions=instructions,
-        input=input
-    ) as response:
-        await response.stream_to_file(speech_file_path)
+    with metrics.UpstreamTimer("audio.speech", model):
+        async with client.audio.speech.with_streaming_response.create(
+            model=model,
+            voice=voice,
+            instructions=instructions,
+            input=input
+        ) as response:
+            received = metrics.upstream_audio_bytes.labels(model)
+            async with ChunkWriter(speech_file_path) as writer:
+                async for chunk in response.iter_bytes():
+                    received.inc(len(chunk))
+                    await writer.write(chunk)
+
+async def stream_audio_model(model: str, voice: str, instructions: str, input: str) -> AsyncIterator[bytes]:
+    """Yield MP3 bytes as they arrive from the TTS API instead of waiting for the whole file."""
+    with metrics.UpstreamTimer("audio.speech.stream", model) as timer:
+        async with client.audio.speech.with_streaming_response.create(
+            model=model,
+            voice=voice,
+            instructions=instructions,
+            input=input
+        ) as response:
+            received = metrics.upstream_audio_bytes.labels(model)
+            async for chunk in response.iter_bytes():
+                timer.first_token()
+                received.inc(len(chunk))
+                yield chunk
@@ -1,4 +1,4 @@
-from pydantic import BaseModel
+from pydantic import BaseModel, Field
 
 class AduioBookRequest(BaseModel):
     text: str
@@ -28,6 +28,25 @@ class translationResponse(BaseModel):
     translation: str
     info: str
 
+class translationBatchItem(BaseModel):
+    text: str
+    target_language: str
+class translationBatchRequest(BaseModel):
+    items: list[translationBatchItem] = Field(max_length=500)
+class translationBatchResult(BaseModel):
+    translation: str | None = None
+    info: str | None = None
+    error: str | None = None
+class translationBatchResponse(BaseModel):
+    results: list[translationBatchResult]  # Same order as the request items
+# Structured output of one batched translation call
+class translationBatchOutputItem(BaseModel):
+    id: int
+    translation: str
+    info: str
+class translationBatchOutput(BaseModel):
+    items: list[translationBatchOutputItem]
+
 
 
 class CorrectionRequest(BaseModel):
@@ -37,6 +56,21 @@ class CorrectionResponse(BaseModel):
     score: int
     feedback: str
 
+# Structured output of a streamed correction: one entry per criterion, then the total
+class CorrectionCriterion(BaseModel):
+    criterion: str
+    score: int
+    feedback: str
+class CorrectionStreamOutput(BaseModel):
+    criteria: list[CorrectionCriterion]
+    score: int
+
+class CorrectionJobRequest(BaseModel):
+    items: list[CorrectionRequest] | None = Field(default=None, max_length=1000)  # Answers to grade, or
+    input_file: str | None = None  # a JSONL file of {"id", "question", "text"} lines in CORRECTION_JOBS_DIR (for larger jobs)
+    concurrency: int = Field(default=8, ge=1, le=64)
+    batch_file: bool = False  # Only write Batch API request files instead of grading
+
 
 
 
@@ -1,18 +1,266 @@
-from util.config import client
-
-async def complition_model(model: str, instructions: str, input: str, max_output_tokens: int = None, temperature: float = None) -> str:
-    if model in ["gpt-5-mini", "gpt-5", "gpt-5-nano"]:
-        response = await client.responses.create(
-            model=model,
-            instructions=instructions,
-            input = input
-        )
-    else:
-        response = await client.responses.create(
-            model=model,
-            instructions=instructions,
-            input = input,
-            max_output_tokens=max_output_tokens,
-            temperature=temperature,
+import os
+import time
+import random
+import asyncio
+import logging
+import email.utils
+import openai
+from util.config import client, HTTPException
+from util import metrics, tracing
+from util.admission import PrioritySemaphore
+
+logger = logging.getLogger(__name__)
+
+# Concurrent upstream calls allowed per model; OPENAI_MODEL_CONCURRENCY overrides single
+# models, e.g. "gpt-4o=32,gpt-5-nano=128".
+OPENAI_MAX_CONCURRENCY = int(os.getenv("OPENAI_MAX_CONCURRENCY", "64"))
+OPENAI_MODEL_CONCURRENCY = {
+    name.strip(): int(limit)
+    for name, _, limit in (item.partition("=") for item in os.getenv("OPENAI_MODEL_CONCURRENCY", "").split(","))
+    if name.strip() and limit.strip()
+}
+OPENAI_MAX_RETRIES = int(os.getenv("OPENAI_MAX_RETRIES", "4"))
+OPENAI_BACKOFF_BASE = float(os.getenv("OPENAI_BACKOFF_BASE", "0.5"))
+OPENAI_BACKOFF_MAX = float(os.getenv("OPENAI_BACKOFF_MAX", "20"))
+# Default time budget of one call, including queueing for a slot and every retry.
+OPENAI_DEADLINE = float(os.getenv("OPENAI_DEADLINE", "120"))
+
+NO_SAMPLING_MODELS = ["gpt-5-mini", "gpt-5", "gpt-5-nano"]
+
+# Retries happen here instead of inside the SDK so they respect the semaphores and deadlines.
+_client = client.with_options(max_retries=0)
+_semaphores: dict[str, PrioritySemaphore] = {}
+
+
+def model_semaphore(model: str) -> PrioritySemaphore:
+    # Interactive requests get free slots first and bulk work can only hold part of them (see util.admission).
+    semaphore = _semaphores.get(model)
+    if semaphore is None:
+        semaphore = _semaphores[model] = PrioritySemaphore(OPENAI_MODEL_CONCURRENCY.get(model, OPENAI_MAX_CONCURRENCY))
+    return semaphore
+
+
+def _retryable(e: Exception) -> bool:
+    if isinstance(e, openai.APIConnectionError):  # includes APITimeoutError
+        return True
+    if isinstance(e, openai.APIStatusError):
+        if e.code == "insufficient_quota":
+            return False
+        return e.status_code in (408, 409, 429) or e.status_code >= 500
+    return False
+
+
+def retry_after(e: Exception) -> float | None:
+    """Seconds the API asked us to wait (retry-after-ms / retry-after headers), if any."""
+    response = getattr(e, "response", None)
+    if response is None:
+        return None
+    headers = response.headers
+    try:
+        return float(headers["retry-after-ms"]) / 1000
+    except (KeyError, ValueError):
+        pass
+    value = headers.get("retry-after")
+    if not value:
+        return None
+    try:
+        return float(value)
+    except ValueError:
+        parsed = email.utils.parsedate_tz(value)
+        return max(0.0, email.utils.mktime_tz(parsed) - time.time()) if parsed else None
+
+
+def backoff_delay(attempt: int, requested: float | None = None) -> float:
+    """Full-jitter exponential backoff, or the server's Retry-After plus a little jitter."""
+    if requested is not None:
+        return requested + random.uniform(0, OPENAI_BACKOFF_BASE)
+    return random.uniform(0, min(OPENAI_BACKOFF_MAX, OPENAI_BACKOFF_BASE * 2 ** attempt))
+
+
+async def acquire_slot(model: str):
+    """Wait for one of the model's concurrency slots, recording the wait; call the returned function to release it."""
+    semaphore = model_semaphore(model)
+    with tracing.span("openai.queue", metrics.upstream_queue_wait.labels(model)):
+        admission_class = await semaphore.acquire()
+    return lambda: semaphore.release(admission_class)
+
+
+async def _attempt(model: str, request, limit: bool):
+    if not limit:
+        return await request()
+    release = await acquire_slot(model)
+    try:
+        return await request()
+    finally:
+        release()
+
+
+async def _hedged(model: str, request, limit: bool, hedge_after: float):
+    """Start a second identical request if the first is not done after hedge_after seconds; keep the first success."""
+    tasks = [asyncio.ensure_future(_attempt(model, request, limit))]
+    try:
+        done, _ = await asyncio.wait(tasks, timeout=hedge_after)
+        if not done:
+            tasks.append(asyncio.ensure_future(_attempt(model, request, limit)))
+            logger.info(f"Hedging {model} call after {hedge_after}s")
+        pending = set(tasks)
+        error = None
+        while pending:
+            done, pending = await asyncio.wait(pending, return_when=asyncio.FIRST_COMPLETED)
+            for task in done:
+                if task.exception() is None:
+                    return task.result()
+                error = task.exception()
+        raise error
+    finally:
+        for task in tasks:
+            if not task.done():
+                task.cancel()
+            elif not task.cancelled():
+                task.exception()
+
+
+async def call_with_retries(model: str, request, deadline: float = None, hedge_after: float = None, limit: bool = True):
+    """
+    Run an upstream OpenAI call with a concurrency slot, retries and a deadline.
+    Args:
+        model: Model name; selects the concurrency semaphore.
+        request: Zero-argument coroutine factory that makes one API call.
+        deadline: Seconds for the whole call, retries included (default OPENAI_DEADLINE).
+        hedge_after: If set, race a duplicate request when an attempt takes longer than this.
+        limit: Acquire the model's semaphore for each attempt (the caller may hold it instead).
+    Returns:
+        The result of the first successful attempt.
+    """
+    deadline = deadline or OPENAI_DEADLINE
+    deadline_at = time.monotonic() + deadline
+    attempt = 0
+    while True:
+        remaining = deadline_at - time.monotonic()
+        try:
+            if hedge_after is not None and hedge_after < remaining:
+                call = _hedged(model, request, limit, hedge_after)
+            else:
+                call = _attempt(model, request, limit)
+            return await asyncio.wait_for(call, remaining)
+        except asyncio.TimeoutError:
+            raise TimeoutError(f"{model} call exceeded its {deadline:g}s deadline") from None
+        except Exception as e:
+            if not _retryable(e) or attempt >= OPENAI_MAX_RETRIES:
+                raise
+            requested = retry_after(e)
+            delay = backoff_delay(attempt, requested)
+            if time.monotonic() + delay >= deadline_at:
+                raise
+            if requested is not None:
+                # Duplicating requests while rate limited only makes it worse.
+                hedge_after = None
+            attempt += 1
+            metrics.upstream_retries.labels(model, type(e).__name__).inc()
+            logger.warning(f"{model} call failed ({type(e).__name__}: {e}); retry {attempt}/{OPENAI_MAX_RETRIES} in {delay:.2f}s")
+            await asyncio.sleep(delay)
+
+
+def http_error(e: Exception) -> HTTPException:
+    """Map an upstream failure to the HTTP error an endpoint should return."""
+    if isinstance(e, HTTPException):
+        return e
+    if isinstance(e, openai.RateLimitError):
+        requested = retry_after(e)
+        headers = {"Retry-After": str(max(1, round(requested)))} if requested is not None else None
+        return HTTPException(status_code=429, detail=str(e), headers=headers)
+    if isinstance(e, (TimeoutError, openai.APITimeoutError)):
+        return HTTPException(status_code=504, detail=str(e))
+    if isinstance(e, openai.APIConnectionError) or (isinstance(e, openai.APIStatusError) and e.status_code >= 500):
+        return HTTPException(status_code=502, detail=str(e))
+    return HTTPException(status_code=500, detail=str(e))
+
+
+def _sampling(model: str, max_output_tokens: int = None, temperature: float = None) -> dict:
+    if model in NO_SAMPLING_MODELS:
+        return {}
+    return dict(max_output_tokens=max_output_tokens, temperature=temperature)
+
+
+async def complition_model(model: str, instructions: str, input: str, max_output_tokens: int = None, temperature: float = None,
+                           prompt_cache_key: str = None, text_format: dict = None, deadline: float = None, hedge_after: float = None) -> str:
+    extra = _sampling(model, max_output_tokens, temperature)
+    if prompt_cache_key is not None:
+        # Routes requests that share a long static prefix to the same prompt cache.
+        extra["prompt_cache_key"] = prompt_cache_key
+    if text_format is not None:
+        # Structured output, e.g. prs.json_schema_format(SomeModel).
+        extra["text"] = {"format": text_format}
+    with metrics.UpstreamTimer("responses", model):
+        response = await call_with_retries(
+            model,
+            lambda: _client.responses.create(
+                model=model,
+                instructions=instructions,
+                input = input,
+                **extra
+            ),
+            deadline=deadline,
+            hedge_after=hedge_after,
         )
+    metrics.record_usage(model, usage_tokens(response))
     return response
+
+
+def usage_tokens(response) -> dict:
+    """
+    Token usage of a Responses API result.
+    Returns:
+        dict: input_tokens, cached_tokens (input tokens served from the prompt cache) and output_tokens.
+    """
+    usage = getattr(response, "usage", None)
+    if usage is None:
+        return {"input_tokens": 0, "cached_tokens": 0, "output_tokens": 0}
+    details = getattr(usage, "input_tokens_details", None)
+    return {
+        "input_tokens": usage.input_tokens,
+        "cached_tokens": getattr(details, "cached_tokens", 0) or 0,
+        "output_tokens": usage.output_tokens,
+    }
+
+
+async def complition_model_stream(model: str, instructions: str, input: str, max_output_tokens: int = None, temperature: float = None,
+                                  prompt_cache_key: str = None, text_format: dict = None, deadline: float = None):
+    """
+    Yield the output text deltas of a response as the model generates them.
+    Opening the stream is retried within the deadline; once text has been yielded a failure is raised as is.
+    The model's concurrency slot is held until the stream ends.
+    """
+    extra = _sampling(model, max_output_tokens, temperature)
+    if prompt_cache_key is not None:
+        extra["prompt_cache_key"] = prompt_cache_key
+    if text_format is not None:
+        extra["text"] = {"format": text_format}
+    with metrics.UpstreamTimer("responses.stream", model) as timer:
+        release = await acquire_slot(model)
+        try:
+            stream = await call_with_retries(
+                model,
+                lambda: _client.responses.create(
+                    model=model,
+                    instructions=instructions,
+                    input=input,
+                    stream=True,
+                    **extra
+                ),
+                deadline=deadline,
+                limit=False,
+            )
+            try:
+                async for event in stream:
+                    if event.type == "response.output_text.delta":
+                        timer.first_token()
+                        yield event.delta
+                    elif event.type == "response.completed":
+                        metrics.record_usage(model, usage_tokens(event.response))
+                    elif event.type in ("response.failed", "error"):
+                        raise RuntimeError(f"Response stream failed: {event}")
+            finally:
+                await stream.close()
+        finally:
+            release()
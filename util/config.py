@@ -2,24 +2,41 @@ import sys
 import os
 sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..')))
 from pathlib import Path
-from openai import AsyncOpenAI, audio
+from openai import AsyncOpenAI, DefaultAsyncHttpxClient, audio
+import httpx
 import dotenv 
 import os 
 from pydantic import BaseModel
-from fastapi import FastAPI, HTTPException, APIRouter
+from fastapi import FastAPI, HTTPException, APIRouter, Response
 from fastapi.middleware.cors import CORSMiddleware
 from fastapi.responses import StreamingResponse
 import uvicorn
+
+# Load environment variables from .env file before the util modules read their settings
+dotenv.load_dotenv()
+
 from util import parsingoutput as prs
 from util import classes as cls
-from safarai_chatbot.chatbot.chatbot import stream_response, system_prompt
+from util.metrics import MetricsMiddleware
+from util.tracing import TraceMiddleware, configure_logging
+from util.admission import AdmissionMiddleware
 
 
 try: 
-    # Load environment variables from .env file
-    dotenv.load_dotenv()
+    # Log lines carry the trace id of the request they belong to
+    configure_logging()
     key = os.getenv("OPEN_AI_KEY")
-    client = AsyncOpenAI(api_key=key)
+    # One pooled async client shared by every router. Limits are sized for many
+    # concurrent chat turns; OPENAI_MAX_CONNECTIONS / OPENAI_MAX_KEEPALIVE override them.
+    client = AsyncOpenAI(
+        api_key=key,
+        http_client=DefaultAsyncHttpxClient(
+            limits=httpx.Limits(
+                max_connections=int(os.getenv("OPENAI_MAX_CONNECTIONS", "1000")),
+                max_keepalive_connections=int(os.getenv("OPENAI_MAX_KEEPALIVE", "100")),
+            )
+        ),
+    )
 
     # Check if running behind a reverse proxy (production) or directly (development)
     # Set USE_ROOT_PATH=true in .env for production with reverse proxy
@@ -34,6 +51,9 @@ try:
         openapi_url="/openapi.json"
     )
 
+    # Priority lanes, queue limits and per-client rate limits; inside CORS so rejections carry CORS headers
+    app.add_middleware(AdmissionMiddleware)
+
     # Add CORS middleware
     app.add_middleware(
         CORSMiddleware,
@@ -43,6 +63,11 @@ try:
         allow_headers=["*"],
     )
 
+    # Per-route latency histograms and in-flight gauges, served at /metrics
+    app.add_middleware(MetricsMiddleware)
+    # Trace id (X-Trace-Id), per-phase spans and slow request logging
+    app.add_middleware(TraceMiddleware)
+
 
 except Exception as e:
     raise HTTPException(status_code = 500, detail = str(e))
\ No newline at end of file
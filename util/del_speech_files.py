@@ -1,21 +1,37 @@
-import os
-from pathlib import Path
-from util.config import Path, APIRouter, HTTPException
+from contextlib import asynccontextmanager
+from util.config import APIRouter, HTTPException
+from util.speech_janitor import speech_janitor
 import logging
 
 logging.basicConfig(level=logging.INFO)
-del_speech_files_router = APIRouter(tags=["del-speech-files"])
+
+
+@asynccontextmanager
+async def speech_janitor_lifespan(app):
+    await speech_janitor.start()
+    yield
+    await speech_janitor.stop()
+
+
+del_speech_files_router = APIRouter(tags=["del-speech-files"], lifespan=speech_janitor_lifespan)
 
 @del_speech_files_router.get("/del-speech-files")
-async def del_speech_files():
+async def del_speech_files(purge: bool = False):
+    """
+    Trigger a cleanup of the speechfiles directory and return immediately.
+    By default this is a normal size/age sweep; purge=true evicts every file that
+    has not been handed out recently. Deletion happens in the background janitor.
+    """
     try:
-        logging.info("Deleting speech files...")
-        speech_files_path = Path(__file__).parent.parent / "speechfiles"
-        speech_files = list(speech_files_path.glob("*.mp3"))
-        for speech_file in speech_files:
-            os.remove(speech_file)
-        logging.info(f"Deleted {len(speech_files)} speech files")
-        return {"message": "Speech files deleted successfully"}
+        logging.info(f"Speech files cleanup requested (purge={purge})")
+        speech_janitor.trigger(purge=purge)
+        return {"message": "Speech files cleanup scheduled", "stats": speech_janitor.snapshot()}
     except Exception as e:
-        logging.error(f"Error deleting speech files: {e}")
-        raise HTTPException(status_code=500, detail=str(e))
\ No newline at end of file
+        logging.error(f"Error scheduling speech files cleanup: {e}")
+        raise HTTPException(status_code=500, detail=str(e))
+
+
+@del_speech_files_router.get("/del-speech-files/stats")
+async def speech_files_stats():
+    """Current size of the speech cache and janitor eviction counters."""
+    return speech_janitor.snapshot()
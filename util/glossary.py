@@ -0,0 +1,450 @@
+import os
+import re
+import sys
+import json
+import mmap
+import time
+import asyncio
+import logging
+import struct
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable
+from util.translation_cache import normalize_text
+from util.tracing import span
+from util.singleflight import SingleFlight
+from util import metrics
+
+try:
+    import fcntl
+except ImportError:  # Windows: rebuilds are not locked across workers
+    fcntl = None
+
+GLOSSARY_ENABLED = os.getenv("GLOSSARY_ENABLED", "true").lower() in ("1", "true", "yes")
+GLOSSARY_DIR = Path(os.getenv("GLOSSARY_DIR", str(Path(__file__).parent.parent / "glossary")))
+# Messages of at most this many words and characters are looked up. Phrases of more than
+# one word are answered from seed entries only ("look after"), never learned: a short
+# sentence like "I am fine" is conversation, not a glossary term.
+GLOSSARY_MAX_WORDS = int(os.getenv("GLOSSARY_MAX_WORDS", "3"))
+GLOSSARY_MAX_CHARS = int(os.getenv("GLOSSARY_MAX_CHARS", "40"))
+# Answers kept in memory per worker, least recently used evicted first.
+GLOSSARY_CACHE_SIZE = int(os.getenv("GLOSSARY_CACHE_SIZE", "5000"))
+# Entries in the index; past this the oldest learned entries are dropped at the next rebuild (seed entries stay).
+GLOSSARY_MAX_ENTRIES = int(os.getenv("GLOSSARY_MAX_ENTRIES", "200000"))
+# Learned entries waiting in learned.jsonl before they are merged into the index.
+GLOSSARY_MERGE_AT = int(os.getenv("GLOSSARY_MERGE_AT", "200"))
+GLOSSARY_REFRESH_SECONDS = float(os.getenv("GLOSSARY_REFRESH_SECONDS", "30"))
+GLOSSARY_MAX_ANSWER_CHARS = int(os.getenv("GLOSSARY_MAX_ANSWER_CHARS", "1500"))
+# Learned (model) entries stop being served this long after they were added; seed entries never expire.
+GLOSSARY_LEARNED_TTL = float(os.getenv("GLOSSARY_LEARNED_TTL_DAYS", "30")) * 86400
+# Context-free model calls running at once per worker to fill glossary misses; further misses are skipped.
+GLOSSARY_BACKFILL_CONCURRENCY = int(os.getenv("GLOSSARY_BACKFILL_CONCURRENCY", "4"))
+
+REFUSAL = "I can only answer questions about learning English."
+# Greetings and one-word replies are conversation, not vocabulary questions.
+CHAT_WORDS = frozenset((
+    "hi", "hii", "hello", "hey", "bye", "goodbye", "thanks", "thank you", "thx", "ok", "okay", "yes", "no",
+    "yeah", "yep", "nope", "sure", "please", "help", "good", "great", "cool", "nice", "wow", "sorry",
+    "good morning", "good night", "good evening", "good afternoon", "how are you", "what", "why", "how",
+    "مرحبا", "اهلا", "أهلا", "شكرا", "نعم", "لا", "السلام عليكم", "مع السلامة",
+))
+
+_WORD = re.compile(r"[^\W\d_]+(?:['-][^\W\d_]+)*")
+_ARABIC = re.compile(r"[؀-ۿ]")
+_EDGE_PUNCTUATION = " \t\n.,!?;:\"'`«»“”‘’()[]{}؟،؛"
+
+# Index file: magic, entry count, one uint64 offset per entry (sorted by key), then "key\0json\n" records.
+_MAGIC = b"SAFGLOS1"
+_HEADER = struct.Struct("<8sQ")
+_OFFSET = struct.Struct("<Q")
+
+
+def normalize_term(text: str) -> str:
+    return normalize_text(text.replace("’", "'")).strip(_EDGE_PUNCTUATION).casefold()
+
+
+def glossary_term(message: str) -> str | None:
+    """
+    The normalized term when a chat message is a single word or a short phrase
+    ("apple", "look after", "مدرسة"), otherwise None. Greetings and yes/no replies
+    are not terms. Phrases only ever match seed entries (see is_phrase).
+    """
+    if not GLOSSARY_ENABLED or len(message) > GLOSSARY_MAX_CHARS * 2:
+        return None
+    term = normalize_term(message)
+    if not term or len(term) > GLOSSARY_MAX_CHARS or term in CHAT_WORDS:
+        return None
+    words = term.split(" ")
+    if len(words) > GLOSSARY_MAX_WORDS or not all(_WORD.fullmatch(word) for word in words):
+        return None
+    return term
+
+
+def is_phrase(term: str) -> bool:
+    return " " in term
+
+
+def acceptable_answer(term: str, answer: str) -> bool:
+    """A model reply worth reusing for term: bilingual, mentions the term, not a refusal or a long digression."""
+    return (
+        0 < len(answer) <= GLOSSARY_MAX_ANSWER_CHARS
+        and REFUSAL.casefold() not in answer.casefold()
+        and _ARABIC.search(answer) is not None
+        and term in answer.casefold()
+    )
+
+
+def _expires_at(entry: dict) -> float:
+    """When entry stops being served: never for seed entries, GLOSSARY_LEARNED_TTL after a model entry was added."""
+    if entry.get("source") == "seed":
+        return float("inf")
+    return entry.get("added", 0) + GLOSSARY_LEARNED_TTL
+
+
+def _file_version(path: Path) -> tuple | None:
+    try:
+        stat = path.stat()
+    except FileNotFoundError:
+        return None
+    return stat.st_ino, stat.st_mtime_ns, stat.st_size
+
+
+class GlossaryIndex:
+    """Read-only, memory-mapped glossary file. Lookups are a binary search over the sorted keys."""
+
+    def __init__(self, path: Path):
+        self.path = path
+        self.version = _file_version(path)
+        self.count = 0
+        self._mm = None
+        with open(path, "rb") as f:
+            if self.version and self.version[2] >= _HEADER.size:
+                self._mm = mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+                magic, self.count = _HEADER.unpack_from(self._mm, 0)
+                if magic != _MAGIC:
+                    raise ValueError(f"{path} is not a glossary index")
+
+    def _record(self, i: int) -> tuple[int, int]:
+        start = _OFFSET.unpack_from(self._mm, _HEADER.size + i * _OFFSET.size)[0]
+        return start, self._mm.find(b"\0", start)
+
+    def get(self, term: str) -> dict | None:
+        key = term.encode("utf-8")
+        low, high = 0, self.count
+        while low < high:
+            middle = (low + high) // 2
+            start, end = self._record(middle)
+            found = self._mm[start:end]
+            if found < key:
+                low = middle + 1
+            elif found > key:
+                high = middle
+            else:
+                return json.loads(self._mm[end + 1:self._mm.find(b"\n", end)])
+        return None
+
+    def items(self):
+        for i in range(self.count):
+            start, end = self._record(i)
+            yield self._mm[start:end].decode("utf-8"), json.loads(self._mm[end + 1:self._mm.find(b"\n", end)])
+
+    @staticmethod
+    def write(path: Path, entries: dict[str, dict]):
+        """Write entries (term -> entry) as a new index, atomically replacing any existing one."""
+        keys = sorted(term.encode("utf-8") for term in entries)
+        records = [
+            key + b"\0" + json.dumps(entries[key.decode("utf-8")], ensure_ascii=False).encode("utf-8") + b"\n"
+            for key in keys
+        ]
+        offsets, position = [], _HEADER.size + _OFFSET.size * len(records)
+        for record in records:
+            offsets.append(position)
+            position += len(record)
+        tmp = path.with_suffix(f".tmp{os.getpid()}")
+        with open(tmp, "wb") as f:
+            f.write(_HEADER.pack(_MAGIC, len(records)))
+            f.write(b"".join(_OFFSET.pack(offset) for offset in offsets))
+            f.writelines(records)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp, path)
+
+
+class Glossary:
+    """
+    Bilingual answers for single words and short phrases, shared by the chat routes.
+    Lookups go through a per-worker LRU, then entries learned since the last merge,
+    then the memory-mapped index (glossary.idx). Terms that missed are answered by a
+    separate, context-free model call (backfill) and appended to learned.jsonl, which
+    every worker reads on refresh; once it holds GLOSSARY_MERGE_AT entries one worker
+    merges it into a new index and the others remap it. Learned entries expire after
+    GLOSSARY_LEARNED_TTL; purge() removes one term, purge_learned() all of them.
+    """
+
+    def __init__(self, directory: Path = GLOSSARY_DIR, cache_size: int = GLOSSARY_CACHE_SIZE,
+                 max_entries: int = GLOSSARY_MAX_ENTRIES):
+        self.directory = Path(directory)
+        self.index_path = self.directory / "glossary.idx"
+        self.learned_path = self.directory / "learned.jsonl"
+        self.cache_size = cache_size
+        self.max_entries = max_entries
+        self._index: GlossaryIndex | None = None
+        self._learned: dict[str, dict] = {}
+        self._learned_at = (None, 0)  # (inode of learned.jsonl, bytes read)
+        self._cache: OrderedDict[str, tuple[str, float]] = OrderedDict()  # term -> (answer, expires at)
+        self._backfill = SingleFlight()
+        self._task: asyncio.Task | None = None
+        self.stats = {
+            "hits": 0, "misses": 0, "learned": 0, "rejected": 0, "backfills": 0, "backfills_skipped": 0,
+            "purged": 0, "rebuilds": 0, "errors": 0,
+        }
+
+    def lookup(self, term: str) -> str | None:
+        with span("glossary.lookup"):
+            now = time.time()
+            cached = self._cache.get(term)
+            if cached is not None and cached[1] > now:
+                answer = cached[0]
+                self._cache.move_to_end(term)
+            else:
+                answer = None
+                entry = self._learned.get(term)
+                if entry is None and self._index is not None:
+                    entry = self._index.get(term)
+                if entry is not None and (
+                    entry.get("purged") or _expires_at(entry) <= now
+                    or (is_phrase(term) and entry.get("source") != "seed")
+                ):
+                    entry = None
+                if entry is not None:
+                    answer = entry["answer"]
+                    self._remember(term, answer, _expires_at(entry))
+                else:
+                    self._cache.pop(term, None)
+        self.stats["misses" if answer is None else "hits"] += 1
+        metrics.cache_requests.labels("glossary", "miss" if answer is None else "hit").inc()
+        return answer
+
+    def _remember(self, term: str, answer: str, expires_at: float):
+        self._cache[term] = (answer, expires_at)
+        self._cache.move_to_end(term)
+        while len(self._cache) > self.cache_size:
+            self._cache.popitem(last=False)
+
+    async def learn(self, term: str, answer: str) -> bool:
+        """Keep a model answer for a single-word term if it looks like a glossary answer; returns whether it was kept."""
+        answer = answer.strip()
+        if is_phrase(term) or not acceptable_answer(term, answer):
+            self.stats["rejected"] += 1
+            return False
+        entry = {"term": term, "answer": answer, "source": "model", "added": int(time.time())}
+        self._learned[term] = entry
+        self._remember(term, answer, _expires_at(entry))
+        self.stats["learned"] += 1
+        await self._write(entry)
+        return True
+
+    def backfill(self, term: str, ask: Callable[[], Awaitable[str]]):
+        """
+        Learn term in the background from ask(), a model call made with the system prompt
+        and the term only. The reply to the student's own request is never learned: it
+        depends on their conversation, which can steer it anywhere. Skipped for phrases,
+        for terms already being backfilled, and when GLOSSARY_BACKFILL_CONCURRENCY calls
+        are running.
+        """
+        if is_phrase(term) or self._backfill.inflight(term):
+            return
+        if len(self._backfill) >= GLOSSARY_BACKFILL_CONCURRENCY:
+            self.stats["backfills_skipped"] += 1
+            return
+        self.stats["backfills"] += 1
+        self._backfill.start(term, lambda: self._run_backfill(term, ask))
+
+    async def _run_backfill(self, term: str, ask: Callable[[], Awaitable[str]]):
+        try:
+            await self.learn(term, await ask())
+        except Exception as e:
+            self.stats["errors"] += 1
+            logging.error(f"Glossary backfill for {term!r} failed: {e}")
+
+    async def purge(self, term: str):
+        """Stop serving term (learned or seed) in every worker; it is dropped from the index at the next rebuild."""
+        entry = {"term": term, "purged": True, "added": int(time.time())}
+        self._learned[term] = entry
+        self._cache.pop(term, None)
+        self.stats["purged"] += 1
+        await self._write(entry)
+
+    async def purge_learned(self) -> bool:
+        """Rebuild the index from seed entries only. Returns False if another worker is rebuilding."""
+        return await self.rebuild(keep_learned=False)
+
+    async def _write(self, entry: dict):
+        try:
+            await asyncio.to_thread(self._append, entry)
+        except OSError as e:
+            self.stats["errors"] += 1
+            logging.error(f"Glossary write failed: {e}")
+
+    def _append(self, entry: dict):
+        self.directory.mkdir(parents=True, exist_ok=True)
+        # One write per line with O_APPEND, so lines from several workers do not interleave.
+        with open(self.learned_path, "ab") as f:
+            f.write((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8"))
+
+    def _read_learned(self, path: Path, inode, position: int) -> tuple[dict, tuple]:
+        """Complete lines of path from position on (from the start if the file was replaced)."""
+        entries = {}
+        try:
+            with open(path, "rb") as f:
+                current = os.fstat(f.fileno()).st_ino
+                if current != inode:
+                    position = 0
+                f.seek(position)
+                data = f.read()
+        except FileNotFoundError:
+            return entries, (None, 0)
+        complete = data.rfind(b"\n") + 1
+        for line in data[:complete].splitlines():
+            try:
+                entry = json.loads(line)
+                entries[entry["term"]] = entry
+            except (ValueError, KeyError):
+                continue
+        return entries, (current, position + complete)
+
+    def _scan(self, index_version, learned_at: tuple) -> tuple:
+        """Worker-thread half of refresh(): a new index if the file changed, and new learned lines."""
+        index = None
+        if _file_version(self.index_path) != index_version:
+            index = GlossaryIndex(self.index_path) if self.index_path.exists() else False
+            learned_at = (None, 0)
+        learned, learned_at = self._read_learned(self.learned_path, *learned_at)
+        return index, learned, learned_at
+
+    async def refresh(self):
+        """Pick up another worker's rebuild and learned entries; merge learned.jsonl once it is large enough."""
+        index_version = self._index.version if self._index is not None else None
+        try:
+            index, learned, learned_at = await asyncio.to_thread(self._scan, index_version, self._learned_at)
+        except (OSError, ValueError) as e:
+            self.stats["errors"] += 1
+            logging.error(f"Glossary refresh failed: {e}")
+            return
+        if index is not None:
+            # The old map is closed when the last lookup using it is done, not here.
+            self._index = index or None
+            self._learned = learned
+            self._cache.clear()
+        else:
+            self._learned.update(learned)
+            # Another worker may have purged or relearned these terms.
+            for term in learned:
+                self._cache.pop(term, None)
+        self._learned_at = learned_at
+        if len(self._learned) >= GLOSSARY_MERGE_AT:
+            await self.rebuild()
+
+    async def rebuild(self, seed: dict[str, dict] | None = None, keep_learned: bool = True) -> bool:
+        try:
+            rebuilt = await asyncio.to_thread(self._rebuild, seed, keep_learned)
+        except (OSError, ValueError) as e:
+            self.stats["errors"] += 1
+            logging.error(f"Glossary rebuild failed: {e}")
+            return False
+        if rebuilt:
+            self.stats["rebuilds"] += 1
+            await self.refresh()
+        return rebuilt
+
+    def _rebuild(self, seed: dict[str, dict] | None, keep_learned: bool = True) -> bool:
+        """
+        Merge learned.jsonl (and seed entries) into a new index, dropping purged terms and
+        expired learned entries, or every learned entry unless keep_learned. Returns False
+        if another worker is doing it.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        with open(self.directory / "glossary.lock", "wb") as lock:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(lock, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return False
+            # New answers go to a fresh learned.jsonl while this one is merged.
+            merging = self.directory / "learned.merging.jsonl"
+            if self.learned_path.exists() and not merging.exists():
+                os.replace(self.learned_path, merging)
+            entries = {}
+            if self.index_path.exists():
+                index = GlossaryIndex(self.index_path)
+                entries.update(index.items())
+            learned, _ = self._read_learned(merging, None, 0)
+            for term, entry in learned.items():
+                if entry.get("purged"):
+                    entries.pop(term, None)
+                elif not is_phrase(term) and entries.get(term, {}).get("source") != "seed":
+                    entries[term] = entry
+            now = time.time()
+            entries = {
+                term: entry for term, entry in entries.items()
+                if entry.get("source") == "seed" or (keep_learned and _expires_at(entry) > now)
+            }
+            entries.update(seed or {})
+            if len(entries) > self.max_entries:
+                newest = sorted(entries.items(), key=lambda item: (item[1].get("source") == "seed", item[1].get("added", 0)))
+                entries = dict(newest[-self.max_entries:])
+            with span("glossary.rebuild"):
+                GlossaryIndex.write(self.index_path, entries)
+            merging.unlink(missing_ok=True)
+            logging.info(f"Glossary index rebuilt with {len(entries)} entries ({len(learned)} learned)")
+            return True
+
+    async def _refresh_loop(self):
+        while True:
+            await asyncio.sleep(GLOSSARY_REFRESH_SECONDS)
+            await self.refresh()
+
+    async def start(self):
+        if self._task is None and GLOSSARY_ENABLED:
+            await self.refresh()
+            self._task = asyncio.create_task(self._refresh_loop())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    def snapshot(self) -> dict:
+        lookups = self.stats["hits"] + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": round(self.stats["hits"] / lookups, 4) if lookups else None,
+            "enabled": GLOSSARY_ENABLED,
+            "index_entries": self._index.count if self._index is not None else 0,
+            "learned_entries": len(self._learned),
+            "cached": len(self._cache),
+            "cache_size": self.cache_size,
+            "directory": str(self.directory),
+        }
+
+
+glossary = Glossary()
+
+
+def read_seed(path: str) -> dict[str, dict]:
+    """Seed entries from a JSONL file of {"term": ..., "answer": ...} lines."""
+    seed = {}
+    with open(path, encoding="utf-8") as f:
+        for line in f:
+            if line.strip():
+                item = json.loads(line)
+                seed[normalize_term(item["term"])] = {"term": normalize_term(item["term"]), "answer": item["answer"].strip(), "source": "seed"}
+    return seed
+
+
+if __name__ == "__main__":
+    # python -m util.glossary build data/glossary.jsonl
+    if len(sys.argv) != 3 or sys.argv[1] != "build":
+        sys.exit("usage: python -m util.glossary build SEED.jsonl")
+    logging.basicConfig(level=logging.INFO)
+    asyncio.run(glossary.rebuild(read_seed(sys.argv[2])))
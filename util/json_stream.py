@@ -0,0 +1,75 @@
+import json
+
+
+class JsonStreamParser:
+    """
+    Incremental parser for one JSON object that arrives in chunks (e.g. streamed model output).
+    feed() scans only the new characters and returns (key, element) for every object or
+    array element of a top-level array field that has just been completed, e.g.
+    ("criteria", {...}) for {"criteria": [{...}, ...]}. Once the closing brace arrives,
+    `result` holds the whole parsed object. Malformed JSON raises ValueError, from the
+    element or the closing brace where it is found.
+    """
+
+    def __init__(self):
+        self.text = ""
+        self.result = None
+        self._pos = 0
+        self._stack: list[str] = []
+        self._in_string = False
+        self._escape = False
+        self._string_start = 0
+        self._last_string = None
+        self._key = None
+        self._start = None
+        self._element_start = None
+
+    def feed(self, chunk: str) -> list[tuple[str, object]]:
+        self.text += chunk
+        completed = []
+        text = self.text
+        for pos in range(self._pos, len(text)):
+            char = text[pos]
+            if self.result is not None or (self._start is None and char != "{"):
+                # Text before or after the object (prose, code fences) is ignored.
+                continue
+            if self._in_string:
+                if self._escape:
+                    self._escape = False
+                elif char == "\\":
+                    self._escape = True
+                elif char == '"':
+                    self._in_string = False
+                    self._last_string = text[self._string_start:pos + 1]
+                continue
+            depth = len(self._stack)
+            if depth == 2 and self._stack[-1] == "[" and self._element_start is None and char not in " \t\r\n,]":
+                self._element_start = pos
+            if char == '"':
+                self._in_string = True
+                self._string_start = pos
+            elif char == ":" and depth == 1:
+                if self._last_string is None:
+                    raise ValueError(f"Expected a key before ':' at position {pos}")
+                self._key = json.loads(self._last_string)
+            elif char in "{[":
+                if self._start is None:
+                    self._start = pos
+                self._stack.append(char)
+            elif char in "}]":
+                self._stack.pop()
+                if not self._stack:
+                    self.result = json.loads(text[self._start:pos + 1])
+                elif len(self._stack) == 2 and self._element_start is not None:
+                    completed.append((self._key, json.loads(text[self._element_start:pos + 1])))
+                    self._element_start = None
+                elif len(self._stack) == 1 and self._element_start is not None:
+                    # The array closed right after a scalar element.
+                    completed.append((self._key, json.loads(text[self._element_start:pos])))
+                    self._element_start = None
+            elif char == "," and depth == 2 and self._element_start is not None:
+                # End of a scalar array element.
+                completed.append((self._key, json.loads(text[self._element_start:pos])))
+                self._element_start = None
+        self._pos = len(text)
+        return completed
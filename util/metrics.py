@@ -0,0 +1,461 @@
+import os
+import json
+import time
+import asyncio
+import logging
+import threading
+from abc import ABC, abstractmethod
+from contextlib import asynccontextmanager
+from bisect import bisect_left
+from util import tracing
+from fastapi import APIRouter
+from fastapi.responses import PlainTextResponse
+
+logger = logging.getLogger(__name__)
+
+# Seconds. Covers quick cache hits up to multi-minute bulk grading calls.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Directory shared by the worker processes (serve.py sets one up for multi-worker runs).
+# Each worker writes its values there every METRICS_FLUSH_SECONDS, and /metrics on any
+# worker reports the total over all of them.
+METRICS_MULTIPROC_DIR = os.getenv("METRICS_MULTIPROC_DIR", "")
+METRICS_FLUSH_SECONDS = float(os.getenv("METRICS_FLUSH_SECONDS", "5"))
+
+_metrics: list["Metric"] = []
+_collectors = []
+# (pid, start time in ns) of this worker, which names its file in METRICS_MULTIPROC_DIR.
+_worker: tuple[int, int] | None = None
+
+
+def _escape(value: str) -> str:
+    return str(value).replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class Metric(ABC):
+    """
+    Base class of the metric types: a name, help text and a fixed set of label names.
+    labels(...) returns the child for one combination of label values; children are
+    cached, so the hot path is a dict lookup plus an addition. Metrics are only updated
+    from the event loop, so no locking is needed.
+    """
+    kind = "untyped"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = ()):
+        self.name = name
+        self.help = help
+        self.labelnames = tuple(labelnames)
+        self._children: dict[tuple, object] = {}
+        if not self.labelnames:
+            self._children[()] = self._child()
+        _metrics.append(self)
+
+    @abstractmethod
+    def _child(self):
+        """A new child holding the value of one label combination."""
+
+    def labels(self, *values):
+        child = self._children.get(values)
+        if child is None:
+            if len(values) != len(self.labelnames):
+                raise ValueError(f"{self.name} expects labels {self.labelnames}, got {values}")
+            child = self._children[values] = self._child()
+        return child
+
+    def _label_text(self, values: tuple, extra: str = "") -> str:
+        pairs = [f'{name}="{_escape(value)}"' for name, value in zip(self.labelnames, values)]
+        if extra:
+            pairs.append(extra)
+        return "{" + ",".join(pairs) + "}" if pairs else ""
+
+    def state(self) -> dict:
+        """A copy of every child's value, keyed by label values; what workers share and render() formats."""
+        return {values: child.state() for values, child in list(self._children.items())}
+
+    def merge(self, state: dict, values: tuple, value):
+        """Add another worker's value for one label combination into state."""
+        state[values] = state.get(values, 0.0) + value
+
+    def render(self, state: dict | None = None) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, value in (self.state() if state is None else state).items():
+            lines.append(f"{self.name}{self._label_text(values)} {_format(value)}")
+        return lines
+
+
+class _Value:
+    __slots__ = ("value",)
+
+    def __init__(self):
+        self.value = 0.0
+
+    def state(self) -> float:
+        return self.value
+
+    def inc(self, amount: float = 1):
+        self.value += amount
+
+    def dec(self, amount: float = 1):
+        self.value -= amount
+
+    def set(self, value: float):
+        self.value = value
+
+
+class Counter(Metric):
+    kind = "counter"
+
+    def _child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self._children[()].inc(amount)
+
+
+class Gauge(Metric):
+    """
+    Across workers, gauges of live workers are summed (requests in flight), or with
+    mode="max" the largest is reported, for values every worker reads from shared
+    state (sessions in the SQLite store).
+    """
+    kind = "gauge"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), mode: str = "sum"):
+        self.mode = mode
+        super().__init__(name, help, labelnames)
+
+    def merge(self, state: dict, values: tuple, value):
+        if self.mode == "max":
+            state[values] = max(state.get(values, value), value)
+        else:
+            super().merge(state, values, value)
+
+    def _child(self):
+        return _Value()
+
+    def inc(self, amount: float = 1):
+        self._children[()].inc(amount)
+
+    def dec(self, amount: float = 1):
+        self._children[()].dec(amount)
+
+    def set(self, value: float):
+        self._children[()].set(value)
+
+
+class _Buckets:
+    __slots__ = ("bounds", "counts", "sum")
+
+    def __init__(self, bounds: tuple):
+        self.bounds = bounds
+        self.counts = [0] * (len(bounds) + 1)
+        self.sum = 0.0
+
+    def observe(self, value: float):
+        # Per-bucket counts; they are made cumulative only when rendered.
+        self.counts[bisect_left(self.bounds, value)] += 1
+        self.sum += value
+
+    def state(self) -> tuple[list, float]:
+        return list(self.counts), self.sum
+
+
+class Histogram(Metric):
+    kind = "histogram"
+
+    def __init__(self, name: str, help: str, labelnames: tuple = (), buckets: tuple = DEFAULT_BUCKETS):
+        self.buckets = tuple(sorted(buckets))
+        super().__init__(name, help, labelnames)
+
+    def _child(self):
+        return _Buckets(self.buckets)
+
+    def observe(self, value: float):
+        self._children[()].observe(value)
+
+    def merge(self, state: dict, values: tuple, value):
+        counts, total = value
+        if values in state:
+            mine, my_total = state[values]
+            state[values] = ([a + b for a, b in zip(mine, counts)], my_total + total)
+        else:
+            state[values] = (list(counts), total)
+
+    def render(self, state: dict | None = None) -> list[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for values, (counts, observed_sum) in (self.state() if state is None else state).items():
+            total = 0
+            for bound, count in zip(self.buckets + (float("inf"),), counts):
+                total += count
+                le = 'le="' + _format(bound) + '"'
+                lines.append(f"{self.name}_bucket{self._label_text(values, le)} {total}")
+            labels = self._label_text(values)
+            lines.append(f"{self.name}_sum{labels} {observed_sum}")
+            lines.append(f"{self.name}_count{labels} {total}")
+        return lines
+
+
+def add_collector(collector):
+    """Register a coroutine function that refreshes gauges right before each scrape (e.g. counts kept in a store)."""
+    _collectors.append(collector)
+
+
+def _alive(pid: int) -> bool:
+    if os.name == "nt":
+        return True
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        pass
+    return True
+
+
+def _write_worker_file(path: str, data: dict):
+    tmp = f"{path}.{threading.get_ident()}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f)
+    os.replace(tmp, path)
+
+
+def _read_worker_files(directory: str) -> list[tuple[bool, dict]]:
+    """
+    (alive, metrics) of every worker that has written its values, including exited ones.
+    A pid can come back as a new worker after a restart; only the latest file of a pid
+    belongs to the live process.
+    """
+    files = []
+    for name in os.listdir(directory):
+        if not name.endswith(".json"):
+            continue
+        try:
+            with open(os.path.join(directory, name), encoding="utf-8") as f:
+                data = json.load(f)
+        except (OSError, ValueError):
+            continue
+        files.append(data)
+    latest = {}
+    for data in files:
+        latest[data["pid"]] = max(latest.get(data["pid"], 0), data.get("started", 0))
+    return [
+        (data.get("started", 0) == latest[data["pid"]] and _alive(data["pid"]), data["metrics"])
+        for data in files
+    ]
+
+
+async def flush():
+    """Write this worker's values to METRICS_MULTIPROC_DIR for the other workers' scrapes."""
+    global _worker
+    if _worker is None or _worker[0] != os.getpid():
+        _worker = (os.getpid(), time.time_ns())
+    pid, started = _worker
+    data = {
+        "pid": pid,
+        "started": started,
+        "metrics": {metric.name: [[list(values), value] for values, value in metric.state().items()] for metric in _metrics},
+    }
+    await asyncio.to_thread(_write_worker_file, os.path.join(METRICS_MULTIPROC_DIR, f"{pid}-{started}.json"), data)
+
+
+async def render() -> str:
+    """
+    All metrics in the Prometheus text exposition format. With METRICS_MULTIPROC_DIR set,
+    this worker flushes its own values and then sums every worker's file. Each worker's
+    share therefore only grows between scrapes, whichever worker answers. Counters and
+    histograms of exited workers are kept, so totals never go backwards when a worker restarts.
+    """
+    results = await asyncio.gather(*(collector() for collector in _collectors), return_exceptions=True)
+    for collector, result in zip(_collectors, results):
+        if isinstance(result, Exception):
+            logger.warning(f"Metrics collector {collector.__qualname__} failed: {result}")
+    if not METRICS_MULTIPROC_DIR:
+        return "\n".join(line for metric in _metrics for line in metric.render()) + "\n"
+    await flush()
+    workers = await asyncio.to_thread(_read_worker_files, METRICS_MULTIPROC_DIR)
+    lines = []
+    for metric in _metrics:
+        state = {}
+        for alive, values in workers:
+            if metric.kind == "gauge" and not alive:
+                continue
+            for labels, value in values.get(metric.name, ()):
+                metric.merge(state, tuple(labels), value)
+        lines.extend(metric.render(state))
+    return "\n".join(lines) + "\n"
+
+
+# HTTP layer
+http_requests_in_flight = Gauge("http_requests_in_flight", "HTTP requests currently being served.")
+http_request_duration = Histogram(
+    "http_request_duration_seconds", "Time from receiving a request to sending the last byte of its response.",
+    ("method", "route", "status"),
+)
+http_streams_in_flight = Gauge("http_streams_in_flight", "Streaming responses (SSE, audio) currently open.", ("route",))
+http_stream_first_byte = Histogram(
+    "http_stream_first_byte_seconds", "Time until the first body chunk of a streaming response.", ("route",),
+)
+
+# Upstream (OpenAI) calls
+upstream_duration = Histogram(
+    "openai_request_duration_seconds",
+    "Duration of upstream OpenAI calls including retries and concurrency waits; streams are timed until the last chunk.",
+    ("operation", "model", "outcome"),
+)
+upstream_first_token = Histogram(
+    "openai_time_to_first_token_seconds", "Time until a streamed upstream call produced its first chunk.",
+    ("operation", "model"),
+)
+upstream_queue_wait = Histogram(
+    "openai_concurrency_wait_seconds", "Time spent waiting for a per-model concurrency slot.", ("model",),
+)
+upstream_retries = Counter("openai_retries_total", "Upstream attempts that failed and were retried.", ("model", "error"))
+upstream_tokens = Counter(
+    "openai_tokens_total", "Tokens reported by the API; type is input, cached (input served from the prompt cache) or output.",
+    ("model", "type"),
+)
+upstream_audio_bytes = Counter("openai_audio_bytes_total", "Bytes of synthesized speech received.", ("model",))
+
+# Local work
+file_io_duration = Histogram(
+    "file_io_duration_seconds", "Time spent on local file reads and writes.", ("operation",),
+    buckets=(0.0005, 0.001, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5),
+)
+cache_requests = Counter("cache_requests_total", "Cache lookups by cache and result (hit or miss).", ("cache", "result"))
+realtime_sessions_active = Gauge("realtime_sessions_active", "Realtime sessions in the session store.", mode="max")
+
+
+def record_usage(model: str, usage: dict):
+    """Add a usage_tokens()-style dict (input_tokens, cached_tokens, output_tokens) to the token counters."""
+    for kind in ("input", "cached", "output"):
+        amount = usage.get(f"{kind}_tokens") or 0
+        if amount:
+            upstream_tokens.labels(model, kind).inc(amount)
+
+
+class UpstreamTimer:
+    """
+    Times one upstream call:
+
+        with UpstreamTimer("responses", model) as timer:
+            async for chunk in stream:
+                timer.first_token()
+                ...
+
+    The outcome label is ok, error, or cancelled (client went away, generator closed);
+    set `outcome` inside the block for failures that are returned rather than raised.
+    The call is also a span ("openai.<operation>") of the current request's trace.
+    """
+    __slots__ = ("operation", "model", "outcome", "started", "_first", "_span")
+
+    def __init__(self, operation: str, model: str):
+        self.operation = operation
+        self.model = model
+        self.outcome = None
+        self._first = False
+        self._span = tracing.span(f"openai.{operation}")
+
+    def __enter__(self):
+        self._span.__enter__()
+        self.started = time.perf_counter()
+        return self
+
+    def first_token(self):
+        if not self._first:
+            self._first = True
+            waited = time.perf_counter() - self.started
+            upstream_first_token.labels(self.operation, self.model).observe(waited)
+            if self._span.trace is not None:
+                self._span.trace.add(f"openai.{self.operation}.first_token", self.started, waited)
+
+    def __exit__(self, exc_type, exc, traceback):
+        if exc_type is None:
+            outcome = self.outcome or "ok"
+        elif issubclass(exc_type, (asyncio.CancelledError, GeneratorExit)):
+            outcome = "cancelled"
+        else:
+            outcome = "error"
+        upstream_duration.labels(self.operation, self.model, outcome).observe(time.perf_counter() - self.started)
+        self._span.__exit__(exc_type, exc, traceback)
+        return False
+
+
+def _route(scope) -> str:
+    # Route templates (/correction/jobs/{job_id}) rather than raw paths keep the label set small.
+    route = scope.get("route")
+    return getattr(route, "path", None) or "unmatched"
+
+
+class MetricsMiddleware:
+    """Plain ASGI middleware (no per-request task or body buffering) that records the HTTP metrics above."""
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        started = time.perf_counter()
+        status = 500
+        stream_route = None
+
+        async def send_with_metrics(message):
+            nonlocal status, stream_route
+            if message["type"] == "http.response.start":
+                status = message["status"]
+            elif message["type"] == "http.response.body" and stream_route is None and message.get("more_body"):
+                stream_route = _route(scope)
+                http_streams_in_flight.labels(stream_route).inc()
+                http_stream_first_byte.labels(stream_route).observe(time.perf_counter() - started)
+            await send(message)
+
+        http_requests_in_flight.inc()
+        try:
+            await self.app(scope, receive, send_with_metrics)
+        finally:
+            http_requests_in_flight.dec()
+            if stream_route is not None:
+                http_streams_in_flight.labels(stream_route).dec()
+            http_request_duration.labels(scope["method"], _route(scope), str(status)).observe(time.perf_counter() - started)
+
+
+async def _flush_loop():
+    while True:
+        await asyncio.sleep(METRICS_FLUSH_SECONDS)
+        try:
+            await flush()
+        except OSError as e:
+            logger.warning(f"Could not write worker metrics to {METRICS_MULTIPROC_DIR}: {e}")
+
+
+@asynccontextmanager
+async def metrics_lifespan(app):
+    if not METRICS_MULTIPROC_DIR:
+        yield
+        return
+    os.makedirs(METRICS_MULTIPROC_DIR, exist_ok=True)
+    task = asyncio.create_task(_flush_loop())
+    yield
+    task.cancel()
+    try:
+        await flush()
+    except OSError as e:
+        logger.warning(f"Could not write worker metrics to {METRICS_MULTIPROC_DIR}: {e}")
+
+
+metrics_router = APIRouter(tags=["metrics"], lifespan=metrics_lifespan)
+
+
+@metrics_router.get("/metrics", response_class=PlainTextResponse, include_in_schema=False)
+async def metrics():
+    """Prometheus scrape endpoint. With several workers, the totals over all of them (see METRICS_MULTIPROC_DIR)."""
+    return PlainTextResponse(await render(), media_type=CONTENT_TYPE)
@@ -1,5 +1,80 @@
 import json
 import re
+from functools import lru_cache
+from pydantic import BaseModel, ValidationError
+
+_decoder = json.JSONDecoder()
+
+
+def _strict_schema(schema):
+    """Adapt a pydantic JSON schema to structured-output strict mode: closed objects, every property required, no defaults."""
+    if isinstance(schema, list):
+        return [_strict_schema(value) for value in schema]
+    if not isinstance(schema, dict):
+        return schema
+    strict = {}
+    for key, value in schema.items():
+        if key in ("default", "title"):
+            continue
+        if key in ("properties", "$defs"):
+            # Keys here are field / definition names, not schema keywords.
+            strict[key] = {name: _strict_schema(sub) for name, sub in value.items()}
+        else:
+            strict[key] = _strict_schema(value)
+    if strict.get("type") == "object" and "properties" in strict:
+        strict["additionalProperties"] = False
+        strict["required"] = list(strict["properties"])
+    return strict
+
+
+@lru_cache(maxsize=None)
+def json_schema_format(model: type[BaseModel]) -> dict:
+    """
+    Responses API `text.format` asking the model for JSON that matches a pydantic model.
+    Args:
+        model: The pydantic model the output must validate into.
+    Returns:
+        dict: A strict json_schema format named after the model.
+    """
+    return {"type": "json_schema", "name": model.__name__, "schema": _strict_schema(model.model_json_schema()), "strict": True}
+
+
+def extract_json_object(text: str) -> dict | None:
+    """
+    Return the first JSON object embedded in text (e.g. wrapped in prose or a code fence), or None.
+    Each candidate is decoded with JSONDecoder.raw_decode, which stops at the end of the
+    object, so nothing after it is scanned and quotes inside strings are kept intact.
+    A "{" that does not start a valid object restarts the decode at the next "{", so text
+    full of stray braces is O(n^2) in the worst case; model output has one or two.
+    """
+    start = text.find("{")
+    while start != -1:
+        try:
+            value, _ = _decoder.raw_decode(text, start)
+            if isinstance(value, dict):
+                return value
+        except ValueError:
+            pass
+        start = text.find("{", start + 1)
+    return None
+
+
+def parse_model(response, model: type[BaseModel]):
+    """
+    Validate a response's output text into a pydantic model.
+    Structured output is plain JSON and validates directly; otherwise the first JSON
+    object in the text is used. Raises ValueError if neither validates.
+    """
+    output_text = response.output_text.strip()
+    try:
+        return model.model_validate_json(output_text)
+    except ValidationError:
+        pass
+    data = extract_json_object(output_text)
+    if data is None:
+        raise ValueError(f"No JSON object in the model output for {model.__name__}")
+    return model.model_validate(data)
+
 
 def extract_json_from_response(response, header: str = "output:") -> dict:
     """
@@ -16,6 +91,11 @@ def extract_json_from_response(response, header: str = "output:") -> dict:
     if output_text.startswith(header):
         output_text = output_text[len(header):].strip()
     
+    # Fast path: the first well-formed JSON object in the text
+    data = extract_json_object(output_text)
+    if data is not None:
+        return data
+
     # Try to find JSON object in the text
     json_match = re.search(r'\{.*\}', output_text, re.DOTALL)
     if json_match:
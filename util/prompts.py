@@ -0,0 +1,143 @@
+import os
+import time
+import asyncio
+import hashlib
+import logging
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from pathlib import Path
+from util.tracing import span
+
+CONFIG_DIR = Path(__file__).parent.parent / "config"
+PROMPT_CHECK_INTERVAL = float(os.getenv("PROMPT_CHECK_INTERVAL", "5"))
+PROMPT_SUFFIXES = (".txt", ".json")
+
+
+@dataclass(frozen=True)
+class Prompt:
+    name: str
+    text: str
+    version: str
+    mtime: float
+    loaded_at: float
+
+
+def _read_prompt(path: Path) -> Prompt:
+    with span("prompt.read"):
+        text = path.read_text(encoding="utf-8")
+    return Prompt(
+        name=path.stem,
+        text=text,
+        version=hashlib.sha256(text.encode("utf-8")).hexdigest()[:12],
+        mtime=path.stat().st_mtime,
+        loaded_at=time.time(),
+    )
+
+
+class PromptRegistry:
+    """
+    In-memory copy of the prompt, rubric and profile files under config/.
+    Everything is read once at startup (prompt_registry_lifespan, on every router that
+    reads prompts); handlers get immutable strings without any file I/O. A background
+    watcher re-reads files whose mtime changed, so edits take effect without a restart.
+    Each prompt carries a short content hash as its version.
+    """
+
+    def __init__(self, directory: Path = CONFIG_DIR, check_interval: float = PROMPT_CHECK_INTERVAL):
+        self.directory = Path(directory)
+        self.check_interval = check_interval
+        self._prompts: dict[str, Prompt] = {}
+        self._loaded = False
+        self._task: asyncio.Task | None = None
+
+    def _files(self) -> list[Path]:
+        return sorted(p for p in self.directory.iterdir() if p.suffix in PROMPT_SUFFIXES and p.is_file())
+
+    def reload(self) -> list[str]:
+        """
+        Re-read every file whose mtime changed (and pick up new or removed files).
+        Returns:
+            list[str]: Names of the prompts that changed.
+        """
+        changed = []
+        seen = set()
+        for path in self._files():
+            seen.add(path.stem)
+            current = self._prompts.get(path.stem)
+            if current is not None and current.mtime == path.stat().st_mtime:
+                continue
+            prompt = _read_prompt(path)
+            if current is None or current.version != prompt.version:
+                changed.append(prompt.name)
+            self._prompts[prompt.name] = prompt
+        for name in set(self._prompts) - seen:
+            del self._prompts[name]
+            changed.append(name)
+        self._loaded = True
+        if changed:
+            logging.info(f"Loaded prompts: {', '.join(f'{n}@{self.version(n)}' for n in changed)}")
+        return changed
+
+    def _require_loaded(self):
+        if not self._loaded:
+            # Loading here would read files on the event loop; scripts call reload() themselves.
+            raise RuntimeError("Prompts are not loaded; start the registry from the router's lifespan")
+
+    def get(self, name: str) -> Prompt:
+        """Return the current prompt called name (file name without extension)."""
+        self._require_loaded()
+        try:
+            return self._prompts[name]
+        except KeyError:
+            raise KeyError(f"Unknown prompt '{name}' in {self.directory}") from None
+
+    def text(self, name: str) -> str:
+        return self.get(name).text
+
+    def version(self, name: str) -> str | None:
+        prompt = self._prompts.get(name)
+        return prompt.version if prompt else None
+
+    def versions(self, *names: str) -> dict[str, str]:
+        """Versions of the given prompts, or of every prompt when no names are given."""
+        self._require_loaded()
+        names = names or tuple(sorted(self._prompts))
+        return {name: self.get(name).version for name in names}
+
+    def version_header(self, *names: str) -> str:
+        """Compact 'name=version,...' string for an X-Prompt-Version response header."""
+        return ",".join(f"{name}={version}" for name, version in self.versions(*names).items())
+
+    async def _watch(self):
+        while True:
+            await asyncio.sleep(self.check_interval)
+            try:
+                await asyncio.to_thread(self.reload)
+            except Exception as e:
+                logging.error(f"Prompt reload failed: {e}")
+
+    async def start(self):
+        """Load the prompts in a worker thread and start the watcher; several routers may call this."""
+        if not self._loaded:
+            await asyncio.to_thread(self.reload)
+        if self._task is None and self.check_interval > 0:
+            self._task = asyncio.create_task(self._watch())
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+prompt_registry = PromptRegistry()
+
+
+@asynccontextmanager
+async def prompt_registry_lifespan(app):
+    await prompt_registry.start()
+    yield
+    await prompt_registry.stop()
@@ -0,0 +1,47 @@
+import asyncio
+from typing import Awaitable, Callable, Hashable
+
+
+class SingleFlight:
+    """
+    Collapses concurrent calls that share a key into a single in-flight task.
+    The first caller for a key starts the work; every caller that arrives while it is
+    still running awaits the same result (or exception) instead of repeating it.
+    """
+
+    def __init__(self):
+        self._inflight: dict[Hashable, asyncio.Future] = {}
+
+    def inflight(self, key: Hashable) -> bool:
+        return key in self._inflight
+
+    def __len__(self) -> int:
+        return len(self._inflight)
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable]):
+        """
+        Run fn() once for all concurrent callers of key.
+        Args:
+            key: Identifies identical work, e.g. a cache key.
+            fn: Zero-argument coroutine factory that performs the work.
+        Returns:
+            The result of fn(), shared with every concurrent caller.
+        """
+        # Shield so one caller disconnecting does not cancel the work for the others.
+        return await asyncio.shield(self.start(key, fn))
+
+    def start(self, key: Hashable, fn: Callable[[], Awaitable]) -> asyncio.Future:
+        """Start fn() for key unless it is already running, and return the shared task."""
+        task = self._inflight.get(key)
+        if task is None:
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda t: self._done(key, t))
+        return task
+
+    def _done(self, key: Hashable, task: asyncio.Future):
+        if self._inflight.get(key) is task:
+            del self._inflight[key]
+        # Mark the exception as retrieved even if every waiter went away.
+        if not task.cancelled():
+            task.exception()
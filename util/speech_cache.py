@@ -0,0 +1,496 @@
+import os
+import json
+import time
+import uuid
+import asyncio
+import hashlib
+import logging
+from collections import OrderedDict
+from dataclasses import dataclass
+from pathlib import Path
+from typing import AsyncIterator
+from util.audio_model import audio_model, stream_audio_model, ChunkWriter
+from util.singleflight import SingleFlight
+from util import metrics
+from util.tracing import span
+
+SPEECH_DIR = Path(os.getenv("SPEECH_DIR", str(Path(__file__).parent.parent / "speechfiles")))
+
+# Temp files older than this are leftovers from a crashed synthesis.
+STALE_TEMP_SECONDS = 3600
+READ_CHUNK_SIZE = 64 * 1024
+# Upstream chunks held for a streaming client before synthesis waits for it to catch up.
+STREAM_QUEUE_CHUNKS = 32
+# How often a request for text that is being synthesized checks the temp file for more audio.
+TAIL_POLL_SECONDS = 0.05
+# Shared log of files added and deleted by every worker (see SpeechCache.sync); replaced
+# at the next full rescan once it grows past JOURNAL_MAX_BYTES.
+JOURNAL_NAME = ".journal.jsonl"
+JOURNAL_MAX_BYTES = 16 * 1024 * 1024
+
+
+@dataclass
+class SpeechEntry:
+    path: Path
+    size: int
+    created: float
+    last_access: float
+
+
+class SpeechCache:
+    """
+    Content-addressed cache of synthesized speech under speechfiles/.
+    Files are named after a hash of (model, voice, instructions, text), so the same
+    sentence read with the same voice and accent is synthesized once and reused.
+
+    The in-memory index holds every MP3 in the directory in least-recently-used order
+    with its size. Every worker appends the files it adds and deletes to a journal in the
+    same directory, and the janitor replays the other workers' entries before each sweep,
+    so their files count against the budget too without rescanning the directory.
+    """
+
+    def __init__(self, directory: Path = SPEECH_DIR):
+        self.directory = Path(directory)
+        self._index: OrderedDict[str, SpeechEntry] = OrderedDict()
+        self._loaded = False
+        self._load_lock = asyncio.Lock()
+        self._flight = SingleFlight()
+        self._writing: dict[str, Path] = {}  # key -> temp file being synthesized
+        self._orphans: list[Path] = []
+        self._journal_at = (None, 0)  # (inode of the journal, bytes read)
+        self._journal_pending: list[dict] = []
+        self._journal_flush: asyncio.Task | None = None
+        self.total_bytes = 0
+
+    @staticmethod
+    def key(model: str, voice: str, instructions: str, text: str) -> str:
+        digest = hashlib.sha256()
+        for part in (model, voice, instructions, text):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def path_for(self, key: str) -> Path:
+        return self.directory / f"tts_{key}.mp3"
+
+    @property
+    def journal_path(self) -> Path:
+        return self.directory / JOURNAL_NAME
+
+    def scan(self) -> tuple[list[SpeechEntry], list[Path], float]:
+        """
+        Stat every file in the directory. Returns the MP3s, temp files left behind by a
+        crashed synthesis, and when the scan started.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        now = time.time()
+        found, orphans = [], []
+        with os.scandir(self.directory) as entries:
+            for entry in entries:
+                name = entry.name
+                try:
+                    stat = entry.stat()
+                except FileNotFoundError:
+                    continue
+                if name.endswith(".mp3"):
+                    found.append(SpeechEntry(Path(entry.path), stat.st_size, stat.st_mtime, stat.st_atime))
+                elif name.endswith(".tmp") and now - stat.st_mtime > STALE_TEMP_SECONDS:
+                    orphans.append(Path(entry.path))
+        return found, orphans, now
+
+    async def load(self):
+        """Build the in-memory index from the files already on disk (once per process, in a worker thread)."""
+        if self._loaded:
+            return
+        async with self._load_lock:
+            if self._loaded:
+                return
+            found, orphans, scanned_at, self._journal_at = await asyncio.to_thread(self._rescan)
+            self.reconcile(found, orphans, scanned_at)
+            self._loaded = True
+        logging.info(f"Speech cache loaded {len(self._index)} files ({self.total_bytes} bytes) from {self.directory}")
+
+    def _rescan(self) -> tuple[list[SpeechEntry], list[Path], float, tuple]:
+        """
+        scan(), plus where the journal ends. The position is taken before the scan, so entries
+        appended while it runs are replayed afterwards. An oversized journal is removed first;
+        the other workers notice it was replaced and rescan too.
+        """
+        self.directory.mkdir(parents=True, exist_ok=True)
+        try:
+            if self.journal_path.stat().st_size > JOURNAL_MAX_BYTES:
+                self.journal_path.unlink()
+        except FileNotFoundError:
+            pass
+        try:
+            stat = self.journal_path.stat()
+            journal_at = (stat.st_ino, stat.st_size)
+        except FileNotFoundError:
+            journal_at = (None, 0)
+        return (*self.scan(), journal_at)
+
+    def reconcile(self, found: list[SpeechEntry], orphans: list[Path], scanned_at: float):
+        """
+        Replace the index with the result of scan(). Used at startup and by the janitor's
+        occasional safety rescan, which catches files changed outside the cache (manual
+        cleanup, a lost journal). A file's last use is the later of its atime and the last
+        time this process handed it out.
+        """
+        names = set()
+        for entry in found:
+            names.add(entry.path.name)
+            known = self._index.get(entry.path.name)
+            if known is not None:
+                entry.last_access = max(entry.last_access, known.last_access)
+        # Files this process committed while the scan was running.
+        found.extend(entry for name, entry in self._index.items() if name not in names and entry.created >= scanned_at)
+        self._index = OrderedDict()
+        self.total_bytes = 0
+        for entry in sorted(found, key=lambda e: e.last_access):
+            self._add(entry)
+        known_orphans = set(self._orphans)
+        self._orphans.extend(path for path in orphans if path not in known_orphans)
+
+    def _read_journal(self, inode, position: int) -> tuple[list[dict], tuple, bool]:
+        """
+        Complete journal lines from position on. The last value is True when the journal was
+        replaced or removed since position was taken, in which case the caller must rescan.
+        """
+        events = []
+        try:
+            with open(self.journal_path, "rb") as f:
+                stat = os.fstat(f.fileno())
+                if inode is not None and (stat.st_ino != inode or stat.st_size < position):
+                    return events, (stat.st_ino, 0), True
+                f.seek(position)
+                data = f.read()
+        except FileNotFoundError:
+            return events, (None, 0), inode is not None
+        complete = data.rfind(b"\n") + 1
+        for line in data[:complete].splitlines():
+            try:
+                events.append(json.loads(line))
+            except ValueError:
+                continue
+        return events, (stat.st_ino, position + complete), False
+
+    def _replay(self, events: list[dict]):
+        for event in events:
+            name = event.get("name")
+            if event.get("op") == "add" and name not in self._index:
+                created = event.get("created", 0)
+                self._add(SpeechEntry(self.directory / name, event.get("size", 0), created, created))
+            elif event.get("op") == "del":
+                self._forget(name)
+
+    async def sync(self, full: bool = False) -> bool:
+        """
+        Bring the index up to date with the other workers: replay their journal entries, or
+        rescan the whole directory when full is set or the journal was replaced. Both run in
+        a worker thread. Returns whether the directory was rescanned.
+        """
+        if not self._loaded:
+            await self.load()
+            return True
+        if not full:
+            events, journal_at, replaced = await asyncio.to_thread(self._read_journal, *self._journal_at)
+            if not replaced and journal_at[1] <= JOURNAL_MAX_BYTES:
+                self._journal_at = journal_at
+                self._replay(events)
+                return False
+        found, orphans, scanned_at, self._journal_at = await asyncio.to_thread(self._rescan)
+        self.reconcile(found, orphans, scanned_at)
+        return True
+
+    def journal(self, op: str, entry: SpeechEntry):
+        """Record that this worker added ("add") or deleted ("del") a file; written in the background."""
+        event = {"op": op, "name": entry.path.name}
+        if op == "add":
+            event.update(size=entry.size, created=entry.created)
+        self._journal_pending.append(event)
+        if self._journal_flush is None or self._journal_flush.done():
+            self._journal_flush = asyncio.get_running_loop().create_task(self._write_journal())
+
+    async def flush_journal(self):
+        """Wait until everything journaled so far is written."""
+        while self._journal_flush is not None and not self._journal_flush.done():
+            await asyncio.shield(self._journal_flush)
+
+    async def _write_journal(self):
+        while self._journal_pending:
+            events, self._journal_pending = self._journal_pending, []
+            try:
+                await asyncio.to_thread(self._append_journal, events)
+            except OSError as e:
+                logging.error(f"Speech cache journal write failed: {e}")
+
+    def _append_journal(self, events: list[dict]):
+        # One write with O_APPEND, so lines from several workers do not interleave.
+        data = "".join(json.dumps(event) + "\n" for event in events)
+        with open(self.journal_path, "ab") as f:
+            f.write(data.encode("utf-8"))
+
+    def _add(self, entry: SpeechEntry):
+        name = entry.path.name
+        old = self._index.pop(name, None)
+        if old is not None:
+            self.total_bytes -= old.size
+        self._index[name] = entry
+        self.total_bytes += entry.size
+
+    def _forget(self, name: str) -> SpeechEntry | None:
+        entry = self._index.pop(name, None)
+        if entry is not None:
+            self.total_bytes -= entry.size
+        return entry
+
+    async def lookup(self, key: str) -> Path | None:
+        """
+        Return the cached file for key, or None on a miss. The file system is only touched
+        from a worker thread: on a hit to record the access (which also finds files removed
+        behind our back), on an index miss to look for a file another worker just wrote.
+        """
+        await self.load()
+        path = self.path_for(key)
+        entry = self._index.get(path.name)
+        if entry is None:
+            # Another worker process may have written it since the janitor last replayed the journal.
+            stat = await asyncio.to_thread(_stat, path)
+            if stat is None:
+                return None
+            entry = self._index.get(path.name) or SpeechEntry(path, stat.st_size, stat.st_mtime, stat.st_atime)
+            self._add(entry)
+        self.touch(entry)
+        if not await asyncio.to_thread(_utime, path, (entry.last_access, entry.created)):
+            # Removed behind our back (manual cleanup); forget it.
+            self._forget(path.name)
+            return None
+        return path
+
+    def touch(self, entry: SpeechEntry):
+        """
+        Mark a file as just used, moving it to the most-recently-used end. lookup() also
+        writes the access time to the file itself, so janitors in other worker processes
+        can see it before deleting the file.
+        """
+        entry.last_access = time.time()
+        if entry.path.name in self._index:
+            self._index.move_to_end(entry.path.name)
+
+    async def get_or_create(self, model: str, voice: str, instructions: str, text: str) -> Path:
+        """
+        Return the path of the MP3 for these synthesis parameters, synthesizing it on a miss.
+        Concurrent misses for the same key share a single upstream synthesis.
+        """
+        key = self.key(model, voice, instructions, text)
+        path = await self.lookup(key)
+        metrics.cache_requests.labels("speech", "miss" if path is None else "hit").inc()
+        if path is not None:
+            return path
+        return await self._flight.do(key, lambda: self._synthesize(key, model, voice, instructions, text))
+
+    async def stream(self, model: str, voice: str, instructions: str, text: str) -> AsyncIterator[bytes]:
+        """
+        Yield the MP3 for these synthesis parameters chunk by chunk.
+        Hits are read from disk. On a miss the upstream audio is forwarded as it arrives
+        and written to the cache at the same time. A slow client slows the synthesis down
+        instead of piling the file up in memory; if the client disconnects the write keeps
+        going, so the next request for the same text is a hit. Requests for text that is
+        already being synthesized read the temp file as it grows.
+        """
+        key = self.key(model, voice, instructions, text)
+        path = await self.lookup(key)
+        metrics.cache_requests.labels("speech", "miss" if path is None else "hit").inc()
+        if path is None and self._flight.inflight(key):
+            task = self._flight.start(key, lambda: self._synthesize(key, model, voice, instructions, text))
+            async for chunk in self._tail(key, task):
+                yield chunk
+            return
+        if path is not None:
+            async for chunk in _read_chunks(path):
+                yield chunk
+            return
+
+        queue: asyncio.Queue = asyncio.Queue(maxsize=STREAM_QUEUE_CHUNKS)
+        listening = [True]
+        task = self._flight.start(
+            key, lambda: self._synthesize_streaming(key, model, voice, instructions, text, queue, listening)
+        )
+        try:
+            while (chunk := await queue.get()) is not None:
+                yield chunk
+        finally:
+            # Client gone (or done): stop forwarding and unblock a synthesis waiting on a full queue.
+            listening[0] = False
+            while not queue.empty():
+                queue.get_nowait()
+        # Surface upstream failures to the caller.
+        await asyncio.shield(task)
+
+    async def _tail(self, key: str, task: asyncio.Future) -> AsyncIterator[bytes]:
+        """Read the temp file another request is synthesizing as it is written, then surface its outcome."""
+        reads = metrics.file_io_duration.labels("speech.read")
+        file = None
+        try:
+            while True:
+                # Checked before reading: once the writer has finished, an empty read means the end.
+                finished = task.done()
+                if file is None:
+                    tmp_path = self._writing.get(key)
+                    if tmp_path is not None:
+                        try:
+                            file = await asyncio.to_thread(open, tmp_path, "rb")
+                        except FileNotFoundError:
+                            pass
+                    if file is None:
+                        if finished:
+                            break
+                        await asyncio.sleep(TAIL_POLL_SECONDS)
+                        continue
+                with span("mp3.read", reads):
+                    chunk = await asyncio.to_thread(file.read, READ_CHUNK_SIZE)
+                if chunk:
+                    yield chunk
+                elif finished:
+                    break
+                else:
+                    await asyncio.sleep(TAIL_POLL_SECONDS)
+        finally:
+            if file is not None:
+                file.close()
+        path = await asyncio.shield(task)
+        if file is None:
+            # Finished before the temp file could be opened; it is in the cache now.
+            async for chunk in _read_chunks(path):
+                yield chunk
+
+    async def _synthesize_streaming(self, key: str, model: str, voice: str, instructions: str, text: str,
+                                    queue: asyncio.Queue, listening: list[bool]) -> Path:
+        tmp_path = self.temp_path(key)
+        self._writing[key] = tmp_path
+        try:
+            async with ChunkWriter(tmp_path) as writer:
+                async for chunk in stream_audio_model(model=model, voice=voice, instructions=instructions, input=text):
+                    # Forward first; the write is batched and runs off the event loop.
+                    if listening[0]:
+                        await queue.put(chunk)
+                    await writer.write(chunk)
+            return await self.commit(key, tmp_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        finally:
+            self._writing.pop(key, None)
+            if listening[0]:
+                await queue.put(None)
+
+    async def _synthesize(self, key: str, model: str, voice: str, instructions: str, text: str) -> Path:
+        final_path = self.path_for(key)
+        tmp_path = self.temp_path(key)
+        self._writing[key] = tmp_path
+        try:
+            await audio_model(
+                model=model,
+                voice=voice,
+                instructions=instructions,
+                input=text,
+                speech_file_path=tmp_path
+            )
+            await self.commit(key, tmp_path)
+        except BaseException:
+            tmp_path.unlink(missing_ok=True)
+            raise
+        finally:
+            self._writing.pop(key, None)
+        return final_path
+
+    def temp_path(self, key: str) -> Path:
+        """Unique scratch file in the cache directory, so the final rename stays atomic."""
+        return self.directory / f".{key}.{uuid.uuid4().hex}.tmp"
+
+    async def commit(self, key: str, tmp_path: Path) -> Path:
+        """Atomically move a fully written temp file into place and index it."""
+        final_path = self.path_for(key)
+        stat = await asyncio.to_thread(_replace, tmp_path, final_path)
+        entry = SpeechEntry(final_path, stat.st_size, stat.st_mtime, time.time())
+        self._add(entry)
+        self.journal("add", entry)
+        return final_path
+
+    def eviction_candidates(self, max_bytes: int, max_age: float, min_idle: float, purge: bool = False) -> list[SpeechEntry]:
+        """
+        Pick files to evict and drop them from the index.
+        Files older than max_age go first, then least-recently-used files until the
+        directory fits in max_bytes. Files used within the last min_idle seconds are
+        never picked, so clients still downloading them are not cut off.
+        With purge=True every idle file is picked.
+        """
+        now = time.time()
+        victims = []
+        for name, entry in list(self._index.items()):
+            if now - entry.last_access < min_idle:
+                continue
+            if purge or now - entry.created > max_age:
+                victims.append(self._forget(name))
+        for name, entry in list(self._index.items()):
+            if self.total_bytes <= max_bytes:
+                break
+            if now - entry.last_access < min_idle:
+                # LRU order: everything after this was used even more recently.
+                break
+            victims.append(self._forget(name))
+        return victims
+
+    def restore(self, entries: list[SpeechEntry]):
+        """Put back entries the janitor picked but found were recently used by another worker."""
+        for entry in entries:
+            if entry.path.name not in self._index:
+                self._add(entry)
+                self._index.move_to_end(entry.path.name)
+
+    def take_orphans(self) -> list[Path]:
+        orphans, self._orphans = self._orphans, []
+        return orphans
+
+    def __len__(self) -> int:
+        return len(self._index)
+
+
+def _stat(path: Path) -> os.stat_result | None:
+    try:
+        return path.stat()
+    except FileNotFoundError:
+        return None
+
+
+def _utime(path: Path, times: tuple[float, float]) -> bool:
+    """Set a file's access time; False if the file is gone."""
+    try:
+        os.utime(path, times)
+    except FileNotFoundError:
+        return False
+    except OSError:
+        pass
+    return True
+
+
+def _replace(tmp_path: Path, final_path: Path) -> os.stat_result:
+    os.replace(tmp_path, final_path)
+    return final_path.stat()
+
+
+async def _read_chunks(path: Path) -> AsyncIterator[bytes]:
+    reads = metrics.file_io_duration.labels("speech.read")
+    file = await asyncio.to_thread(open, path, "rb")
+    try:
+        while True:
+            with span("mp3.read", reads):
+                chunk = await asyncio.to_thread(file.read, READ_CHUNK_SIZE)
+            if not chunk:
+                break
+            yield chunk
+    finally:
+        file.close()
+
+
+speech_cache = SpeechCache()
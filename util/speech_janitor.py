@@ -0,0 +1,156 @@
+import os
+import time
+import asyncio
+import logging
+from pathlib import Path
+from util.speech_cache import SpeechCache, SpeechEntry, speech_cache
+
+# Defaults: 2 GiB on disk, files live a week, sweep every 5 minutes and never
+# delete anything that was handed out in the last 10 minutes.
+SPEECH_CACHE_MAX_BYTES = int(os.getenv("SPEECH_CACHE_MAX_BYTES", str(2 * 1024 ** 3)))
+SPEECH_CACHE_MAX_AGE = float(os.getenv("SPEECH_CACHE_MAX_AGE", str(7 * 24 * 3600)))
+SPEECH_CACHE_MIN_IDLE = float(os.getenv("SPEECH_CACHE_MIN_IDLE", "600"))
+SPEECH_JANITOR_INTERVAL = float(os.getenv("SPEECH_JANITOR_INTERVAL", "300"))
+# Sweeps replay the shared journal; the whole directory is only rescanned this often, as a safety net.
+SPEECH_CACHE_RESCAN_SECONDS = float(os.getenv("SPEECH_CACHE_RESCAN_SECONDS", str(6 * 3600)))
+
+
+def _remove_files(paths: list[Path]) -> int:
+    removed = 0
+    for path in paths:
+        try:
+            os.remove(path)
+            removed += 1
+        except FileNotFoundError:
+            pass
+        except OSError as e:
+            logging.error(f"Could not remove speech file {path}: {e}")
+    return removed
+
+
+def _recently_used(entries: list[SpeechEntry], min_idle: float) -> list[SpeechEntry]:
+    """
+    Entries whose file was accessed within min_idle seconds according to the file's atime.
+    With several workers, another process may have handed the file out after our index
+    last saw it; SpeechCache.lookup records that access on the file.
+    """
+    now = time.time()
+    used = []
+    for entry in entries:
+        try:
+            stat = entry.path.stat()
+        except FileNotFoundError:
+            continue
+        if now - stat.st_atime < min_idle:
+            entry.last_access = stat.st_atime
+            used.append(entry)
+    return used
+
+
+class SpeechJanitor:
+    """
+    Background task that keeps speechfiles/ within a size and age budget.
+    Each sweep first replays the journal of files other worker processes added and
+    deleted (a full rescan runs only every rescan_interval), so the whole directory
+    counts against the budget; eviction then works on the cache's index and the
+    deletes run off the event loop and are journaled in turn.
+    """
+
+    def __init__(self, cache: SpeechCache, max_bytes: int = SPEECH_CACHE_MAX_BYTES,
+                 max_age: float = SPEECH_CACHE_MAX_AGE, min_idle: float = SPEECH_CACHE_MIN_IDLE,
+                 interval: float = SPEECH_JANITOR_INTERVAL, rescan_interval: float = SPEECH_CACHE_RESCAN_SECONDS):
+        self.cache = cache
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.min_idle = min_idle
+        self.interval = interval
+        self.rescan_interval = rescan_interval
+        self._rescanned = time.monotonic()
+        self._wakeup = asyncio.Event()
+        self._purge = False
+        self._task: asyncio.Task | None = None
+        self.stats = {
+            "runs": 0,
+            "rescans": 0,
+            "evicted_files": 0,
+            "evicted_bytes": 0,
+            "last_run": None,
+            "last_run_seconds": None,
+            "last_evicted_files": 0,
+        }
+
+    async def run_once(self, purge: bool = False) -> dict:
+        started = time.monotonic()
+        if await self.cache.sync(full=time.monotonic() - self._rescanned >= self.rescan_interval):
+            self._rescanned = time.monotonic()
+            self.stats["rescans"] += 1
+        victims = self.cache.eviction_candidates(self.max_bytes, self.max_age, self.min_idle, purge=purge)
+        if victims and self.min_idle > 0:
+            used = await asyncio.to_thread(_recently_used, victims, self.min_idle)
+            if used:
+                self.cache.restore(used)
+                kept = {entry.path.name for entry in used}
+                victims = [entry for entry in victims if entry.path.name not in kept]
+        paths = [entry.path for entry in victims] + self.cache.take_orphans()
+        if paths:
+            await asyncio.to_thread(_remove_files, paths)
+        for entry in victims:
+            self.cache.journal("del", entry)
+        await self.cache.flush_journal()
+        evicted_bytes = sum(entry.size for entry in victims)
+        self.stats["runs"] += 1
+        self.stats["evicted_files"] += len(victims)
+        self.stats["evicted_bytes"] += evicted_bytes
+        self.stats["last_run"] = time.time()
+        self.stats["last_run_seconds"] = round(time.monotonic() - started, 4)
+        self.stats["last_evicted_files"] = len(victims)
+        if victims:
+            logging.info(f"Speech janitor evicted {len(victims)} files ({evicted_bytes} bytes)")
+        return self.snapshot()
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "files": len(self.cache),
+            "total_bytes": self.cache.total_bytes,
+            "max_bytes": self.max_bytes,
+            "max_age": self.max_age,
+        }
+
+    def trigger(self, purge: bool = False):
+        """Ask the background loop to sweep now instead of waiting for the next interval."""
+        self._purge = self._purge or purge
+        self._wakeup.set()
+
+    async def _loop(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=self.interval)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            purge, self._purge = self._purge, False
+            try:
+                await self.run_once(purge=purge)
+            except Exception as e:
+                logging.error(f"Speech janitor run failed: {e}")
+
+    async def start(self):
+        if self._task is None:
+            # Build the index off the event loop; the first sweep then runs right away.
+            await self.cache.sync()
+            self._rescanned = time.monotonic()
+            self._task = asyncio.create_task(self._loop())
+            self.trigger()
+
+    async def stop(self):
+        if self._task is not None:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+
+
+speech_janitor = SpeechJanitor(speech_cache)
@@ -0,0 +1,55 @@
+import os
+import json
+import asyncio
+from typing import AsyncIterator
+
+SSE_HEARTBEAT_INTERVAL = float(os.getenv("SSE_HEARTBEAT_INTERVAL", "15"))
+
+# SSE comment line: ignored by EventSource and by our clients (they only parse "data: " lines),
+# but keeps proxies and load balancers from closing an idle stream.
+HEARTBEAT = ": ping\n\n"
+
+SSE_HEADERS = {
+    "Cache-Control": "no-cache",
+    "Connection": "keep-alive",
+    "X-Accel-Buffering": "no",
+}
+
+
+def sse_event(payload: dict) -> str:
+    """Format a payload as one Server-Sent Events data frame."""
+    return f"data: {json.dumps(payload, ensure_ascii=False)}\n\n"
+
+
+async def with_heartbeat(frames: AsyncIterator[str], interval: float = SSE_HEARTBEAT_INTERVAL) -> AsyncIterator[str]:
+    """
+    Pass SSE frames through, inserting a heartbeat whenever the source is quiet for `interval` seconds.
+    Args:
+        frames: Async iterator of already formatted SSE frames.
+        interval: Seconds of silence before a heartbeat is sent.
+    """
+    iterator = frames.__aiter__()
+    pending = None
+    try:
+        while True:
+            if pending is None:
+                pending = asyncio.ensure_future(iterator.__anext__())
+            done, _ = await asyncio.wait({pending}, timeout=interval)
+            if not done:
+                yield HEARTBEAT
+                continue
+            task, pending = pending, None
+            try:
+                frame = task.result()
+            except StopAsyncIteration:
+                break
+            yield frame
+    finally:
+        if pending is not None:
+            pending.cancel()
+            try:
+                await pending
+            except (asyncio.CancelledError, StopAsyncIteration):
+                pass
+        if hasattr(iterator, "aclose"):
+            await iterator.aclose()
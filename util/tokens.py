@@ -0,0 +1,36 @@
+import math
+import asyncio
+import logging
+from functools import lru_cache
+
+# gpt-4.1 / gpt-4o / gpt-5 family tokenizer.
+TOKEN_ENCODING = "o200k_base"
+
+_encoding = None
+
+
+def _get_encoding():
+    global _encoding
+    if _encoding is None:
+        try:
+            import tiktoken
+            _encoding = tiktoken.get_encoding(TOKEN_ENCODING)
+        except Exception as e:
+            # The BPE file is downloaded on first use; without it, estimate instead of failing the request.
+            logging.warning(f"tiktoken encoding unavailable ({e}); estimating tokens from length")
+            _encoding = False
+    return _encoding
+
+
+async def preload_encoding():
+    """Load (on a cold cache, download) the BPE file in a worker thread; call it from router lifespans."""
+    await asyncio.to_thread(_get_encoding)
+
+
+@lru_cache(maxsize=8192)
+def count_tokens(text: str) -> int:
+    """Token count of text, memoized so repeated text is only encoded once."""
+    encoding = _get_encoding()
+    if not encoding:
+        return math.ceil(len(text) / 4)
+    return len(encoding.encode(text, disallowed_special=()))
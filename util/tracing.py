@@ -0,0 +1,199 @@
+import os
+import re
+import json
+import time
+import uuid
+import logging
+from collections import deque
+from contextvars import ContextVar
+
+logger = logging.getLogger(__name__)
+
+# Requests slower than this (seconds, streams until their last byte) are logged with their span breakdown.
+TRACE_SLOW_SECONDS = float(os.getenv("TRACE_SLOW_SECONDS", "2"))
+# How many slow traces GET /admin/traces/slow keeps.
+TRACE_SLOW_KEEP = int(os.getenv("TRACE_SLOW_KEEP", "100"))
+# Individual spans kept per request for the timeline; totals per phase are always complete.
+TRACE_MAX_SPANS = 64
+
+TRACE_HEADER = "x-trace-id"
+LOG_FORMAT = "%(asctime)s %(levelname)s [%(trace_id)s] %(name)s: %(message)s"
+
+_VALID_TRACE_ID = re.compile(r"[A-Za-z0-9._-]{8,64}")
+_current: ContextVar["Trace | None"] = ContextVar("trace", default=None)
+
+slow_traces: deque = deque(maxlen=TRACE_SLOW_KEEP)
+
+
+class Trace:
+    """
+    Timing of one request, split into named phases (spans).
+    Spans with the same name are summed, so a phase that runs many times
+    (one MP3 write per chunk, several TTS calls in parallel) shows up once with
+    its count, total and longest run. Spans started in tasks spawned by the
+    request land in the same trace, because tasks copy the context.
+    """
+    __slots__ = ("trace_id", "method", "path", "started", "phases", "spans", "duration", "status")
+
+    def __init__(self, trace_id: str, method: str = "", path: str = ""):
+        self.trace_id = trace_id
+        self.method = method
+        self.path = path
+        self.started = time.perf_counter()
+        self.phases: dict[str, list] = {}
+        self.spans: list[tuple] = []
+        self.duration = None
+        self.status = None
+
+    def add(self, name: str, start: float, duration: float):
+        phase = self.phases.get(name)
+        if phase is None:
+            self.phases[name] = [1, duration, duration]
+        else:
+            phase[0] += 1
+            phase[1] += duration
+            phase[2] = max(phase[2], duration)
+        if len(self.spans) < TRACE_MAX_SPANS:
+            self.spans.append((name, start - self.started, duration))
+
+    def breakdown(self) -> dict:
+        """Per phase: count, total_ms and max_ms, longest total first."""
+        return {
+            name: {"count": count, "total_ms": round(total * 1000, 2), "max_ms": round(longest * 1000, 2)}
+            for name, (count, total, longest) in sorted(self.phases.items(), key=lambda item: -item[1][1])
+        }
+
+    def server_timing(self) -> str:
+        """Phase totals as a Server-Timing header value (shown in browser dev tools)."""
+        return ", ".join(f"{name};dur={total * 1000:.1f}" for name, (_, total, _) in self.phases.items())
+
+    def to_dict(self) -> dict:
+        return {
+            "trace_id": self.trace_id,
+            "method": self.method,
+            "path": self.path,
+            "status": self.status,
+            "duration_ms": round(self.duration * 1000, 2) if self.duration is not None else None,
+            "phases": self.breakdown(),
+            "spans": [
+                {"name": name, "start_ms": round(start * 1000, 2), "duration_ms": round(duration * 1000, 2)}
+                for name, start, duration in self.spans
+            ],
+        }
+
+    def finish(self, status: int):
+        self.duration = time.perf_counter() - self.started
+        self.status = status
+        if self.duration >= TRACE_SLOW_SECONDS:
+            slow_traces.append(self.to_dict())
+            logger.warning(
+                f"Slow request {self.method} {self.path} -> {status} in {self.duration:.2f}s: "
+                + json.dumps(self.breakdown())
+            )
+
+
+class span:
+    """
+    Time a phase of the current request:
+
+        with span("prompt.build"):
+            ...
+
+    Outside a request this costs one context variable lookup. `observe` is an
+    optional histogram child (see util.metrics) that gets the duration as well.
+    """
+    __slots__ = ("name", "observe", "trace", "started")
+
+    def __init__(self, name: str, observe=None):
+        self.name = name
+        self.observe = observe
+
+    def __enter__(self):
+        self.trace = _current.get()
+        if self.trace is not None or self.observe is not None:
+            self.started = time.perf_counter()
+        return self
+
+    def __exit__(self, exc_type, exc, traceback):
+        if self.trace is None and self.observe is None:
+            return False
+        duration = time.perf_counter() - self.started
+        if self.trace is not None:
+            self.trace.add(self.name, self.started, duration)
+        if self.observe is not None:
+            self.observe.observe(duration)
+        return False
+
+
+def current_trace() -> Trace | None:
+    return _current.get()
+
+
+def current_trace_id() -> str | None:
+    trace = _current.get()
+    return trace.trace_id if trace is not None else None
+
+
+def _incoming_trace_id(scope) -> str | None:
+    for name, value in scope.get("headers", ()):
+        if name == TRACE_HEADER.encode():
+            value = value.decode("latin-1")
+            return value if _VALID_TRACE_ID.fullmatch(value) else None
+    return None
+
+
+class TraceMiddleware:
+    """
+    Starts a Trace for every HTTP request. The id comes from the caller's X-Trace-Id
+    header when it looks valid, otherwise a new one is made; it is returned in
+    X-Trace-Id, with the phases finished so far in Server-Timing.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        trace = Trace(_incoming_trace_id(scope) or uuid.uuid4().hex[:16], scope["method"], scope["path"])
+        token = _current.set(trace)
+        status = 500
+
+        async def send_with_trace(message):
+            nonlocal status
+            if message["type"] == "http.response.start":
+                status = message["status"]
+                headers = list(message.get("headers", ()))
+                headers.append((TRACE_HEADER.encode(), trace.trace_id.encode()))
+                if trace.phases:
+                    headers.append((b"server-timing", trace.server_timing().encode()))
+                message = {**message, "headers": headers}
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_trace)
+        finally:
+            trace.finish(status)
+            _current.reset(token)
+
+
+def install_log_context():
+    """Give every log record a trace_id attribute ("-" outside a request) for LOG_FORMAT."""
+    factory = logging.getLogRecordFactory()
+    if getattr(factory, "adds_trace_id", False):
+        return
+
+    def record_factory(*args, **kwargs):
+        record = factory(*args, **kwargs)
+        trace = _current.get()
+        record.trace_id = trace.trace_id if trace is not None else "-"
+        return record
+
+    record_factory.adds_trace_id = True
+    logging.setLogRecordFactory(record_factory)
+
+
+def configure_logging(level: int = logging.INFO):
+    install_log_context()
+    logging.basicConfig(level=level, format=LOG_FORMAT)
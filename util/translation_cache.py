@@ -0,0 +1,203 @@
+import os
+import time
+import json
+import asyncio
+import hashlib
+import logging
+import sqlite3
+import threading
+import unicodedata
+from collections import OrderedDict
+from pathlib import Path
+from typing import Awaitable, Callable
+from util.singleflight import SingleFlight
+
+TRANSLATION_CACHE_SIZE = int(os.getenv("TRANSLATION_CACHE_SIZE", "20000"))
+TRANSLATION_CACHE_TTL = float(os.getenv("TRANSLATION_CACHE_TTL", str(30 * 24 * 3600)))
+# Set TRANSLATION_CACHE_DB to an empty string to keep the cache in memory only.
+TRANSLATION_CACHE_DB = os.getenv("TRANSLATION_CACHE_DB", str(Path(__file__).parent.parent / "translation_cache.db"))
+
+
+def normalize_text(text: str) -> str:
+    """Unicode NFC with surrounding and repeated whitespace collapsed; case is kept since it can change a translation."""
+    return " ".join(unicodedata.normalize("NFC", text).split())
+
+
+def normalize_language(language: str) -> str:
+    return normalize_text(language).casefold()
+
+
+class TranslationCache:
+    """
+    Translations keyed by (model, instructions, normalized text).
+    An in-memory LRU with a TTL answers repeated words and phrases without calling the
+    model; concurrent misses for the same key share one upstream call. An optional
+    SQLite file (WAL mode, shared by every worker on the host) keeps entries across
+    restarts. The instructions are part of the key, so editing the prompt starts fresh.
+    """
+
+    def __init__(self, max_size: int = TRANSLATION_CACHE_SIZE, ttl: float = TRANSLATION_CACHE_TTL,
+                 path: str | None = TRANSLATION_CACHE_DB):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.path = path or None
+        self._entries: OrderedDict[str, tuple[dict, float]] = OrderedDict()
+        self._flight = SingleFlight()
+        self._lock = threading.Lock()
+        self._conn: sqlite3.Connection | None = None
+        self.stats = {"hits": 0, "disk_hits": 0, "misses": 0, "coalesced": 0, "stored": 0, "errors": 0}
+
+    @staticmethod
+    def key(model: str, instructions: str, text: str) -> str:
+        digest = hashlib.sha256()
+        for part in (model, instructions, text):
+            digest.update(part.encode("utf-8"))
+            digest.update(b"\0")
+        return digest.hexdigest()
+
+    def _db(self) -> sqlite3.Connection:
+        if self._conn is None:
+            self._conn = sqlite3.connect(self.path, check_same_thread=False, timeout=5, isolation_level=None)
+            self._conn.execute("PRAGMA journal_mode=WAL")
+            self._conn.execute("PRAGMA synchronous=NORMAL")
+            self._conn.execute(
+                "CREATE TABLE IF NOT EXISTS translations (key TEXT PRIMARY KEY, expires_at REAL NOT NULL, value TEXT NOT NULL)"
+            )
+        return self._conn
+
+    def _load(self, key: str) -> tuple[dict, float] | None:
+        with self._lock:
+            row = self._db().execute("SELECT value, expires_at FROM translations WHERE key = ?", (key,)).fetchone()
+        if row is None or row[1] <= time.time():
+            return None
+        return json.loads(row[0]), row[1]
+
+    def _load_many(self, keys: list[str]) -> dict[str, tuple[dict, float]]:
+        found = {}
+        for key in keys:
+            entry = self._load(key)
+            if entry is not None:
+                found[key] = entry
+        return found
+
+    def _save(self, key: str, value: dict, expires_at: float):
+        with self._lock:
+            self._db().execute(
+                "INSERT OR REPLACE INTO translations VALUES (?, ?, ?)",
+                (key, expires_at, json.dumps(value, ensure_ascii=False)),
+            )
+
+    def prune(self) -> int:
+        """Delete expired rows from the SQLite file; returns how many were removed."""
+        if self.path is None:
+            return 0
+        with self._lock:
+            return self._db().execute("DELETE FROM translations WHERE expires_at <= ?", (time.time(),)).rowcount
+
+    def _get(self, key: str) -> dict | None:
+        entry = self._entries.get(key)
+        if entry is None:
+            return None
+        if entry[1] <= time.time():
+            del self._entries[key]
+            return None
+        self._entries.move_to_end(key)
+        return entry[0]
+
+    def _put(self, key: str, value: dict, expires_at: float):
+        self._entries[key] = (value, expires_at)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    async def get_or_create(self, key: str, translate: Callable[[], Awaitable[dict]], count: bool = True) -> dict:
+        """
+        Return the cached translation for key, or run translate() once and cache its result.
+        Args:
+            key: Cache key from TranslationCache.key.
+            translate: Zero-argument coroutine factory returning {"translation": ..., "info": ...}.
+            count: False when the caller already counted this lookup (lookup_many), so it is not counted twice.
+        Returns:
+            dict: The translation result (shared with other callers; do not mutate).
+        """
+        value = self._get(key)
+        if value is not None:
+            self.stats["hits"] += count
+            return value
+        if self._flight.inflight(key):
+            self.stats["coalesced"] += count
+        return await self._flight.do(key, lambda: self._fill(key, translate, count))
+
+    async def _read_disk(self, keys: list[str], count: bool = True) -> dict[str, dict]:
+        if self.path is None or not keys:
+            return {}
+        try:
+            stored = await asyncio.to_thread(self._load_many, keys)
+        except sqlite3.Error as e:
+            self.stats["errors"] += 1
+            logging.error(f"Translation cache read failed: {e}")
+            return {}
+        for key, entry in stored.items():
+            self._put(key, *entry)
+        self.stats["disk_hits"] += len(stored) * count
+        return {key: entry[0] for key, entry in stored.items()}
+
+    async def _fill(self, key: str, translate: Callable[[], Awaitable[dict]], count: bool = True) -> dict:
+        stored = await self._read_disk([key], count)
+        if key in stored:
+            return stored[key]
+        self.stats["misses"] += count
+        value = await translate()
+        await self.put(key, value)
+        return value
+
+    async def lookup_many(self, keys: list[str]) -> dict[str, dict]:
+        """
+        Cached translations for the given keys, from memory or the SQLite file.
+        Keys without an entry are counted as misses and left out of the result.
+        """
+        found = {}
+        for key in keys:
+            value = self._get(key)
+            if value is not None:
+                found[key] = value
+        self.stats["hits"] += len(found)
+        found.update(await self._read_disk([key for key in keys if key not in found]))
+        self.stats["misses"] += len(keys) - len(found)
+        return found
+
+    async def put(self, key: str, value: dict):
+        """Cache a translation result. Parsing failures are returned to the caller but never cached."""
+        if not value.get("translation"):
+            return
+        expires_at = time.time() + self.ttl
+        self._put(key, value, expires_at)
+        self.stats["stored"] += 1
+        if self.path is not None:
+            try:
+                await asyncio.to_thread(self._save, key, value, expires_at)
+            except sqlite3.Error as e:
+                self.stats["errors"] += 1
+                logging.error(f"Translation cache write failed: {e}")
+
+    def snapshot(self) -> dict:
+        # Coalesced requests count as hits: they did not cost an upstream call either.
+        hits = self.stats["hits"] + self.stats["disk_hits"] + self.stats["coalesced"]
+        lookups = hits + self.stats["misses"]
+        return {
+            **self.stats,
+            "hit_ratio": round(hits / lookups, 4) if lookups else None,
+            "entries": len(self._entries),
+            "max_size": self.max_size,
+            "ttl": self.ttl,
+            "db": self.path,
+        }
+
+    def close(self):
+        with self._lock:
+            if self._conn is not None:
+                self._conn.close()
+                self._conn = None
+
+
+translation_cache = TranslationCache()